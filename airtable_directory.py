@@ -0,0 +1,104 @@
+import logging
+from datetime import datetime, timezone
+import http_client
+
+logger = logging.getLogger(__name__)
+
+AIRTABLE_API_URL = "https://api.airtable.com/v0"
+
+# Airtable caps list responses at 100 records per page
+AIRTABLE_PAGE_SIZE = 100
+
+# Safety net in case the server keeps handing back an offset cursor
+MAX_PAGES = 1000
+
+
+class DirectoryFetchError(Exception):
+    """Raised when a complete directory snapshot could not be assembled"""
+
+
+def _fetch_all_pages(url, token, params, session, timeout):
+    """Return every record of a list query, following Airtable's offset cursor.
+
+    Callers pass the shared pooled http_client unless given a session, so a
+    full refresh reuses one keep-alive TCP+TLS connection for every page.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    params = dict(params, pageSize=AIRTABLE_PAGE_SIZE)
+    records = []
+
+    for page in range(1, MAX_PAGES + 1):
+        response = session.get(url, headers=headers, params=params, timeout=timeout)
+        if response.status_code != 200:
+            raise DirectoryFetchError(f"Airtable returned status {response.status_code} on page {page}")
+
+        body = response.json()
+        records.extend(body.get("records", []))
+
+        offset = body.get("offset")
+        if not offset:
+            return records, page
+
+        params["offset"] = offset
+
+    raise DirectoryFetchError(f"Gave up after {MAX_PAGES} pages without reaching the end of the table")
+
+
+def fetch_directory_snapshot(base_id, table_name, token, api_url=AIRTABLE_API_URL, session=None, timeout=10):
+    """Fetch every page of the directory table by following Airtable's offset cursor.
+
+    Returns a dict shaped like a single Airtable list response ({"records": [...]})
+    holding the full record set. Raises DirectoryFetchError if any page fails, so
+    callers never see a partial snapshot.
+    """
+    url = f"{api_url}/{base_id}/{table_name}"
+    records, pages = _fetch_all_pages(url, token, {}, session or http_client, timeout)
+    logger.info(f"Fetched {len(records)} directory records in {pages} page(s)")
+    return {"records": records}
+
+
+def modified_since_formula(since, modified_field=None):
+    """Airtable formula matching records modified after the given unix timestamp.
+
+    Uses the named last-modified field when the table has one, otherwise
+    Airtable's LAST_MODIFIED_TIME() over all fields.
+    """
+    timestamp = datetime.fromtimestamp(since, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    modified = f"{{{modified_field}}}" if modified_field else "LAST_MODIFIED_TIME()"
+    return f"IS_AFTER({modified}, DATETIME_PARSE('{timestamp}'))"
+
+
+def fetch_modified_records(base_id, table_name, token, since, modified_field=None,
+                           api_url=AIRTABLE_API_URL, session=None, timeout=10):
+    """Fetch only the records created or modified after `since` (a unix timestamp)"""
+    url = f"{api_url}/{base_id}/{table_name}"
+    params = {"filterByFormula": modified_since_formula(since, modified_field)}
+    records, pages = _fetch_all_pages(url, token, params, session or http_client, timeout)
+    logger.info(f"Fetched {len(records)} modified directory records in {pages} page(s)")
+    return records
+
+
+def fetch_record_ids(base_id, table_name, token, id_field="Title",
+                     api_url=AIRTABLE_API_URL, session=None, timeout=10):
+    """Fetch the ids of every record, asking for a single small field to keep pages cheap"""
+    url = f"{api_url}/{base_id}/{table_name}"
+    records, pages = _fetch_all_pages(url, token, {"fields[]": id_field}, session or http_client, timeout)
+    logger.info(f"Fetched {len(records)} directory record ids in {pages} page(s)")
+    return {record["id"] for record in records}
+
+
+def merge_records(records, changed, keep_ids=None):
+    """Merge changed records into a snapshot's records by id.
+
+    Changed records replace their old version in place and new ones are
+    appended. When keep_ids is given, records whose id is not in it (deleted
+    upstream) are dropped.
+    """
+    changed_by_id = {record["id"]: record for record in changed}
+    merged = []
+    for record in records:
+        if keep_ids is not None and record["id"] not in keep_ids:
+            continue
+        merged.append(changed_by_id.pop(record["id"], record))
+    merged.extend(changed_by_id.values())
+    return merged
@@ -2,8 +2,9 @@ import os
 import json
 import logging
 import requests
-import threading
+import http_client
 import time
+import concurrent.futures
 import base64
 import cloudinary
 import cloudinary.uploader
@@ -14,6 +15,16 @@ from dotenv import load_dotenv
 from morning_message import main
 from form_submit import form_submit, add_to_group
 from message_receive import message_receive
+from airtable_directory import (
+    fetch_directory_snapshot, fetch_modified_records, fetch_record_ids, merge_records, AIRTABLE_API_URL
+)
+from directory_cache import create_cache_backend
+from directory_index import DirectoryIndex
+from single_flight import SingleFlight
+from job_queue import JobQueue, JobWorkerPool, QueueFull
+from local_store import data_path, shared_path
+from message_dedup import SeenMessages
+import metrics
 from flask_cors import CORS
 
 # Load environment variables from .env file
@@ -40,16 +51,30 @@ else:
     logger = logging.getLogger(__name__)
     logger.warning("Cloudinary not configured - missing environment variables")
 
-# In-memory cache dictionary for directory data
-directory_cache = {
-    "data": None,
-    "last_updated": 0,
-    "updating": False,
-    "force_refresh": False  # New flag to indicate forced refresh
-}
+# Directory data cache shared by all gunicorn workers ("sqlite" under /dev/shm),
+# or a per-process dict with DIRECTORY_CACHE_BACKEND=memory
+directory_cache = create_cache_backend(os.getenv('DIRECTORY_CACHE_BACKEND', 'sqlite'))
 
 # Cache expiry time (5 minutes)
 CACHE_EXPIRY = 5 * 60  # seconds
+# How long a worker may hold the refresh before another one is allowed to retry
+REFRESH_LEASE = 60  # seconds
+# How long a request waits for the first load when there is no data to serve yet
+COLD_START_WAIT = 15  # seconds
+# Refresh by fetching only records modified since the last sync
+DELTA_REFRESH = os.getenv('DIRECTORY_DELTA_REFRESH', 'true').lower() == 'true'
+# Re-read records modified shortly before the last sync to allow for clock skew
+DELTA_OVERLAP = 60  # seconds
+# How often a delta refresh also lists every record id to drop deleted records
+RECONCILE_INTERVAL = 30 * 60  # seconds
+
+# One directory refresh in flight per process; concurrent callers share it
+directory_refresher = SingleFlight("directory_refresh")
+
+# Search index over the cached directory, brought up to date with each new snapshot version
+directory_index = DirectoryIndex()
+QUERY_DEFAULT_LIMIT = 50
+QUERY_MAX_LIMIT = 500
 app.config['RAPID_API_KEY'] = os.getenv('RAPID_API_KEY')
 app.config['ABSTRACT_API_KEY'] = os.getenv('ABSTRACT_API_KEY')
 app.config['MORNING_MESSAGE_PHONE_NUM'] = os.getenv('MORNING_MESSAGE_PHONE_NUM')
@@ -79,7 +104,6 @@ try:
 except (ImportError, AttributeError) as e:
     logger.warning(f"Could not patch OpenAI client: {str(e)}")
 app.config['OPENAI_ASSISTANT_ID'] = os.getenv('OPENAI_ASSISTANT_ID')
-app.config['OPENAI_ASSISTANT_ID_PUNCT'] = os.getenv('OPENAI_ASSISTANT_ID_PUNCT')
 app.config['MY_WA_NUMBER'] = os.getenv('MY_WA_NUMBER')
 app.config['MACHU_NUMBER'] = os.getenv('MACHU_NUMBER')
 
@@ -88,6 +112,9 @@ app.config['AIRTABLE_API_KEY'] = os.getenv('AIRTABLE_API_KEY')  # New modern API
 app.config['AIRTABLE_TOKEN'] = os.getenv('AIRTABLE_TOKEN')      # Legacy token name
 app.config['AIRTABLE_BASE_ID'] = os.getenv('AIRTABLE_BASE_ID')
 app.config['AIRTABLE_TABLE_NAME'] = os.getenv('AIRTABLE_TABLE_NAME', 'main-directory')
+app.config['AIRTABLE_API_URL'] = os.getenv('AIRTABLE_API_URL', AIRTABLE_API_URL)
+# Optional "Last modified time" field used for delta refreshes (defaults to LAST_MODIFIED_TIME())
+app.config['AIRTABLE_LAST_MODIFIED_FIELD'] = os.getenv('AIRTABLE_LAST_MODIFIED_FIELD')
 
 handler = LogtailHandler(source_token=app.config['LOGTAIL_TOKEN'])
 logger = logging.getLogger(__name__)
@@ -110,74 +137,204 @@ def hello_world():
     return render_template("index.html")
 
 def fetch_directory_data_from_airtable():
-    """Fetch data from Airtable and update the cache"""
-    # Set updating flag to prevent multiple simultaneous updates
-    directory_cache["updating"] = True
+    """Refresh the directory cache from Airtable, incrementally when possible"""
+    # Claim the refresh so other workers don't fetch the same data
+    lease = directory_cache.begin_refresh(REFRESH_LEASE)
+    if not lease:
+        # Another worker is already fetching; wait for its result instead
+        logger.info("Directory refresh already in progress in another worker, waiting for it")
+        deadline = time.time() + REFRESH_LEASE
+        while directory_cache.is_refreshing() and time.time() < deadline:
+            time.sleep(0.2)
+        return
     
     try:
-        airtable_token = app.config.get('AIRTABLE_API_KEY') or app.config.get('AIRTABLE_TOKEN')
-        airtable_base_id = app.config.get('AIRTABLE_BASE_ID', 'appU0yK4n5WOdzSDU')
-        airtable_table_name = app.config.get('AIRTABLE_TABLE_NAME', 'main-directory')
-        
-        airtable_url = f"https://api.airtable.com/v0/{airtable_base_id}/{airtable_table_name}"
-        headers = {"Authorization": f"Bearer {airtable_token}"}
+        airtable = {
+            "token": app.config.get('AIRTABLE_API_KEY') or app.config.get('AIRTABLE_TOKEN'),
+            "base_id": app.config.get('AIRTABLE_BASE_ID', 'appU0yK4n5WOdzSDU'),
+            "table_name": app.config.get('AIRTABLE_TABLE_NAME', 'main-directory'),
+            "api_url": app.config.get('AIRTABLE_API_URL', AIRTABLE_API_URL)
+        }
         
-        logger.info("Refreshing directory data from Airtable")
-        response = requests.get(airtable_url, headers=headers)
+        started_at = time.time()
+        entry = directory_cache.get()
+        synced_at, reconciled_at = directory_cache.sync_state()
         
-        if response.status_code == 200:
-            # Update cache
-            directory_cache["data"] = response.json()
-            directory_cache["last_updated"] = time.time()
-            logger.info("Directory cache refreshed successfully")
-        else:
-            logger.error(f"Failed to refresh directory data. Status code: {response.status_code}")
+        metrics.incr("directory_refresh.upstream_fetches")
+        with metrics.timed("directory_refresh.upstream_latency"):
+            if DELTA_REFRESH and entry.data is not None and synced_at:
+                try:
+                    refresh_directory_delta(entry, synced_at, reconciled_at, started_at, airtable)
+                    return
+                except Exception as e:
+                    logger.warning(f"Delta refresh failed, falling back to a full refresh: {str(e)}")
+            
+            refresh_directory_full(started_at, airtable)
     except Exception as e:
+        metrics.incr("directory_refresh.failures")
         logger.error(f"Error refreshing directory data: {str(e)}")
     finally:
-        # Clear updating flag
-        directory_cache["updating"] = False
+        # Release the refresh for the next expiry (unless our lease ran out and another worker took it)
+        directory_cache.end_refresh(lease)
+
+def refresh_directory_full(started_at, airtable):
+    """Replace the cached snapshot with a complete fetch of the table"""
+    logger.info("Refreshing directory data from Airtable")
+    metrics.incr("directory_refresh.full")
+    snapshot = fetch_directory_snapshot(airtable["base_id"], airtable["table_name"], airtable["token"],
+                                        api_url=airtable["api_url"])
+    
+    # Swap the complete snapshot in only once every page has arrived
+    directory_cache.put(snapshot, started_at)
+    logger.info(f"Directory cache refreshed successfully with {len(snapshot['records'])} records")
+
+def refresh_directory_delta(entry, synced_at, reconciled_at, started_at, airtable):
+    """Merge records modified since the last sync into the cached snapshot"""
+    modified_field = app.config.get('AIRTABLE_LAST_MODIFIED_FIELD')
+    logger.info("Refreshing modified directory records from Airtable")
+    metrics.incr("directory_refresh.delta")
+    changed = fetch_modified_records(airtable["base_id"], airtable["table_name"], airtable["token"],
+                                     since=synced_at - DELTA_OVERLAP, modified_field=modified_field,
+                                     api_url=airtable["api_url"])
+    metrics.incr("directory_refresh.delta_records", len(changed))
+    
+    # Deletions don't show up as modifications, so periodically list every id
+    keep_ids = None
+    if started_at - reconciled_at > RECONCILE_INTERVAL:
+        metrics.incr("directory_refresh.reconciliations")
+        keep_ids = fetch_record_ids(airtable["base_id"], airtable["table_name"], airtable["token"],
+                                    id_field=modified_field or "Title", api_url=airtable["api_url"])
+    
+    records = entry.data.get("records", [])
+    merged = merge_records(records, changed, keep_ids)
+    merged_ids = {record["id"] for record in merged}
+    
+    if keep_ids is not None and merged_ids != keep_ids:
+        # Records exist that we never saw as modified; start over from a full fetch
+        logger.warning("Directory delta is out of sync with Airtable, doing a full refresh")
+        refresh_directory_full(started_at, airtable)
+    elif not changed and len(merged) == len(records):
+        # Nothing changed: keep the serialized snapshot and just mark it fresh
+        directory_cache.touch(started_at, reconciled=keep_ids is not None)
+        logger.info("Directory cache is up to date")
+    else:
+        directory_cache.put({"records": merged}, started_at, reconciled=keep_ids is not None)
+        logger.info(f"Directory cache updated with {len(changed)} modified records, {len(merged)} records in total")
+
+def start_directory_refresh():
+    """Start a background refresh, or join the one already in flight"""
+    return directory_refresher.submit("directory", fetch_directory_data_from_airtable)
+
+def current_directory_entry():
+    """Return the cached directory, refreshing it in the background when stale"""
+    entry = directory_cache.get()
+    
+    # Check if cache needs refreshing (expired, empty, or invalidated)
+    cache_age = time.time() - entry.last_updated
+    if entry.data is None or cache_age > CACHE_EXPIRY:
+        # Refresh in the background so this request isn't blocked
+        refresh = start_directory_refresh()
+        
+        # With no data to serve yet, wait for the refresh to complete (first
+        # load); every waiting request blocks on the same refresh
+        if entry.data is None:
+            try:
+                refresh.result(timeout=COLD_START_WAIT)
+            except concurrent.futures.TimeoutError:
+                logger.warning(f"Directory data not loaded after {COLD_START_WAIT}s")
+            entry = directory_cache.get()
+    
+    return entry
 
 @app.route("/get_directory_data")
 def get_directory_data():
     """Get directory data, with auto-refresh on stale cache"""
-    current_time = time.time()
+    entry = current_directory_entry()
+    if entry.body is None:
+        return jsonify({"records": []})
     
-    # Check if cache needs refreshing (expired, empty, or force refresh requested)
-    cache_age = current_time - directory_cache["last_updated"]
-    if (directory_cache["data"] is None or cache_age > CACHE_EXPIRY or directory_cache["force_refresh"]) and not directory_cache["updating"]:
-        # Reset force refresh flag if it was set
-        directory_cache["force_refresh"] = False
-        # Start a background thread to refresh cache
-        # This prevents blocking the current request
-        refresh_thread = threading.Thread(target=fetch_directory_data_from_airtable)
-        refresh_thread.daemon = True
-        refresh_thread.start()
-        
-        # If we have existing data, use it while refresh happens in background
-        if directory_cache["data"] is not None:
-            return jsonify(directory_cache["data"])
-        
-        # Otherwise wait for the refresh to complete (first load)
-        refresh_thread.join()
+    return directory_data_response(entry)
+
+def directory_data_response(entry):
+    """Serve the pre-serialized snapshot, answering revalidation with 304"""
+    # Prefer brotli, then gzip, when the client accepts them and we have them
+    encoding = None
+    for candidate in ("br", "gzip"):
+        if candidate in entry.encoded and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    
+    # Each representation gets its own strong ETag
+    etag = f"{entry.etag}-{encoding}" if encoding else entry.etag
     
-    return jsonify(directory_cache["data"] or {"records": []})
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        body = entry.encoded[encoding] if encoding else entry.body
+        response = app.response_class(body, mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    # Let browsers keep the body but revalidate with the ETag on every use
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/directory/query")
+def query_directory():
+    """Search, filter and page through the cached directory"""
+    try:
+        limit = int(request.args.get('limit', QUERY_DEFAULT_LIMIT))
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({"success": False, "error": "limit must be a positive integer"}), 400
+    limit = min(limit, QUERY_MAX_LIMIT)
+    
+    entry = current_directory_entry()
+    directory_index.sync((entry.data or {}).get("records", []), entry.version)
+    
+    try:
+        result = directory_index.query(
+            q=request.args.get('q', ''),
+            category=request.args.get('category'),
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    return jsonify(result)
 
 @app.route("/refresh_directory_cache")
 def refresh_directory_cache():
-    """Force a refresh of the directory data cache"""
-    # Set the force refresh flag and invalidate timestamp
-    directory_cache["force_refresh"] = True
-    directory_cache["last_updated"] = 0
+    """Force a full refresh of the directory data cache"""
+    # Invalidate the shared cache so every worker treats it as stale, and drop the
+    # sync watermarks so the refresh refetches the whole table instead of a delta
+    directory_cache.request_full_refresh()
     
-    # Start a background thread to refresh cache immediately
-    refresh_thread = threading.Thread(target=fetch_directory_data_from_airtable)
-    refresh_thread.daemon = True
-    refresh_thread.start()
+    # Refresh immediately in the background
+    start_directory_refresh()
     
     # Return a success response
     return jsonify({"success": True, "message": "Cache refresh initiated"})
 
+def write_through_directory_cache(upserts=(), deletes=()):
+    """Apply a successful Airtable write to the cached directory instead of refetching it"""
+    try:
+        if directory_cache.apply(upserts=upserts, deletes=deletes):
+            metrics.incr("directory_cache.write_through")
+    except Exception as e:
+        # Fall back to refetching rather than serving data without the write
+        logger.error(f"Error writing through to directory cache, invalidating it instead: {str(e)}")
+        directory_cache.invalidate()
+
+@app.route("/metrics")
+def get_metrics():
+    """Counters and latency histograms for this worker process"""
+    return jsonify(metrics.snapshot())
+
 @app.route("/directory")
 def directory():
     # Get Airtable credentials
@@ -200,9 +357,6 @@ def directory():
 @app.route("/add_directory_entry", methods=['POST'])
 def add_directory_entry():
     try:
-        # Invalidate cache to force refresh on next request
-        directory_cache["last_updated"] = 0
-        
         # Handle multipart form data or JSON
         logo_action = 'keep'
         logo_file = None
@@ -360,7 +514,7 @@ def add_directory_entry():
         
         try:
             # First try the direct URL with single record format
-            response = requests.post(airtable_create_url, headers=headers, json=airtable_data, timeout=10)
+            response = http_client.post(airtable_create_url, headers=headers, json=airtable_data, timeout=10)
             
             # Log the response from Airtable
             logger.info(f"Airtable response status: {response.status_code}")
@@ -378,7 +532,7 @@ def add_directory_entry():
                 }
                 logger.info(f"Trying records endpoint: {records_url}")
                 logger.info(f"Using records data format: {records_data}")
-                response = requests.post(records_url, headers=headers, json=records_data, timeout=10)
+                response = http_client.post(records_url, headers=headers, json=records_data, timeout=10)
                 logger.info(f"Second attempt response status: {response.status_code}")
             
             if response.status_code >= 400:
@@ -439,7 +593,7 @@ def add_directory_entry():
                         
                         # Update the record with our Cloudinary URL
                         attachment_url = f'https://api.airtable.com/v0/{airtable_base_id}/{airtable_table_name}/{record_id}'
-                        attachment_response = requests.patch(
+                        attachment_response = http_client.patch(
                             attachment_url,
                             headers={
                                 'Authorization': f'Bearer {airtable_token}',
@@ -462,6 +616,12 @@ def add_directory_entry():
                 except Exception as e:
                     logger.error(f"Error in Cloudinary upload process for new record: {str(e)}")
             
+            # Show the new entry immediately in every worker's cache
+            if 'id' in created_data:
+                write_through_directory_cache(upserts=[created_data])
+            elif created_data.get('records'):
+                write_through_directory_cache(upserts=created_data['records'])
+            
             return jsonify({"success": True, "data": created_data}), 200
             
         except requests.exceptions.Timeout:
@@ -481,9 +641,6 @@ def add_directory_entry():
 
 @app.route("/update_directory_entry", methods=['POST'])
 def update_directory_entry():
-    # Invalidate cache to force refresh on next request
-    directory_cache["last_updated"] = 0
-    
     # Handle multipart form data
     try:
         # Enhanced logging for debugging
@@ -696,7 +853,7 @@ def update_directory_entry():
     
     try:
         # Use PATCH method to update the record
-        response = requests.patch(airtable_url, headers=headers, json=airtable_data, timeout=10)
+        response = http_client.patch(airtable_url, headers=headers, json=airtable_data, timeout=10)
         
         # Log the response from Airtable
         logger.info(f"Airtable update response status: {response.status_code}")
@@ -751,7 +908,7 @@ def update_directory_entry():
                     
                     # Update the record with our Cloudinary URL
                     attachment_url = f'https://api.airtable.com/v0/{airtable_base_id}/{airtable_table_name}/{record_id}'
-                    attachment_response = requests.patch(
+                    attachment_response = http_client.patch(
                         attachment_url,
                         headers={
                             'Authorization': f'Bearer {airtable_token}',
@@ -774,6 +931,9 @@ def update_directory_entry():
             except Exception as e:
                 logger.error(f"Error in Cloudinary upload process: {str(e)}")
         
+        # Show the edit immediately in every worker's cache
+        write_through_directory_cache(upserts=[response_data])
+        
         # Extract the logo URL from the final response data
         logo_url = None
         if response_data.get('fields', {}).get('Logo'):
@@ -798,9 +958,6 @@ def update_directory_entry():
 @app.route("/delete_directory_entry", methods=['POST'])
 def delete_directory_entry():
     """Delete an existing entry from the Airtable directory"""
-    # Invalidate cache to force refresh on next request
-    directory_cache["last_updated"] = 0
-    
     # Handle both JSON and form data
     record_id = None
     
@@ -854,7 +1011,7 @@ def delete_directory_entry():
     
     try:
         # Send DELETE request to Airtable
-        response = requests.delete(airtable_url, headers=headers, timeout=10)
+        response = http_client.delete(airtable_url, headers=headers, timeout=10)
         
         # Check for errors
         if response.status_code >= 400:
@@ -862,6 +1019,9 @@ def delete_directory_entry():
             logger.error(f"Airtable error response: {error_text}")
             return jsonify({"success": False, "error": f"Airtable API error: {error_text}"}), response.status_code
         
+        # Remove the entry from every worker's cache right away
+        write_through_directory_cache(deletes=[record_id])
+        
         # Return success response
         return jsonify({"success": True, "message": "Record deleted successfully"}), 200
         
@@ -886,11 +1046,72 @@ def post_route():
     data = request.get_json()
     return form_submit(data)
 
+# Incoming WhatsApp webhooks are persisted and processed by a pool of
+# background workers, so the request returns as soon as the job is queued
+message_jobs = JobWorkerPool(
+    JobQueue(data_path('message_queue.sqlite'), max_depth=int(os.getenv('MESSAGE_QUEUE_MAX_DEPTH', '200'))),
+    handlers={"message_receive": message_receive},
+    workers=int(os.getenv('MESSAGE_WORKERS', '4')),
+    context_factory=app.app_context
+)
+
+# Webhook message ids seen recently, so provider retries aren't processed twice
+seen_messages = SeenMessages(shared_path('seen-messages.sqlite'))
+
+@app.before_first_request
+def start_message_workers():
+    # Pick up jobs accepted before the last restart
+    message_jobs.ensure_started()
+
+def is_valid_message_payload(data):
+    """Check the webhook has the parts message_receive relies on"""
+    if not isinstance(data, dict):
+        return False
+    info = data.get('Info')
+    return isinstance(info, dict) and isinstance(data.get('Message'), dict) \
+        and all(key in info for key in ('Chat', 'Sender', 'IsGroup', 'PushName'))
+
 @app.route('/message_receive', methods=['POST'])
 def message_receive_route():
-    data = request.get_json()
+    data = request.get_json(silent=True)
     logger.info(data)
-    return message_receive(data)
+    
+    if not is_valid_message_payload(data):
+        logger.info("Ignoring webhook without message info")
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"text": None})
+        }
+    
+    # Acknowledge redeliveries of a message we already accepted without redoing the work
+    message_id = data['Info'].get('ID')
+    dedup_key = f"{data['Info']['Chat']}:{message_id}" if message_id else None
+    if dedup_key and not seen_messages.first_sighting(dedup_key):
+        logger.info(f"Ignoring duplicate webhook for message {message_id}")
+        return {
+            "statusCode": 200,
+            "body": json.dumps({"duplicate": True})
+        }
+    
+    try:
+        # Messages from one chat are handled in order, different chats in parallel
+        job_id = message_jobs.submit("message_receive", data, ordering_key=data['Info']['Chat'])
+    except QueueFull as e:
+        # Ask the provider to redeliver later instead of accepting work we can't run
+        logger.warning(f"Rejecting webhook: {str(e)}")
+        if dedup_key:
+            seen_messages.forget(dedup_key)
+        return jsonify({"success": False, "error": "Busy, retry later"}), 503
+    except Exception:
+        # Not queued (e.g. the database stayed locked), so the redelivery must not look like a duplicate
+        if dedup_key:
+            seen_messages.forget(dedup_key)
+        raise
+    
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"queued": True, "job_id": job_id})
+    }
 
 @app.route("/morning_message")
 def morning_message():
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Give up on a run (and cancel it) after this many seconds
+RUN_DEADLINE = 120
+
+# Polling fallback: first check after POLL_INITIAL seconds, then back off
+# by POLL_FACTOR up to POLL_MAX between checks
+POLL_INITIAL = 0.2
+POLL_FACTOR = 1.5
+POLL_MAX = 2.0
+
+# Run states after which waiting any longer is pointless. We give the
+# assistants no tools, so requires_action can't be satisfied either; such a
+# run stays active (blocking the thread) until cancelled.
+REQUIRES_ACTION = "requires_action"
+FAILED_STATES = {"failed", "expired", "cancelled", "incomplete", "requires_action"}
+
+FAILED_EVENTS = {f"thread.run.{state}" for state in FAILED_STATES}
+
+# Adding a message to a thread that still has an active run is rejected;
+# retry a few times with growing delays while the other run finishes
+ACTIVE_RUN_RETRIES = 5
+ACTIVE_RUN_BACKOFF = 1.0  # seconds, doubled each retry
+
+
+class RunFailed(Exception):
+    """Raised when an assistant run ends without a reply or misses its deadline"""
+
+
+class ConversationLimiter:
+    """Serializes work per conversation and caps concurrent assistant runs.
+
+    Holders of the same key run one at a time; at most max_runs holders
+    (across all keys) run at once in this process. A conversation waiting
+    for its turn doesn't take up one of the max_runs slots.
+    """
+
+    def __init__(self, max_runs):
+        self.max_runs = max_runs
+        self._runs = threading.BoundedSemaphore(max_runs)
+        self._lock = threading.Lock()
+        self._conversations = {}  # key -> [lock, holders]
+        self._active = 0
+
+    @contextmanager
+    def hold(self, key):
+        with self._lock:
+            entry = self._conversations.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        start = time.monotonic()
+        try:
+            with entry[0], self._runs:
+                metrics.observe("assistant_run.queue_wait", time.monotonic() - start)
+                self._set_active(1)
+                try:
+                    yield
+                finally:
+                    self._set_active(-1)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._conversations[key]
+
+    def _set_active(self, delta):
+        with self._lock:
+            self._active += delta
+            metrics.set_gauge("assistant_run.active", self._active)
+
+
+def _is_active_run_error(error):
+    return "while a run" in str(error) and "is active" in str(error)
+
+
+def add_message(client, thread_id, content):
+    """Add a user message to a thread, waiting out a run another worker still has active on it"""
+    for attempt in range(ACTIVE_RUN_RETRIES + 1):
+        try:
+            return client.beta.threads.messages.create(thread_id=thread_id, role="user", content=content)
+        except Exception as e:
+            if attempt == ACTIVE_RUN_RETRIES or not _is_active_run_error(e):
+                raise
+            delay = ACTIVE_RUN_BACKOFF * 2 ** attempt
+            logger.info(f"Thread {thread_id} has an active run, retrying in {delay:.0f}s")
+            metrics.incr("assistant_run.busy_thread")
+            time.sleep(delay)
+
+
+def _message_text(message):
+    for part in message.content:
+        if part.type == "text":
+            return part.text.value
+    raise RunFailed(f"Message {message.id} has no text content")
+
+
+def _cancel(client, thread_id, run_id):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Could not cancel run {run_id}: {str(e)}")
+
+
+def _stream_run(client, thread_id, assistant_id, start, deadline):
+    """Run the assistant over the streaming API; returns (reply, seconds to first token)"""
+    run_id = None
+    first_token = None
+    reply = None
+
+    try:
+        with client.beta.threads.runs.stream(thread_id=thread_id, assistant_id=assistant_id,
+                                             timeout=deadline - time.monotonic()) as stream:
+            for event in stream:
+                if event.event == "thread.run.created":
+                    run_id = event.data.id
+                elif event.event == "thread.message.delta" and first_token is None:
+                    first_token = time.monotonic() - start
+                elif event.event == "thread.message.completed":
+                    reply = _message_text(event.data)
+                elif event.event in FAILED_EVENTS:
+                    if event.data.status == REQUIRES_ACTION:
+                        _cancel(client, thread_id, event.data.id)
+                    error = getattr(event.data, "last_error", None)
+                    raise RunFailed(f"Run {event.data.id} ended as {event.data.status}: {error}")
+
+                if time.monotonic() > deadline:
+                    if run_id:
+                        _cancel(client, thread_id, run_id)
+                    raise RunFailed(f"Run {run_id} missed its {RUN_DEADLINE}s deadline")
+    except RunFailed:
+        raise
+    except Exception:
+        # The stream broke (read timeout, reset connection) but the run may
+        # still be active, which would block the thread until it expires
+        if run_id:
+            _cancel(client, thread_id, run_id)
+        raise
+
+    if reply is None:
+        raise RunFailed(f"Run {run_id} finished without a reply")
+    return reply, first_token
+
+
+def _poll_run(client, thread_id, assistant_id, start, deadline):
+    """Create a run and poll it with exponential backoff; returns (reply, seconds until completed)"""
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    delay = POLL_INITIAL
+
+    while run.status != "completed":
+        if run.status in FAILED_STATES:
+            if run.status == REQUIRES_ACTION:
+                _cancel(client, thread_id, run.id)
+            raise RunFailed(f"Run {run.id} ended as {run.status}: {getattr(run, 'last_error', None)}")
+        if time.monotonic() + delay > deadline:
+            _cancel(client, thread_id, run.id)
+            raise RunFailed(f"Run {run.id} missed its {RUN_DEADLINE}s deadline (last status {run.status})")
+
+        time.sleep(delay)
+        delay = min(delay * POLL_FACTOR, POLL_MAX)
+        metrics.incr("assistant_run.polls")
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+    completed = time.monotonic() - start
+    messages = client.beta.threads.messages.list(thread_id=thread_id, run_id=run.id, order="desc", limit=1)
+    if not messages.data:
+        raise RunFailed(f"Run {run.id} finished without a reply")
+    return _message_text(messages.data[0]), completed
+
+
+def run_and_wait(client, thread_id, assistant_id, deadline_seconds=RUN_DEADLINE, stream=True):
+    """Run an assistant on a thread and return the text of its reply.
+
+    Uses the streaming run API when the client supports it, otherwise polls
+    with backoff. Raises RunFailed if the run fails, is cancelled or expires,
+    or takes longer than deadline_seconds (in which case it is cancelled).
+    """
+    start = time.monotonic()
+    deadline = start + deadline_seconds
+    use_stream = stream and hasattr(client.beta.threads.runs, "stream")
+
+    try:
+        if use_stream:
+            reply, first_token = _stream_run(client, thread_id, assistant_id, start, deadline)
+        else:
+            reply, first_token = _poll_run(client, thread_id, assistant_id, start, deadline)
+    except Exception:
+        metrics.incr("assistant_run.failed")
+        raise
+    finally:
+        metrics.observe("assistant_run.total", time.monotonic() - start)
+
+    if first_token is not None:
+        metrics.observe("assistant_run.first_token", first_token)
+    metrics.incr("assistant_run.streamed" if use_stream else "assistant_run.polled")
+    return reply
@@ -1,21 +1,39 @@
 import base64
-import requests
+import io
+import tempfile
+import http_client
 import mimetypes
 import random
 import os
 import hashlib
 import hmac
+from functools import lru_cache
 from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+from local_store import SHARED_DIR
 
 # Ensure necessary directories exist
-os.makedirs('./tmp', exist_ok=True)
 os.makedirs('./decoded', exist_ok=True)
 
-def download_file(url, filename):
-    response = requests.get(url, allow_redirects=True)
-    response.raise_for_status()
-    with open(filename, 'wb') as file:
-        file.write(response.content)
+# WhatsApp appends the first 10 bytes of HMAC-SHA256(macKey, iv + ciphertext)
+MAC_LENGTH = 10
+# Bytes read from the media server per chunk while streaming
+CHUNK_SIZE = 64 * 1024
+# Spooled media stays in memory up to this size, then moves to a file in
+# SHARED_DIR (shared memory where available), never to the persistent disk
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# HKDF info string WhatsApp uses to derive the keys for each kind of media
+MEDIA_APP_INFO = {
+    'imageMessage': b"WhatsApp Image Keys",
+    'stickerMessage': b"WhatsApp Image Keys",
+    'videoMessage': b"WhatsApp Video Keys",
+    'audioMessage': b"WhatsApp Audio Keys",
+    'documentMessage': b"WhatsApp Document Keys",
+}
+
+class MediaIntegrityError(Exception):
+    """Raised when downloaded media fails its MAC or padding check (corrupt or truncated)"""
 
 def hkdf(key, length, app_info=b""):
     key = hmac.new(b"\0" * 32, key, hashlib.sha256).digest()
@@ -28,6 +46,19 @@ def hkdf(key, length, app_info=b""):
         key_stream += key_block
     return key_stream[:length]
 
+@lru_cache(maxsize=256)
+def expand_media_key(media_key, app_info):
+    """Derive (iv, cipher_key, mac_key) from a base64 mediaKey; cached so retries and forwards skip HKDF"""
+    media_key_expanded = hkdf(base64.b64decode(media_key), 112, app_info)
+    return media_key_expanded[:16], media_key_expanded[16:48], media_key_expanded[48:80]
+
+def app_info_for(message_type):
+    """The HKDF info string for a message type such as 'imageMessage' or 'documentMessage'"""
+    try:
+        return MEDIA_APP_INFO[message_type]
+    except KeyError:
+        raise ValueError(f"Unsupported media message type: {message_type}")
+
 def aes_unpad(s):
     return s[:-ord(s[len(s) - 1:])]
 
@@ -36,29 +67,129 @@ def aes_decrypt(key, ciphertext, iv):
     plaintext = cipher.decrypt(ciphertext)
     return aes_unpad(plaintext)
 
-def decrypt_media_file(media_key, encrypted_file_path, output_file_path, app_info):
-    media_key_expanded = hkdf(base64.b64decode(media_key), 112, app_info)
-    iv = media_key_expanded[:16]
-    cipher_key = media_key_expanded[16:48]
-
+class SpooledMedia(tempfile.SpooledTemporaryFile):
+    """Decrypted media held in memory (spilling into SHARED_DIR when large).
+
+    Keeps the media's filename so uploads (e.g. to Replicate) get the right
+    content type.
+    """
+
+    def __init__(self, filename, max_size=SPOOL_MAX_SIZE):
+        super().__init__(max_size=max_size, dir=SHARED_DIR)
+        self.filename = filename
+
+    @property
+    def name(self):
+        return self.filename
+
+class MediaDecryptor:
+    """Incremental WhatsApp media decryption.
+
+    Feed the encrypted body (ciphertext followed by the 10-byte MAC) to
+    update() in chunks of any size; each call returns the plaintext that can
+    already be released. finalize() checks the MAC and padding and returns
+    the last of the plaintext. The last cipher block and the MAC are held
+    back until then, so memory use doesn't grow with the file size.
+    """
+
+    def __init__(self, media_key, app_info):
+        iv, cipher_key, mac_key = expand_media_key(media_key, app_info)
+        self._cipher = AES.new(cipher_key, AES.MODE_CBC, iv)
+        self._mac = hmac.new(mac_key, iv, hashlib.sha256)
+        self._pending = b""
+
+    def update(self, chunk):
+        data = self._pending + chunk
+        ready = max(0, len(data) - MAC_LENGTH - AES.block_size)
+        ready -= ready % AES.block_size
+        ciphertext, self._pending = data[:ready], data[ready:]
+        self._mac.update(ciphertext)
+        return self._cipher.decrypt(ciphertext)
+
+    def finalize(self):
+        ciphertext, mac = self._pending[:-MAC_LENGTH], self._pending[-MAC_LENGTH:]
+        self._mac.update(ciphertext)
+        if len(mac) < MAC_LENGTH or not hmac.compare_digest(self._mac.digest()[:MAC_LENGTH], mac):
+            raise MediaIntegrityError("Media MAC does not match, the download is corrupt or truncated")
+        if not ciphertext or len(ciphertext) % AES.block_size:
+            raise MediaIntegrityError("Media ciphertext is not a whole number of AES blocks")
+        try:
+            return unpad(self._cipher.decrypt(ciphertext), AES.block_size)
+        except ValueError as e:
+            raise MediaIntegrityError(f"Bad padding in decrypted media: {str(e)}")
+
+def decrypt_stream(media_key, app_info, chunks, output):
+    """Decrypt an iterable of encrypted chunks into the writable file-like output; returns bytes written"""
+    decryptor = MediaDecryptor(media_key, app_info)
+    written = 0
+    for chunk in chunks:
+        plaintext = decryptor.update(chunk)
+        output.write(plaintext)
+        written += len(plaintext)
+    plaintext = decryptor.finalize()
+    output.write(plaintext)
+    return written + len(plaintext)
+
+def download_and_decrypt_to(url, media_key, app_info, output, chunk_size=CHUNK_SIZE):
+    """Download encrypted media and decrypt it into output as it arrives.
+
+    Nothing but the plaintext is written anywhere. Raises MediaIntegrityError
+    if the MAC doesn't match, in which case output holds unverified data and
+    must be discarded.
+    """
+    response = http_client.get(url, allow_redirects=True, stream=True)
+    with response:
+        response.raise_for_status()
+        return decrypt_stream(media_key, app_info, response.iter_content(chunk_size), output)
+
+def _read_chunks(file, length):
+    while length > 0:
+        chunk = file.read(min(CHUNK_SIZE, length))
+        if not chunk:
+            return
+        length -= len(chunk)
+        yield chunk
+
+def verify_media_file(media_key, encrypted_file_path, app_info):
+    """Check an encrypted media file's MAC without decrypting it; raises MediaIntegrityError"""
+    iv, _, mac_key = expand_media_key(media_key, app_info)
+    ciphertext_length = os.path.getsize(encrypted_file_path) - MAC_LENGTH
+    if ciphertext_length <= 0:
+        raise MediaIntegrityError(f"{encrypted_file_path} is too short to be encrypted media")
+
+    mac = hmac.new(mac_key, iv, hashlib.sha256)
     with open(encrypted_file_path, 'rb') as file:
-        media_data = file.read()
+        for chunk in _read_chunks(file, ciphertext_length):
+            mac.update(chunk)
+        expected = file.read(MAC_LENGTH)
+    if not hmac.compare_digest(mac.digest()[:MAC_LENGTH], expected):
+        raise MediaIntegrityError(f"MAC of {encrypted_file_path} does not match, the file is corrupt or truncated")
 
-    file_data = media_data[:-10]  # Remove the last 10 bytes (MAC)
-    decrypted_data = aes_decrypt(cipher_key, file_data, iv)
+def decrypt_media_file(media_key, encrypted_file_path, output_file_path, app_info):
+    # Reject corrupt media before producing any plaintext
+    verify_media_file(media_key, encrypted_file_path, app_info)
 
-    with open(output_file_path, 'wb') as file:
-        file.write(decrypted_data)
+    with open(encrypted_file_path, 'rb') as file, open(output_file_path, 'wb') as output:
+        decrypt_stream(media_key, app_info, _read_chunks(file, os.path.getsize(encrypted_file_path)), output)
 
     # Delete the encrypted file after decryption
     if os.path.exists(encrypted_file_path):
         os.remove(encrypted_file_path)
 
-def download_and_decrypt(payload):
+def download_and_decrypt(payload, mode='file'):
+    """Download and decrypt a WhatsApp media payload.
+
+    mode 'file' writes decoded/<filename> and returns its path; 'memory'
+    returns an io.BytesIO and 'spooled' a SpooledMedia, both rewound and
+    named after the file, so no plaintext touches the persistent disk.
+    """
     media_key = payload['mediaKey']
     url = payload['url']
     message_type = payload['messageType']
-    app_info = bytes(payload['whatsappTypeMessageToDecode'], encoding='utf-8')
+    if payload.get('whatsappTypeMessageToDecode'):
+        app_info = bytes(payload['whatsappTypeMessageToDecode'], encoding='utf-8')
+    else:
+        app_info = app_info_for(message_type)
     mimetype = payload['mimetype'].split(';')[0]
 
     filename = payload.get('filename') or str(random.getrandbits(128))
@@ -67,14 +198,33 @@ def download_and_decrypt(payload):
 
     print(f'filename: {filename}\nmediaKey: {media_key}\nurl: {url}\nmessageType: {message_type}\nwhatsappTypeMessageToDecode: {app_info}\nmimetype: {mimetype}\nextension: {file_extension}')
 
-    encrypted_file_path = f'tmp/{filename}.enc'
-    output_file_path = f'decoded/{complete_filename}'
+    if mode in ('memory', 'spooled'):
+        if mode == 'memory':
+            output = io.BytesIO()
+            output.name = complete_filename
+        else:
+            output = SpooledMedia(complete_filename)
+        try:
+            download_and_decrypt_to(url, media_key, app_info, output)
+        except BaseException:
+            output.close()
+            raise
+        output.seek(0)
+        print(f"Decrypted [{message_type}] [{complete_filename}] in memory")
+        return output
+    elif mode != 'file':
+        raise ValueError(f"Unknown download_and_decrypt mode: {mode}")
 
-    # Download the encrypted file
-    download_file(url, encrypted_file_path)
+    output_file_path = f'decoded/{complete_filename}'
 
-    # Decrypt the media file
-    decrypt_media_file(media_key, encrypted_file_path, output_file_path, app_info)
+    # Download and decrypt in one pass, without keeping the encrypted file
+    try:
+        with open(output_file_path, 'wb') as output:
+            download_and_decrypt_to(url, media_key, app_info, output)
+    except BaseException:
+        if os.path.exists(output_file_path):
+            os.remove(output_file_path)
+        raise
 
     print(f"Decrypted [{message_type}] [{complete_filename}]")
     return output_file_path
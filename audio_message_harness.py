@@ -0,0 +1,34 @@
+"""Test helper: run message_receive.handle_audio_message without WhatsApp or OpenAI"""
+import base64
+import hashlib
+import io
+from contextlib import ExitStack, contextmanager, nullcontext
+from unittest import mock
+from flask import Flask
+import message_receive
+
+
+def audio_payload(audio, claimed=None):
+    """A webhook audioMessage for `audio`; claimed is the content fileSHA256 advertises (defaults to audio)"""
+    claimed = audio if claimed is None else claimed
+    return {'URL': 'https://mmg.whatsapp.net/x', 'mediaKey': 'key', 'mimetype': 'audio/ogg',
+            'fileSHA256': base64.b64encode(hashlib.sha256(claimed).digest()).decode()}
+
+
+@contextmanager
+def handling_audio(audio, cache, **replacements):
+    """Inside an app context where downloads decrypt to `audio` and transcripts go to `cache`.
+
+    Other message_receive attributes (transcribe_audio, punctuate, ...) are
+    replaced by the given keyword arguments for the duration of the block.
+    """
+    app = Flask(__name__)
+    app.config['OPENAI_API_KEY'] = 'sk-test'
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch.object(message_receive, "transcript_cache", cache))
+        stack.enter_context(mock.patch.object(message_receive, "download_and_decrypt",
+                                              side_effect=lambda *args, **kwargs: nullcontext(io.BytesIO(audio))))
+        for name, replacement in replacements.items():
+            stack.enter_context(mock.patch.object(message_receive, name, replacement))
+        stack.enter_context(app.app_context())
+        yield
@@ -0,0 +1,101 @@
+"""Benchmark a full directory refresh against a local fake Airtable.
+
+Usage: python bench_directory_refresh.py [record_count ...]
+"""
+import json
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+from airtable_directory import fetch_directory_snapshot
+
+REPEATS = 5
+DEFAULT_COUNTS = [100, 500, 1000, 2000, 5000]
+
+
+def make_records(count):
+    return [
+        {
+            "id": f"rec{i:014d}",
+            "createdTime": "2024-01-01T00:00:00.000Z",
+            "fields": {
+                "Title": f"Business {i}",
+                "Category": ["Food", "Services"] if i % 2 else ["Tours"],
+                "Subtitle": "A short description of what this business does",
+                "Phone Number": f"+506{i:08d}",
+                "Website URL": f"https://example.com/{i}",
+            },
+        }
+        for i in range(count)
+    ]
+
+
+class FakeAirtableHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the client can keep the connection alive between pages
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs stall every keep-alive page by ~40ms
+    disable_nagle_algorithm = True
+    records = []
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        page_size = int(query.get("pageSize", ["100"])[0])
+        start = int(query.get("offset", ["0"])[0])
+        page = {"records": self.records[start:start + page_size]}
+        if start + page_size < len(self.records):
+            page["offset"] = str(start + page_size)
+
+        body = json.dumps(page).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def time_refresh(api_url, session_factory):
+    timings = []
+    for _ in range(REPEATS):
+        session = session_factory()
+        start = time.perf_counter()
+        snapshot = fetch_directory_snapshot("appBench", "main-directory", "token", api_url=api_url, session=session)
+        timings.append(time.perf_counter() - start)
+    return snapshot, statistics.median(timings)
+
+
+class NoKeepAliveSession:
+    """Opens a new connection for every page, like bare requests.get did"""
+
+    def get(self, *args, **kwargs):
+        return requests.get(*args, **kwargs)
+
+
+def main(counts):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAirtableHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}/v0"
+
+    print(f"{'records':>8} {'pages':>6} {'keep-alive ms':>14} {'no keep-alive ms':>17}")
+    try:
+        for count in counts:
+            FakeAirtableHandler.records = make_records(count)
+            snapshot, shared = time_refresh(api_url, requests.Session)
+            _, fresh = time_refresh(api_url, NoKeepAliveSession)
+            assert len(snapshot["records"]) == count
+            pages = max(1, -(-count // 100))
+            print(f"{count:>8} {pages:>6} {shared * 1000:>14.1f} {fresh * 1000:>17.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS)
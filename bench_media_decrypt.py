@@ -0,0 +1,123 @@
+"""Benchmark downloading and decrypting WhatsApp media from a local fake media server.
+
+Compares the old buffered path (whole body in memory, written to tmp/, read
+back, decrypted in one go) with the streaming decryptor, reporting wall time,
+throughput and peak RSS growth. Each run happens in a fresh forked process so
+peak RSS is measured per run.
+
+Usage: python bench_media_decrypt.py [size_mb ...]
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+from audio_download_decode import hkdf, aes_decrypt, download_and_decrypt_to
+
+DEFAULT_SIZES_MB = [1, 16, 64]
+APP_INFO = b"WhatsApp Audio Keys"
+MEDIA_KEY = base64.b64encode(bytes(range(32))).decode()
+
+
+def encrypt_media(plaintext):
+    expanded = hkdf(base64.b64decode(MEDIA_KEY), 112, APP_INFO)
+    iv, cipher_key, mac_key = expanded[:16], expanded[16:48], expanded[48:80]
+    ciphertext = AES.new(cipher_key, AES.MODE_CBC, iv).encrypt(pad(plaintext, AES.block_size))
+    return ciphertext + hmac.new(mac_key, iv + ciphertext, hashlib.sha256).digest()[:10]
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    bodies = {}
+
+    def do_GET(self):
+        body = self.bodies[int(self.path.strip("/"))]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(sizes_mb, ready):
+    # Runs in its own process so the encrypted bodies don't count towards the measured RSS
+    FakeMediaHandler.bodies = {size: encrypt_media(os.urandom(size * 1024 * 1024)) for size in sizes_mb}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMediaHandler)
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def buffered(url, workdir):
+    """The previous implementation: response.content -> tmp file -> read back -> decrypt -> write"""
+    encrypted_path = os.path.join(workdir, "media.enc")
+    response = requests.get(url)
+    with open(encrypted_path, "wb") as file:
+        file.write(response.content)
+    del response
+
+    expanded = hkdf(base64.b64decode(MEDIA_KEY), 112, APP_INFO)
+    with open(encrypted_path, "rb") as file:
+        media_data = file.read()
+    decrypted = aes_decrypt(expanded[16:48], media_data[:-10], expanded[:16])
+    with open(os.path.join(workdir, "media.ogg"), "wb") as file:
+        file.write(decrypted)
+    os.remove(encrypted_path)
+
+
+def streaming(url, workdir):
+    with open(os.path.join(workdir, "media.ogg"), "wb") as output:
+        download_and_decrypt_to(url, MEDIA_KEY, APP_INFO, output)
+
+
+def measure(method, url, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        method(url, workdir)
+        elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+    results.put((elapsed, (peak - before) / 1024))
+
+
+def run_isolated(context, method, url):
+    results = context.Queue()
+    process = context.Process(target=measure, args=(method, url, results))
+    process.start()
+    outcome = results.get()
+    process.join()
+    return outcome
+
+
+def main(sizes_mb):
+    context = multiprocessing.get_context("fork")
+    ready = context.Queue()
+    server = context.Process(target=serve, args=(sizes_mb, ready), daemon=True)
+    server.start()
+    port = ready.get()
+
+    print(f"{'size MB':>8} {'method':>10} {'ms':>9} {'MB/s':>8} {'peak RSS +MB':>13}")
+    try:
+        for size in sizes_mb:
+            url = f"http://127.0.0.1:{port}/{size}"
+            for name, method in [("buffered", buffered), ("streaming", streaming)]:
+                elapsed, rss = run_isolated(context, method, url)
+                print(f"{size:>8} {name:>10} {elapsed * 1000:>9.1f} {size / elapsed:>8.1f} {rss:>13.1f}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES_MB)
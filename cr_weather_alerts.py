@@ -1,5 +1,5 @@
 import feedparser
-import requests
+import http_client
 from bs4 import BeautifulSoup
 
 # Replace with your DeepL API key if using translation
@@ -7,7 +7,7 @@ DEEPL_API_KEY = "7cdd98b5-31e3-46a0-91ca-923a04eb389c:fx"
 
 # Fetch the RSS feed
 def fetch_latest_feed(feed_url):
-    feed = feedparser.parse(feed_url)
+    feed = feedparser.parse(http_client.get(feed_url).content)
     if feed.entries:
         latest_entry = feed.entries[0]
         return latest_entry
@@ -16,7 +16,7 @@ def fetch_latest_feed(feed_url):
 
 # Fetch the content from the entry's URL
 def fetch_entry_content(entry_url):
-    response = requests.get(entry_url)
+    response = http_client.get(entry_url)
     if response.status_code == 200:
         return response.text
     else:
@@ -52,7 +52,7 @@ def translate_description(description, target_language="EN"):
         "text": description,
         "target_lang": target_language
     }
-    response = requests.post(url, data=params)
+    response = http_client.post(url, data=params)
     if response.status_code == 200:
         return response.json()["translations"][0]["text"]
     else:
@@ -0,0 +1,484 @@
+import gzip
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from local_store import SQLiteStore, shared_path
+from airtable_directory import merge_records
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Compression levels for the precompressed bodies: brotli 5 and gzip 6 get
+# most of the size reduction of the maximum levels for a fraction of the CPU
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+# A write-through only gets a quick gzip copy, made in the background; the
+# next refresh compresses properly and adds the brotli copy back
+WRITE_GZIP_LEVEL = 1
+
+# Write-throughs are remembered this long, so a refresh that started before
+# one can re-apply it to what it fetched instead of undoing it
+WRITE_LOG_RETENTION = 60 * 60  # seconds
+
+# Snapshots are {"records": [...]}; the body is built around the serialized
+# records so single records can be spliced in and out of it
+SNAPSHOT_PREFIX = b'{"records":['
+SNAPSHOT_SUFFIX = b']}'
+
+# data is the decoded Airtable snapshot ({"records": [...]}) or None if never loaded.
+# body is the same snapshot serialized to JSON, etag its strong validator and
+# encoded maps a content-coding ("gzip", "br") to the precompressed body.
+CacheEntry = namedtuple('CacheEntry', ['data', 'last_updated', 'version', 'body', 'etag', 'encoded'])
+EMPTY_ENTRY = CacheEntry(None, 0, 0, None, None, {})
+
+
+def _dump_record(record):
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _join_records(parts):
+    """Body for (record id, serialized record) pairs, and each record's [id, start, length] span in it"""
+    spans = []
+    position = len(SNAPSHOT_PREFIX)
+    for record_id, part in parts:
+        spans.append([record_id, position, len(part)])
+        position += len(part) + 1
+    return SNAPSHOT_PREFIX + b','.join(part for _, part in parts) + SNAPSHOT_SUFFIX, spans
+
+
+def serialize_snapshot(data):
+    """Serialize a snapshot to JSON bytes; returns (body, spans of the records in it)"""
+    return _join_records([(record["id"], _dump_record(record)) for record in data.get("records", [])])
+
+
+def splice_records(body, spans, upserts=(), deletes=()):
+    """Apply written records to a serialized snapshot, serializing only those records.
+
+    Same result as serializing apply_changes(): updated records stay in
+    place, new ones are appended and deleted ones dropped.
+    """
+    changed = {record["id"]: record for record in upserts}
+    deleted = set(deletes)
+    parts = []
+    for record_id, start, length in spans:
+        if record_id in deleted:
+            continue
+        if record_id in changed:
+            parts.append((record_id, _dump_record(changed.pop(record_id))))
+        else:
+            parts.append((record_id, body[start:start + length]))
+    parts.extend((record_id, _dump_record(record)) for record_id, record in changed.items())
+    return _join_records(parts)
+
+
+def body_etag(body):
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def compress_body(body, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY):
+    """Precompressed variants of a body by content-coding; brotli_quality=None skips brotli"""
+    # mtime=0 keeps the gzip bytes identical for identical data in every worker
+    encoded = {'gzip': gzip.compress(body, compresslevel=gzip_level, mtime=0)}
+    if brotli is not None and brotli_quality is not None:
+        encoded['br'] = brotli.compress(body, quality=brotli_quality)
+    return encoded
+
+
+def apply_changes(data, upserts=(), deletes=()):
+    """Return a copy of a snapshot with written records replaced or added and deleted ones removed"""
+    deleted = set(deletes)
+    records = [record for record in data.get("records", []) if record["id"] not in deleted]
+    return dict(data, records=merge_records(records, upserts))
+
+
+class CacheBackend:
+    """Where the directory snapshot lives and how workers coordinate refreshing it.
+
+    `put` takes the time the refresh *started*: if the cache was invalidated
+    while the fetch was in flight, the new data is stored but stays stale so
+    the next read fetches again and picks up the write. The start time is also
+    remembered as the delta-sync watermark, and as the reconciliation time
+    when the refresh saw the complete list of record ids. Writes applied
+    since the refresh started are re-applied to its data before it is stored,
+    so a refresh can't bring back a record deleted while it was fetching.
+    """
+
+    def get(self):
+        raise NotImplementedError
+
+    def put(self, data, started_at, reconciled=True):
+        raise NotImplementedError
+
+    def touch(self, started_at, reconciled=False):
+        """Mark the cached data fresh as of started_at without changing it"""
+        raise NotImplementedError
+
+    def apply(self, upserts=(), deletes=()):
+        """Write records created, updated or deleted upstream through to the cached snapshot.
+
+        Bumps the version without touching freshness. Only the written
+        records are serialized and spliced into the body; compression happens
+        in the background at a cheap level. A refresh already in flight may
+        not include the write, so its result is left stale.
+        Returns False when nothing is cached yet.
+        """
+        raise NotImplementedError
+
+    def _store_encoded(self, version, encoded):
+        """Attach compressed bodies to the given version, if it is still the current one"""
+        raise NotImplementedError
+
+    def _compress_in_background(self, version, body):
+        def compress():
+            try:
+                self._store_encoded(version, compress_body(body, gzip_level=WRITE_GZIP_LEVEL, brotli_quality=None))
+            except Exception as e:
+                logger.warning(f"Could not compress directory cache version {version}: {str(e)}")
+
+        threading.Thread(target=compress, name="directory-compress", daemon=True).start()
+
+    def sync_state(self):
+        """Return (synced_at, reconciled_at) of the last successful refresh"""
+        raise NotImplementedError
+
+    def invalidate(self):
+        raise NotImplementedError
+
+    def request_full_refresh(self):
+        """Invalidate and forget the sync watermarks, so the next refresh refetches the whole table.
+
+        A refresh already in flight doesn't restore the watermarks when it stores its result.
+        """
+        raise NotImplementedError
+
+    def begin_refresh(self, lease_seconds):
+        """Claim the refresh; returns a lease token, or None if another refresh holds an unexpired lease"""
+        raise NotImplementedError
+
+    def end_refresh(self, token):
+        """Release the lease, unless it expired and another refresh has claimed it since"""
+        raise NotImplementedError
+
+    def is_refreshing(self):
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """The original in-process dict: every worker keeps and refreshes its own copy"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = EMPTY_ENTRY
+        self._invalidated_at = 0
+        self._full_refresh_requested_at = 0
+        self._refresh_until = 0
+        self._refresh_token = None
+        self._synced_at = 0
+        self._reconciled_at = 0
+        self._spans = []
+        self._writes = []  # (applied_at, upserts, deletes)
+
+    def get(self):
+        return self._entry
+
+    def put(self, data, started_at, reconciled=True):
+        with self._lock:
+            for applied_at, upserts, deletes in self._writes:
+                if applied_at >= started_at:
+                    data = apply_changes(data, upserts, deletes)
+            body, self._spans = serialize_snapshot(data)
+            last_updated = 0 if self._invalidated_at > started_at else started_at
+            version = self._entry.version + 1
+            self._entry = CacheEntry(data, last_updated, version, body, body_etag(body), {})
+            self._record_sync(started_at, reconciled)
+        self._store_encoded(version, compress_body(body))
+
+    def _store_encoded(self, version, encoded):
+        with self._lock:
+            if self._entry.version == version:
+                self._entry = self._entry._replace(encoded=encoded)
+
+    def _record_sync(self, started_at, reconciled):
+        if self._full_refresh_requested_at > started_at:
+            return
+        self._synced_at = started_at
+        if reconciled:
+            self._reconciled_at = started_at
+
+    def apply(self, upserts=(), deletes=()):
+        upserts, deletes = list(upserts), list(deletes)
+        with self._lock:
+            now = time.time()
+            self._invalidated_at = now
+            self._writes = [write for write in self._writes if write[0] > now - WRITE_LOG_RETENTION]
+            self._writes.append((now, upserts, deletes))
+            if self._entry.data is None:
+                return False
+            data = apply_changes(self._entry.data, upserts, deletes)
+            body, self._spans = splice_records(self._entry.body, self._spans, upserts, deletes)
+            version = self._entry.version + 1
+            self._entry = self._entry._replace(data=data, version=version, body=body,
+                                               etag=body_etag(body), encoded={})
+        self._compress_in_background(version, body)
+        return True
+
+    def touch(self, started_at, reconciled=False):
+        with self._lock:
+            if self._invalidated_at <= started_at:
+                self._entry = self._entry._replace(last_updated=started_at)
+            self._record_sync(started_at, reconciled)
+
+    def sync_state(self):
+        return self._synced_at, self._reconciled_at
+
+    def invalidate(self):
+        with self._lock:
+            self._invalidated_at = time.time()
+            self._entry = self._entry._replace(last_updated=0)
+
+    def request_full_refresh(self):
+        with self._lock:
+            self._invalidated_at = self._full_refresh_requested_at = time.time()
+            self._entry = self._entry._replace(last_updated=0)
+            self._synced_at = self._reconciled_at = 0
+
+    def begin_refresh(self, lease_seconds):
+        with self._lock:
+            now = time.time()
+            if self._refresh_until > now:
+                return None
+            self._refresh_until = now + lease_seconds
+            self._refresh_token = uuid.uuid4().hex
+            return self._refresh_token
+
+    def end_refresh(self, token):
+        with self._lock:
+            if self._refresh_token == token:
+                self._refresh_until = 0
+                self._refresh_token = None
+
+    def is_refreshing(self):
+        return self._refresh_until > time.time()
+
+
+class SQLiteCacheBackend(SQLiteStore, CacheBackend):
+    """Snapshot kept in a SQLite file (under /dev/shm by default) shared by all workers.
+
+    One refresh is visible to every process, invalidations reach every process,
+    and the refresh lease stops workers from fetching the same data twice. The
+    refreshing worker stores the serialized and compressed bodies, and each
+    worker keeps the entry for the current version in memory, so a read only
+    costs a single-row lookup unless the data actually changed. Write-throughs
+    are logged in cache_writes for refreshes that started before them.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        body BLOB,
+        etag TEXT,
+        gzip_body BLOB,
+        br_body BLOB,
+        last_updated REAL NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 0,
+        invalidated_at REAL NOT NULL DEFAULT 0,
+        full_refresh_requested_at REAL NOT NULL DEFAULT 0,
+        synced_at REAL NOT NULL DEFAULT 0,
+        reconciled_at REAL NOT NULL DEFAULT 0,
+        refresh_until REAL NOT NULL DEFAULT 0,
+        refresh_token TEXT,
+        record_spans TEXT
+    );
+    CREATE TABLE IF NOT EXISTS cache_writes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL,
+        applied_at REAL NOT NULL,
+        upserts TEXT NOT NULL,
+        deletes TEXT NOT NULL
+    );
+    """
+
+    # Columns added since the table was first created, with their definitions.
+    # The file lives in /dev/shm and outlives deploys, so older tables are altered in place.
+    migrations = [
+        ("etag", "TEXT"),
+        ("gzip_body", "BLOB"),
+        ("br_body", "BLOB"),
+        ("invalidated_at", "REAL NOT NULL DEFAULT 0"),
+        ("synced_at", "REAL NOT NULL DEFAULT 0"),
+        ("reconciled_at", "REAL NOT NULL DEFAULT 0"),
+        ("refresh_token", "TEXT"),
+        ("full_refresh_requested_at", "REAL NOT NULL DEFAULT 0"),
+        ("record_spans", "TEXT"),
+    ]
+
+    # Advance the sync watermarks, unless a full refresh was requested after this refresh started
+    _RECORD_SYNC = """synced_at = CASE WHEN full_refresh_requested_at > ? THEN synced_at ELSE ? END,
+                   reconciled_at = CASE WHEN full_refresh_requested_at > ? OR NOT ? THEN reconciled_at ELSE ? END"""
+
+    @staticmethod
+    def _sync_params(started_at, reconciled):
+        return (started_at, started_at, started_at, reconciled, started_at)
+
+    def __init__(self, path, key='directory'):
+        self.key = key
+        self._lock = threading.Lock()
+        self._decoded = EMPTY_ENTRY
+        super().__init__(path)
+        self._migrate()
+        self.connection().execute("INSERT OR IGNORE INTO cache_entries (key) VALUES (?)", (key,))
+
+    def _migrate(self):
+        with self.transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(cache_entries)")}
+            for name, definition in self.migrations:
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE cache_entries ADD COLUMN {name} {definition}")
+
+    def _execute(self, sql, params=()):
+        return self.connection().execute(sql, params + (self.key,))
+
+    @staticmethod
+    def _encoded(gzip_body, br_body):
+        return {name: value for name, value in (('gzip', gzip_body), ('br', br_body)) if value is not None}
+
+    def get(self):
+        version, last_updated, has_gzip, has_br = self._execute(
+            "SELECT version, last_updated, gzip_body IS NOT NULL, br_body IS NOT NULL FROM cache_entries WHERE key = ?"
+        ).fetchone()
+        with self._lock:
+            if version != self._decoded.version:
+                body, etag, gzip_body, br_body, version = self._execute(
+                    "SELECT body, etag, gzip_body, br_body, version FROM cache_entries WHERE key = ?").fetchone()
+                data = json.loads(body) if body is not None else None
+                self._decoded = CacheEntry(data, last_updated, version, body, etag, self._encoded(gzip_body, br_body))
+            elif {'gzip': has_gzip, 'br': has_br} != {name: name in self._decoded.encoded for name in ('gzip', 'br')}:
+                # Compressed copies were added (or dropped) after the body was stored
+                gzip_body, br_body, version = self._execute(
+                    "SELECT gzip_body, br_body, version FROM cache_entries WHERE key = ?").fetchone()
+                if version == self._decoded.version:
+                    self._decoded = self._decoded._replace(encoded=self._encoded(gzip_body, br_body))
+            return self._decoded._replace(last_updated=last_updated)
+
+    def _writes_since(self, started_at, after_id=0):
+        rows = self._execute(
+            "SELECT id, upserts, deletes FROM cache_writes WHERE applied_at >= ? AND id > ? AND key = ? ORDER BY id",
+            (started_at, after_id)).fetchall()
+        return [(write_id, json.loads(upserts), json.loads(deletes)) for write_id, upserts, deletes in rows]
+
+    def put(self, data, started_at, reconciled=True):
+        # Serialize outside the write lock, with the writes made since the refresh started
+        writes = self._writes_since(started_at)
+        for _, upserts, deletes in writes:
+            data = apply_changes(data, upserts, deletes)
+        body, spans = serialize_snapshot(data)
+
+        with self.transaction():
+            # Splice in writes that landed while we were serializing
+            for _, upserts, deletes in self._writes_since(started_at, writes[-1][0] if writes else 0):
+                body, spans = splice_records(body, spans, upserts, deletes)
+            self._execute(
+                """UPDATE cache_entries
+                   SET body = ?, etag = ?, record_spans = ?, gzip_body = NULL, br_body = NULL,
+                       version = version + 1,
+                       last_updated = CASE WHEN invalidated_at > ? THEN 0 ELSE ? END,
+                       """ + self._RECORD_SYNC + """
+                   WHERE key = ?""",
+                (body, body_etag(body), json.dumps(spans), started_at, started_at)
+                + self._sync_params(started_at, reconciled))
+            version, = self._execute("SELECT version FROM cache_entries WHERE key = ?").fetchone()
+        self._store_encoded(version, compress_body(body))
+
+    def _store_encoded(self, version, encoded):
+        self._execute("UPDATE cache_entries SET gzip_body = ?, br_body = ? WHERE version = ? AND key = ?",
+                      (encoded.get('gzip'), encoded.get('br'), version))
+
+    def apply(self, upserts=(), deletes=()):
+        upserts, deletes = list(upserts), list(deletes)
+        now = time.time()
+        with self.transaction():
+            self._execute("UPDATE cache_entries SET invalidated_at = ? WHERE key = ?", (now,))
+            self._execute("INSERT INTO cache_writes (applied_at, upserts, deletes, key) VALUES (?, ?, ?, ?)",
+                          (now, json.dumps(upserts), json.dumps(deletes)))
+            self._execute("DELETE FROM cache_writes WHERE applied_at < ? AND key = ?", (now - WRITE_LOG_RETENTION,))
+            body, spans = self._execute("SELECT body, record_spans FROM cache_entries WHERE key = ?").fetchone()
+            if body is None:
+                return False
+            if spans is None:
+                # Stored by a version that didn't keep record spans
+                body, spans = serialize_snapshot(json.loads(body))
+            else:
+                spans = json.loads(spans)
+            body, spans = splice_records(body, spans, upserts, deletes)
+            self._execute(
+                """UPDATE cache_entries
+                   SET body = ?, etag = ?, record_spans = ?, gzip_body = NULL, br_body = NULL,
+                       version = version + 1
+                   WHERE key = ?""",
+                (body, body_etag(body), json.dumps(spans)))
+            version, = self._execute("SELECT version FROM cache_entries WHERE key = ?").fetchone()
+        self._compress_in_background(version, body)
+        return True
+
+    def touch(self, started_at, reconciled=False):
+        self._execute(
+            """UPDATE cache_entries
+               SET last_updated = CASE WHEN invalidated_at > ? THEN last_updated ELSE ? END,
+                   """ + self._RECORD_SYNC + """
+               WHERE key = ?""",
+            (started_at, started_at) + self._sync_params(started_at, reconciled))
+
+    def sync_state(self):
+        return tuple(self._execute("SELECT synced_at, reconciled_at FROM cache_entries WHERE key = ?").fetchone())
+
+    def invalidate(self):
+        self._execute("UPDATE cache_entries SET last_updated = 0, invalidated_at = ? WHERE key = ?", (time.time(),))
+
+    def request_full_refresh(self):
+        now = time.time()
+        self._execute(
+            """UPDATE cache_entries
+               SET last_updated = 0, invalidated_at = ?, full_refresh_requested_at = ?,
+                   synced_at = 0, reconciled_at = 0
+               WHERE key = ?""",
+            (now, now))
+
+    def begin_refresh(self, lease_seconds):
+        now = time.time()
+        token = uuid.uuid4().hex
+        cursor = self._execute(
+            "UPDATE cache_entries SET refresh_until = ?, refresh_token = ? WHERE refresh_until < ? AND key = ?",
+            (now + lease_seconds, token, now))
+        return token if cursor.rowcount == 1 else None
+
+    def end_refresh(self, token):
+        self._execute(
+            "UPDATE cache_entries SET refresh_until = 0, refresh_token = NULL WHERE refresh_token = ? AND key = ?",
+            (token,))
+
+    def is_refreshing(self):
+        refresh_until, = self._execute("SELECT refresh_until FROM cache_entries WHERE key = ?").fetchone()
+        return refresh_until > time.time()
+
+
+def create_cache_backend(kind='sqlite'):
+    """Build the configured backend, falling back to the in-process dict"""
+    if kind == 'sqlite':
+        path = shared_path('directory-cache.sqlite')
+        try:
+            backend = SQLiteCacheBackend(path)
+            logger.info(f"Using shared SQLite directory cache at {path}")
+            return backend
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open shared directory cache at {path}, using in-process cache: {str(e)}")
+    elif kind != 'memory':
+        logger.warning(f"Unknown DIRECTORY_CACHE_BACKEND '{kind}', using in-process cache")
+    return MemoryCacheBackend()
@@ -0,0 +1,161 @@
+import base64
+import bisect
+import json
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+INDEXED_FIELDS = ("Title", "Subtitle", "Category")
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Lowercase and strip accents so "Café" and "cafe" match"""
+    decomposed = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def _field_values(fields, name):
+    value = fields.get(name)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _sort_key(record):
+    return (normalize(record.get("fields", {}).get("Title") or ""), record["id"])
+
+
+def encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        title, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return (str(title), str(record_id))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+class DirectoryIndex:
+    """In-memory inverted index over Title, Subtitle and Category of the cached directory.
+
+    `sync` brings the index up to date with a snapshot version, re-indexing only
+    records whose indexed content changed. Query terms match word prefixes, so
+    results keep up with as-you-type search. Results are ordered by Title and
+    paged with an opaque keyset cursor that stays valid across refreshes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self._records = {}
+        self._fingerprints = {}
+        self._record_tokens = {}
+        self._sort_keys = {}
+        self._postings = defaultdict(set)
+        self._categories = defaultdict(set)
+        self._tokens = []
+        self._order = []
+
+    def sync(self, records, version):
+        """Apply a snapshot version, touching only the records that were added, changed or removed"""
+        with self._lock:
+            if version == self.version:
+                return
+            incoming = {record["id"]: record for record in records}
+
+            for record_id in set(self._records) - set(incoming):
+                self._remove(record_id)
+
+            for record_id, record in incoming.items():
+                fingerprint = self._fingerprint(record)
+                if self._fingerprints.get(record_id) != fingerprint:
+                    self._remove(record_id)
+                    self._add(record_id, record, fingerprint)
+                else:
+                    # Non-indexed fields (phone, logo...) may still have changed
+                    self._records[record_id] = record
+
+            self._tokens = sorted(self._postings)
+            self._order = sorted(self._sort_keys.values())
+            self.version = version
+
+    def query(self, q="", category=None, limit=50, cursor=None):
+        """Return ({"records": [...], "total": n, "next_cursor": str|None}) for one page"""
+        with self._lock:
+            matches = None
+            for term in tokenize(q or ""):
+                term_matches = self._prefix_matches(term)
+                matches = term_matches if matches is None else matches & term_matches
+                if not matches:
+                    break
+
+            if category:
+                category_matches = self._categories.get(normalize(category).strip(), set())
+                matches = category_matches if matches is None else matches & category_matches
+
+            if matches is None:
+                candidates = self._order
+            else:
+                candidates = sorted(self._sort_keys[record_id] for record_id in matches)
+
+            start = bisect.bisect_right(candidates, decode_cursor(cursor)) if cursor else 0
+            window = candidates[start:start + limit]
+            next_cursor = encode_cursor(window[-1]) if window and start + limit < len(candidates) else None
+            return {
+                "records": [self._records[record_id] for _, record_id in window],
+                "total": len(candidates),
+                "next_cursor": next_cursor,
+            }
+
+    def _prefix_matches(self, term):
+        ids = set()
+        position = bisect.bisect_left(self._tokens, term)
+        while position < len(self._tokens) and self._tokens[position].startswith(term):
+            ids |= self._postings[self._tokens[position]]
+            position += 1
+        return ids
+
+    def _fingerprint(self, record):
+        fields = record.get("fields", {})
+        return tuple(tuple(_field_values(fields, name)) for name in INDEXED_FIELDS)
+
+    def _add(self, record_id, record, fingerprint):
+        fields = record.get("fields", {})
+        tokens = set()
+        for name in INDEXED_FIELDS:
+            for value in _field_values(fields, name):
+                tokens.update(tokenize(value))
+        for token in tokens:
+            self._postings[token].add(record_id)
+        for value in _field_values(fields, "Category"):
+            self._categories[normalize(value).strip()].add(record_id)
+
+        self._records[record_id] = record
+        self._fingerprints[record_id] = fingerprint
+        self._record_tokens[record_id] = tokens
+        self._sort_keys[record_id] = _sort_key(record)
+
+    def _remove(self, record_id):
+        record = self._records.pop(record_id, None)
+        if record is None:
+            return
+        for token in self._record_tokens.pop(record_id, ()):
+            self._postings[token].discard(record_id)
+            if not self._postings[token]:
+                del self._postings[token]
+        for value in _field_values(record.get("fields", {}), "Category"):
+            category = normalize(value).strip()
+            self._categories[category].discard(record_id)
+            if not self._categories[category]:
+                del self._categories[category]
+        del self._fingerprints[record_id]
+        del self._sort_keys[record_id]
@@ -1,4 +1,4 @@
-import requests
+import http_client
 import os
 from flask import current_app
 
@@ -30,7 +30,7 @@ def add_to_group(phone):
       "Content-Type": "application/json"
     }
     print(payload)
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
     print(response)
 
     return {"body": "OK"}
@@ -62,7 +62,7 @@ def form_submit(args):
     	"Content-Type": "application/json"
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
     
     print(response)
 
@@ -1,2 +1,25 @@
 bind = "0.0.0.0:8080"
 workers = 2
+
+
+def post_worker_init(worker):
+    # Warm this worker's OpenAI client, assistant metadata and local models, and
+    # top up the quote pool, in the background, so the first webhook after a
+    # deploy doesn't pay for setup
+    import threading
+    import openai_registry
+    import punctuation
+    import transcribe
+    import quote_pool
+    from app import app
+
+    config = app.config
+    threading.Thread(
+        target=openai_registry.prime,
+        args=(config['OPENAI_API_KEY'], [config['OPENAI_ASSISTANT_ID']]),
+        name="openai-prime",
+        daemon=True,
+    ).start()
+    threading.Thread(target=transcribe.warm_up, name="transcription-warm-up", daemon=True).start()
+    threading.Thread(target=punctuation.warm_up, name="punctuation-warm-up", daemon=True).start()
+    quote_pool.get_pool().refill_if_low()
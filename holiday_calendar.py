@@ -0,0 +1,188 @@
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+import http_client
+from local_store import SQLiteStore
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ABSTRACT_HOLIDAYS_URL = "https://holidays.abstractapi.com/v1/"
+
+# Stored years are re-fetched in the background once they are this old
+REFRESH_INTERVAL = 7 * 24 * 60 * 60  # seconds
+# After a failed fetch, don't call the API again for this long
+RETRY_INTERVAL = 60 * 60  # seconds
+
+# Costa Rica's fixed-date national holidays, used when the API can't be reached
+FIXED_HOLIDAYS_CR = {
+    (1, 1): "New Year's Day",
+    (4, 11): "Juan Santamaría Day",
+    (5, 1): "Labour Day",
+    (7, 25): "Guanacaste Day",
+    (8, 2): "Our Lady of the Angels Day",
+    (8, 15): "Mother's Day",
+    (8, 31): "Day of the Black Person and Afro-Costa Rican Culture",
+    (9, 15): "Independence Day",
+    (12, 1): "Army Abolition Day",
+    (12, 25): "Christmas Day",
+}
+
+
+class HolidayFetchError(Exception):
+    """Raised when a year of holidays could not be loaded from the API"""
+
+
+def easter_sunday(year):
+    """Gregorian Easter Sunday (anonymous Gregorian algorithm)"""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def fallback_holidays(year):
+    """Fixed-date national holidays plus Holy Thursday and Good Friday, as {date: name}"""
+    holidays = {date(year, month, day): name for (month, day), name in FIXED_HOLIDAYS_CR.items()}
+    easter = easter_sunday(year)
+    holidays[easter - timedelta(days=3)] = "Holy Thursday"
+    holidays[easter - timedelta(days=2)] = "Good Friday"
+    return holidays
+
+
+def fetch_year_holidays(year, api_key, country="CR"):
+    """Every holiday abstractapi lists for a country and year, as [{"date": "YYYY-MM-DD", "name": ...}]"""
+    response = http_client.get(ABSTRACT_HOLIDAYS_URL, params={"api_key": api_key, "country": country, "year": year})
+    if response.status_code != 200:
+        raise HolidayFetchError(f"abstractapi returned {response.status_code} for {country} {year}: {response.text[:200]}")
+
+    holidays = []
+    for holiday in response.json():
+        try:
+            day = date(int(holiday["date_year"]), int(holiday["date_month"]), int(holiday["date_day"]))
+        except (KeyError, ValueError):
+            day = datetime.strptime(holiday["date"], "%m/%d/%Y").date()
+        holidays.append({"date": day.isoformat(), "name": holiday.get("name", "No holiday name found")})
+    return holidays
+
+
+class HolidayCalendar(SQLiteStore):
+    """A country's holidays, bulk-loaded a year at a time and kept on disk.
+
+    Lookups are answered from an in-memory {date: name} dict. Stored years
+    are refreshed in the background; when a year can't be fetched at all,
+    the fixed-date national holidays are used instead.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS holiday_years (
+        country TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        holidays TEXT NOT NULL,
+        fetched_at REAL NOT NULL,
+        PRIMARY KEY (country, year)
+    );
+    """
+
+    def __init__(self, path, country="CR", fetch=fetch_year_holidays):
+        self.country = country
+        self.fetch = fetch
+        self._years = {}  # year -> ({date: name}, fetched_at)
+        self._failed_at = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        super().__init__(path)
+
+    def _index(self, holidays):
+        by_date = {}
+        for holiday in holidays:
+            # Several entries can share a date; keep the first, as the API lists them
+            by_date.setdefault(date.fromisoformat(holiday["date"]), holiday["name"])
+        return by_date
+
+    def _load(self, year, api_key):
+        """Fetch a year from the API and store it; returns its {date: name} dict
+
+        The fetch runs without holding self._lock, which is only taken to
+        publish the result, so lookups and background loads never wait on
+        the network.
+        """
+        try:
+            holidays = self.fetch(year, api_key, self.country)
+            if not holidays:
+                # Every year has holidays; an empty list is an API problem, not a quiet year
+                raise HolidayFetchError("the API returned no holidays")
+        except Exception as e:
+            with self._lock:
+                self._failed_at[year] = time.time()
+            metrics.incr("holidays.fetch_errors")
+            raise HolidayFetchError(f"Could not load {self.country} holidays for {year}: {str(e)}") from e
+
+        fetched_at = time.time()
+        self.connection().execute(
+            "INSERT OR REPLACE INTO holiday_years (country, year, holidays, fetched_at) VALUES (?, ?, ?, ?)",
+            (self.country, year, json.dumps(holidays), fetched_at))
+        by_date = self._index(holidays)
+        with self._lock:
+            self._years[year] = (by_date, fetched_at)
+        logger.info(f"Stored {len(holidays)} {self.country} holidays for {year}")
+        return by_date
+
+    def _in_background(self, year, work):
+        with self._lock:
+            if year in self._refreshing:
+                return
+            self._refreshing.add(year)
+
+        def run():
+            try:
+                work()
+            except Exception as e:
+                logger.warning(f"Background holiday load for {year} failed: {str(e)}")
+            finally:
+                self._refreshing.discard(year)
+
+        threading.Thread(target=run, name="holiday-refresh", daemon=True).start()
+
+    def _stored(self, year):
+        """A year's ({date: name}, fetched_at) from disk, or None"""
+        row = self.connection().execute(
+            "SELECT holidays, fetched_at FROM holiday_years WHERE country = ? AND year = ?",
+            (self.country, year)).fetchone()
+        if row is None:
+            return None
+        cached = (self._index(json.loads(row[0])), row[1])
+        with self._lock:
+            return self._years.setdefault(year, cached)
+
+    def year(self, year, api_key):
+        """{date: name} for a year: from memory, then disk, then the API, else the fallback table"""
+        cached = self._years.get(year) or self._stored(year)
+        if cached is None:
+            if time.time() - self._failed_at.get(year, 0) > RETRY_INTERVAL:
+                try:
+                    return self._load(year, api_key)
+                except HolidayFetchError as e:
+                    logger.warning(f"{str(e)}; using the fixed-date holiday table")
+            metrics.incr("holidays.fallbacks")
+            return fallback_holidays(year)
+
+        by_date, fetched_at = cached
+        if time.time() - fetched_at > REFRESH_INTERVAL and time.time() - self._failed_at.get(year, 0) > RETRY_INTERVAL:
+            self._in_background(year, lambda: self._load(year, api_key))
+        return by_date
+
+    def holiday(self, day, api_key):
+        """The name of the holiday on a date, or None"""
+        if day.month == 12 and day.year + 1 not in self._years:
+            # Load next year ahead of time so January 1st is answered from memory
+            self._in_background(day.year + 1, lambda: self.year(day.year + 1, api_key))
+        return self.year(day.year, api_key).get(day)
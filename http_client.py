@@ -0,0 +1,130 @@
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Shared client for every outbound API call (Airtable, RapidAPI, zenquotes,
+# abstractapi, DeepL, WhatsApp media): one keep-alive connection pool per host,
+# default timeouts, retries with jittered backoff on 429/5xx and per-host
+# latency histograms in /metrics.
+
+# (connect, read) timeout in seconds for calls that don't pass their own
+DEFAULT_TIMEOUT = (5, 30)
+
+# Idle keep-alive connections kept per host
+POOL_SIZE = 10
+# Number of hosts whose pools are kept
+POOL_HOSTS = 20
+
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 8  # seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Only these are retried after a 5xx or a read timeout; POST/PATCH may already
+# have taken effect (e.g. a WhatsApp message sent), so they are only retried
+# when the server refused them with 429 or the connection never opened
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+def session():
+    """The pooled session for this process (recreated after a fork)"""
+    global _session, _session_pid
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, max_retries=0)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+def _backoff(attempt):
+    # "Full jitter": a random delay up to the exponential cap
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _retry_after(response):
+    try:
+        return min(float(response.headers.get("Retry-After", "")), BACKOFF_MAX)
+    except ValueError:
+        return None
+
+
+def _should_retry_status(method, status_code):
+    if status_code == 429:
+        return True
+    return status_code in RETRY_STATUSES and method in IDEMPOTENT_METHODS
+
+
+def _should_retry_error(method, error):
+    # A connect timeout means the request never reached the server
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)) \
+        and method in IDEMPOTENT_METHODS
+
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, retries=MAX_RETRIES, **kwargs):
+    """Send a request through the shared pool, retrying transient failures.
+
+    Takes the same keyword arguments as requests.request and returns the
+    final requests.Response (which may still be an error status once
+    retries are exhausted). Connection errors and timeouts are re-raised
+    as the usual requests exceptions.
+    """
+    method = method.upper()
+    host = urlsplit(url).hostname or "unknown"
+
+    for attempt in range(retries + 1):
+        start = time.perf_counter()
+        try:
+            response = session().request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            metrics.observe(f"http.{host}.latency", time.perf_counter() - start)
+            metrics.incr(f"http.{host}.errors")
+            if attempt == retries or not _should_retry_error(method, e):
+                raise
+            delay = _backoff(attempt)
+            logger.warning(f"{method} {host} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+        else:
+            metrics.observe(f"http.{host}.latency", time.perf_counter() - start)
+            metrics.incr(f"http.{host}.status_{response.status_code // 100}xx")
+            if attempt == retries or not _should_retry_status(method, response.status_code):
+                return response
+            delay = _retry_after(response) or _backoff(attempt)
+            logger.warning(f"{method} {host} returned {response.status_code}, retrying in {delay:.2f}s")
+            response.close()
+
+        metrics.incr(f"http.{host}.retries")
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return request("PATCH", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
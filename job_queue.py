@@ -0,0 +1,233 @@
+import json
+import logging
+import threading
+import time
+from local_store import SQLiteStore
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A failed job waits RETRY_BACKOFF seconds before its second attempt, doubling for each one after
+RETRY_BACKOFF = 5  # seconds
+
+# The job each worker thread is running, for complete_current_job()
+_current = threading.local()
+
+
+class QueueFull(Exception):
+    """Raised when the queue is at capacity; callers should ask the sender to retry later"""
+
+
+class JobQueue(SQLiteStore):
+    """Persistent job queue in a SQLite file shared by every gunicorn worker.
+
+    Jobs are claimed under a lease: if the process running a job dies, the
+    lease expires and another worker picks the job up again, so an accepted
+    job survives a restart. Finished jobs are deleted.
+
+    Jobs sharing an ordering_key run one at a time in enqueue order, while
+    jobs with different keys (or none) run in parallel. A failed job is
+    retried after a growing delay (not_before).
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        enqueued_at REAL NOT NULL,
+        lease_until REAL NOT NULL DEFAULT 0,
+        ordering_key TEXT,
+        not_before REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, id);
+    """
+
+    def __init__(self, path, max_depth=200, max_attempts=3, retry_backoff=RETRY_BACKOFF):
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        super().__init__(path)
+        self._migrate()
+
+    def _migrate(self):
+        # Queue files created before ordering keys existed keep their pending jobs
+        with self.transaction() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "ordering_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN ordering_key TEXT")
+            if "not_before" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_ordering_key ON jobs (ordering_key, id)")
+
+    def enqueue(self, kind, payload, ordering_key=None):
+        with self.transaction() as conn:
+            depth, = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            if depth >= self.max_depth:
+                raise QueueFull(f"Job queue is full ({depth} jobs)")
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, enqueued_at, ordering_key) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload), time.time(), ordering_key))
+        metrics.set_gauge("job_queue.depth", depth + 1)
+        return cursor.lastrowid
+
+    def claim(self, lease_seconds):
+        """Take the oldest runnable job, or None; returns (id, kind, payload, attempts, enqueued_at)
+
+        A job is skipped while it waits out its retry delay, or while an
+        older job with the same ordering key is still waiting or holds a
+        live lease.
+        """
+        now = time.time()
+        with self.transaction() as conn:
+            row = conn.execute(
+                """SELECT id, kind, payload, attempts, enqueued_at FROM jobs AS job
+                   WHERE ((status = 'queued' AND not_before <= ?) OR (status = 'running' AND lease_until < ?))
+                     AND (ordering_key IS NULL OR NOT EXISTS (
+                         SELECT 1 FROM jobs AS other
+                         WHERE other.ordering_key = job.ordering_key AND other.id != job.id
+                           AND (other.id < job.id OR (other.status = 'running' AND other.lease_until >= ?))))
+                   ORDER BY id LIMIT 1""",
+                (now, now, now)).fetchone()
+            if row is None:
+                return None
+            job_id, kind, payload, attempts, enqueued_at = row
+            conn.execute(
+                "UPDATE jobs SET status = 'running', lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (now + lease_seconds, job_id))
+        return job_id, kind, json.loads(payload), attempts + 1, enqueued_at
+
+    def extend_lease(self, job_id, lease_seconds):
+        """Keep a long-running job from being claimed again by another worker"""
+        self.connection().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'", (time.time() + lease_seconds, job_id))
+
+    def complete(self, job_id):
+        self.connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def fail(self, job_id, attempts):
+        """Put a failed job back in the queue after a backoff, or drop it once it has used up its attempts"""
+        if attempts >= self.max_attempts:
+            self.connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return False
+        not_before = time.time() + self.retry_backoff * 2 ** (attempts - 1)
+        self.connection().execute(
+            "UPDATE jobs SET status = 'queued', lease_until = 0, not_before = ? WHERE id = ?", (not_before, job_id))
+        return True
+
+    def depth(self):
+        depth, = self.connection().execute("SELECT COUNT(*) FROM jobs").fetchone()
+        return depth
+
+
+def complete_current_job():
+    """Mark the job running on this thread as done right away.
+
+    For handlers with side effects that must not be repeated (e.g. once a
+    reply has been sent): if the handler fails afterwards, or the worker
+    dies, the job is not retried. Does nothing outside a job.
+    """
+    job = getattr(_current, "job", None)
+    if job is not None and not job["completed"]:
+        job["queue"].complete(job["id"])
+        job["completed"] = True
+
+
+class JobWorkerPool:
+    """Fixed pool of threads running jobs from a JobQueue.
+
+    handlers maps a job kind to a function taking the payload. Each job runs
+    inside context_factory() (e.g. app.app_context). Workers are woken right
+    away by jobs enqueued in this process and poll for jobs enqueued by others.
+    A running job's lease is renewed every third of lease_seconds, so only a
+    worker that died loses its jobs to another one.
+    """
+
+    def __init__(self, queue, handlers, workers=4, lease_seconds=300, poll_interval=1.0, context_factory=None):
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.context_factory = context_factory
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{number}")
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.workers} job workers")
+
+    def submit(self, kind, payload, ordering_key=None):
+        """Persist a job and wake a worker; raises QueueFull when at capacity"""
+        try:
+            job_id = self.queue.enqueue(kind, payload, ordering_key)
+        except QueueFull:
+            metrics.incr("job_queue.rejected")
+            raise
+        metrics.incr("job_queue.enqueued")
+        self.ensure_started()
+        self._wakeup.set()
+        return job_id
+
+    def _work(self):
+        while True:
+            try:
+                job = self.queue.claim(self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Error claiming job: {str(e)}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self._run(*job)
+
+    def _keep_leased(self, job_id, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                self.queue.extend_lease(job_id, self.lease_seconds)
+            except Exception as e:
+                logger.warning(f"Could not extend the lease of job {job_id}: {str(e)}")
+
+    def _run(self, job_id, kind, payload, attempts, enqueued_at):
+        metrics.observe("job_queue.wait", time.time() - enqueued_at)
+        start = time.perf_counter()
+        job = _current.job = {"queue": self.queue, "id": job_id, "completed": False}
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=self._keep_leased, args=(job_id, stop_heartbeat),
+                         name=f"job-{job_id}-lease", daemon=True).start()
+        try:
+            handler = self.handlers[kind]
+            if self.context_factory is None:
+                handler(payload)
+            else:
+                with self.context_factory():
+                    handler(payload)
+        except Exception as e:
+            if job["completed"]:
+                # Its side effect already happened; retrying would repeat it
+                metrics.incr("job_queue.failed")
+                logger.error(f"Job {job_id} ({kind}) failed after completing, not retrying: {str(e)}")
+            else:
+                retried = self.queue.fail(job_id, attempts)
+                metrics.incr("job_queue.retried" if retried else "job_queue.failed")
+                logger.error(f"Job {job_id} ({kind}) failed on attempt {attempts}: {str(e)}")
+        else:
+            complete_current_job()
+            metrics.incr("job_queue.completed")
+        finally:
+            stop_heartbeat.set()
+            _current.job = None
+            metrics.observe(f"job_queue.run.{kind}", time.perf_counter() - start)
+            metrics.set_gauge("job_queue.depth", self.queue.depth())
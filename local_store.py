@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# State that only has to outlive a request and be visible to every gunicorn
+# worker lives in shared memory; state that should survive a restart goes
+# under DATA_DIR.
+SHARED_DIR = os.getenv('SHARED_STATE_DIR') or ('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir())
+DATA_DIR = os.getenv('DATA_DIR', 'data')
+
+
+def shared_path(filename):
+    """Path for a file shared between workers but not kept across reboots"""
+    return os.path.join(SHARED_DIR, f"machu-{filename}")
+
+
+def data_path(filename):
+    """Path for a file that should persist across restarts"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
+
+
+class SQLiteStore:
+    """Base class for the small SQLite files shared between gunicorn workers.
+
+    Every thread gets its own connection (reopened after a fork), the database
+    runs in WAL mode so readers never block the writer, and subclasses describe
+    their tables in `schema`.
+    """
+    schema = ""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(self.schema)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Run a block inside BEGIN IMMEDIATE so read-modify-write is atomic across workers"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,168 @@
+"""Moon phase instants computed locally, after Meeus, Astronomical Algorithms, chapter 49.
+
+Mean lunations with the periodic and planetary corrections, accurate to
+about a minute for recent centuries, so no network access is needed to
+tell whether a date is a full moon. Times are naive UTC datetimes, like
+the moon-data API's "Date" field.
+"""
+import math
+from datetime import datetime, timedelta
+
+# Phase numbers, as used by the moon-data API
+NEW_MOON, FIRST_QUARTER, FULL_MOON, LAST_QUARTER = 0, 1, 2, 3
+
+SYNODIC_MONTH = 29.530588861  # days
+JDE_EPOCH = 2451550.09766  # new moon of 2000 January 6 (k = 0)
+UNIX_EPOCH_JD = 2440587.5
+
+# Periodic terms for new and full moon: (coefficient, power of E, M, M', F, Omega multipliers)
+NEW_MOON_TERMS = [
+    (-0.40720, 0, 0, 1, 0, 0), (0.17241, 1, 1, 0, 0, 0), (0.01608, 0, 0, 2, 0, 0),
+    (0.01039, 0, 0, 0, 2, 0), (0.00739, 1, -1, 1, 0, 0), (-0.00514, 1, 1, 1, 0, 0),
+    (0.00208, 2, 2, 0, 0, 0), (-0.00111, 0, 0, 1, -2, 0), (-0.00057, 0, 0, 1, 2, 0),
+    (0.00056, 1, 1, 2, 0, 0), (-0.00042, 0, 0, 3, 0, 0), (0.00042, 1, 1, 0, 2, 0),
+    (0.00038, 1, 1, 0, -2, 0), (-0.00024, 1, -1, 2, 0, 0), (-0.00017, 0, 0, 0, 0, 1),
+    (-0.00007, 0, 2, 1, 0, 0), (0.00004, 0, 0, 2, -2, 0), (0.00004, 0, 3, 0, 0, 0),
+    (0.00003, 0, 1, 1, -2, 0), (0.00003, 0, 0, 2, 2, 0), (-0.00003, 0, 1, 1, 2, 0),
+    (0.00003, 0, -1, 1, 2, 0), (-0.00002, 0, -1, 1, -2, 0), (-0.00002, 0, 1, 3, 0, 0),
+    (0.00002, 0, 0, 4, 0, 0),
+]
+FULL_MOON_TERMS = [
+    (-0.40614, 0, 0, 1, 0, 0), (0.17302, 1, 1, 0, 0, 0), (0.01614, 0, 0, 2, 0, 0),
+    (0.01043, 0, 0, 0, 2, 0), (0.00734, 1, -1, 1, 0, 0), (-0.00515, 1, 1, 1, 0, 0),
+    (0.00209, 2, 2, 0, 0, 0), (-0.00111, 0, 0, 1, -2, 0), (-0.00057, 0, 0, 1, 2, 0),
+    (0.00056, 1, 1, 2, 0, 0), (-0.00042, 0, 0, 3, 0, 0), (0.00042, 1, 1, 0, 2, 0),
+    (0.00038, 1, 1, 0, -2, 0), (-0.00024, 1, -1, 2, 0, 0), (-0.00017, 0, 0, 0, 0, 1),
+    (-0.00007, 0, 2, 1, 0, 0), (0.00004, 0, 0, 2, -2, 0), (0.00004, 0, 3, 0, 0, 0),
+    (0.00003, 0, 1, 1, -2, 0), (0.00003, 0, 0, 2, 2, 0), (-0.00003, 0, 1, 1, 2, 0),
+    (0.00003, 0, -1, 1, 2, 0), (-0.00002, 0, -1, 1, -2, 0), (-0.00002, 0, 1, 3, 0, 0),
+    (0.00002, 0, 0, 4, 0, 0),
+]
+QUARTER_TERMS = [
+    (-0.62801, 0, 0, 1, 0, 0), (0.17172, 1, 1, 0, 0, 0), (-0.01183, 1, 1, 1, 0, 0),
+    (0.00862, 0, 0, 2, 0, 0), (0.00804, 0, 0, 0, 2, 0), (0.00454, 1, -1, 1, 0, 0),
+    (0.00204, 2, 2, 0, 0, 0), (-0.00180, 0, 0, 1, -2, 0), (-0.00070, 0, 0, 1, 2, 0),
+    (-0.00040, 0, 0, 3, 0, 0), (-0.00034, 1, -1, 2, 0, 0), (0.00032, 1, 1, 0, 2, 0),
+    (0.00032, 1, 1, 0, -2, 0), (-0.00028, 2, 2, 1, 0, 0), (0.00027, 1, 1, 2, 0, 0),
+    (-0.00017, 0, 0, 0, 0, 1), (-0.00005, 0, -1, 1, -2, 0), (0.00004, 0, 0, 2, 2, 0),
+    (-0.00004, 0, 1, 1, 2, 0), (0.00004, 0, -2, 1, 0, 0), (0.00003, 0, 1, 1, -2, 0),
+    (0.00003, 0, 3, 0, 0, 0), (0.00002, 0, 0, 2, -2, 0), (0.00002, 0, -1, 1, 2, 0),
+    (-0.00002, 0, 1, 3, 0, 0),
+]
+PHASE_TERMS = {NEW_MOON: NEW_MOON_TERMS, FULL_MOON: FULL_MOON_TERMS,
+               FIRST_QUARTER: QUARTER_TERMS, LAST_QUARTER: QUARTER_TERMS}
+
+# Planetary arguments A1..A14: (constant, coefficient of k, coefficient of T^2), and their amplitudes
+PLANETARY_ARGUMENTS = [
+    (299.77, 0.107408, -0.009173), (251.88, 0.016321, 0), (251.83, 26.651886, 0),
+    (349.42, 36.412478, 0), (84.66, 18.206239, 0), (141.74, 53.303771, 0),
+    (207.14, 2.453732, 0), (154.84, 7.306860, 0), (34.52, 27.261239, 0),
+    (207.19, 0.121824, 0), (291.34, 1.844379, 0), (161.72, 24.198154, 0),
+    (239.56, 25.513099, 0), (331.55, 3.592518, 0),
+]
+PLANETARY_AMPLITUDES = [
+    0.000325, 0.000165, 0.000164, 0.000126, 0.000110, 0.000062, 0.000060,
+    0.000056, 0.000047, 0.000042, 0.000040, 0.000037, 0.000035, 0.000023,
+]
+
+
+def _julian_day(moment):
+    return UNIX_EPOCH_JD + (moment - datetime(1970, 1, 1)).total_seconds() / 86400
+
+
+def _from_julian_day(jd):
+    return datetime(1970, 1, 1) + timedelta(days=jd - UNIX_EPOCH_JD)
+
+
+def delta_t(year):
+    """Terrestrial minus universal time in seconds (Espenak & Meeus polynomials, 1986-2150)"""
+    if year < 2005:
+        t = year - 2000
+        return 63.86 + 0.3345 * t - 0.060374 * t ** 2 + 0.0017275 * t ** 3 + 0.000651814 * t ** 4 + 0.00002373599 * t ** 5
+    if year < 2050:
+        t = year - 2000
+        return 62.92 + 0.32217 * t + 0.005589 * t ** 2
+    u = (year - 1820) / 100
+    return -20 + 32 * u ** 2 - 0.5628 * (2150 - year)
+
+
+def phase_jde(k):
+    """Julian Ephemeris Day of the phase with lunation number k.
+
+    k is an integer for a new moon, +0.25 first quarter, +0.5 full moon,
+    +0.75 last quarter; k = 0 is the new moon of 2000 January 6.
+    """
+    phase = round((k % 1) * 4) % 4
+    T = k / 1236.85
+    jde = (JDE_EPOCH + SYNODIC_MONTH * k + 0.00015437 * T ** 2
+           - 0.000000150 * T ** 3 + 0.00000000073 * T ** 4)
+
+    E = 1 - 0.002516 * T - 0.0000074 * T ** 2
+    M = math.radians(2.5534 + 29.10535670 * k - 0.0000014 * T ** 2 - 0.00000011 * T ** 3)
+    Mp = math.radians(201.5643 + 385.81693528 * k + 0.0107582 * T ** 2
+                      + 0.00001238 * T ** 3 - 0.000000058 * T ** 4)
+    F = math.radians(160.7108 + 390.67050284 * k - 0.0016118 * T ** 2
+                     - 0.00000227 * T ** 3 + 0.000000011 * T ** 4)
+    Omega = math.radians(124.7746 - 1.56375588 * k + 0.0020672 * T ** 2 + 0.00000215 * T ** 3)
+
+    for coefficient, e_power, m, mp, f, omega in PHASE_TERMS[phase]:
+        jde += coefficient * E ** e_power * math.sin(m * M + mp * Mp + f * F + omega * Omega)
+
+    if phase in (FIRST_QUARTER, LAST_QUARTER):
+        W = (0.00306 - 0.00038 * E * math.cos(M) + 0.00026 * math.cos(Mp)
+             - 0.00002 * math.cos(Mp - M) + 0.00002 * math.cos(Mp + M) + 0.00002 * math.cos(2 * F))
+        jde += W if phase == FIRST_QUARTER else -W
+
+    for (constant, per_k, per_t2), amplitude in zip(PLANETARY_ARGUMENTS, PLANETARY_AMPLITUDES):
+        jde += amplitude * math.sin(math.radians(constant + per_k * k + per_t2 * T ** 2))
+
+    return jde
+
+
+def phase_instant(k):
+    """UTC datetime of the phase with lunation number k"""
+    jde = phase_jde(k)
+    year = 2000 + k / 12.3685
+    return _from_julian_day(jde - delta_t(year) / 86400)
+
+
+def _lunation(moment):
+    return (_julian_day(moment) - JDE_EPOCH) / SYNODIC_MONTH
+
+
+def phase_events(start, end, phases=(NEW_MOON, FIRST_QUARTER, FULL_MOON, LAST_QUARTER)):
+    """Sorted (datetime, phase) pairs for every phase instant in [start, end)"""
+    events = []
+    k = math.floor(_lunation(start)) - 1
+    while True:
+        for phase in phases:
+            moment = phase_instant(k + phase / 4)
+            if moment >= end:
+                return sorted(events)
+            if moment >= start:
+                events.append((moment, phase))
+        k += 1
+
+
+def year_phases(year):
+    """A year of phase events in the moon-data API's format ([{"Date": ..., "Phase": n}, ...])"""
+    return [
+        {"Date": moment.strftime("%Y-%m-%dT%H:%M:%S"), "Phase": phase}
+        for moment, phase in phase_events(datetime(year, 1, 1), datetime(year + 1, 1, 1))
+    ]
+
+
+def is_full_moon(day):
+    """Whether a full moon falls on the given (UTC) date"""
+    start = datetime(day.year, day.month, day.day)
+    return bool(phase_events(start, start + timedelta(days=1), phases=(FULL_MOON,)))
+
+
+def next_full_moon(after):
+    """The first full moon instant after the given datetime"""
+    k = math.floor(_lunation(after)) - 1
+    while True:
+        moment = phase_instant(k + 0.5)
+        if moment > after:
+            return moment
+        k += 1
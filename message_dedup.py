@@ -0,0 +1,58 @@
+import time
+from local_store import SQLiteStore
+import metrics
+
+
+class SeenMessages(SQLiteStore):
+    """Recently seen webhook message ids, shared by every gunicorn worker.
+
+    Entries expire after `ttl` seconds and the table is trimmed to
+    `max_entries`, so the store stays small however long the server runs.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS seen_messages (
+        message_id TEXT PRIMARY KEY,
+        seen_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS seen_messages_by_time ON seen_messages (seen_at);
+    """
+
+    # Prune expired entries every this many new ids
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, ttl=24 * 60 * 60, max_entries=20000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inserts = 0
+        super().__init__(path)
+
+    def first_sighting(self, message_id):
+        """Record message_id; returns False if it was already seen within the TTL"""
+        now = time.time()
+        cursor = self.connection().execute(
+            """INSERT INTO seen_messages (message_id, seen_at) VALUES (?, ?)
+               ON CONFLICT (message_id) DO UPDATE SET seen_at = excluded.seen_at
+               WHERE seen_messages.seen_at < ?""",
+            (message_id, now, now - self.ttl))
+
+        if cursor.rowcount == 0:
+            metrics.incr("message_dedup.hits")
+            return False
+
+        metrics.incr("message_dedup.misses")
+        self._inserts += 1
+        if self._inserts % self.PRUNE_EVERY == 0:
+            self.prune()
+        return True
+
+    def forget(self, message_id):
+        """Drop an id again, e.g. when the message could not be accepted and will be redelivered"""
+        self.connection().execute("DELETE FROM seen_messages WHERE message_id = ?", (message_id,))
+
+    def prune(self):
+        conn = self.connection()
+        conn.execute("DELETE FROM seen_messages WHERE seen_at < ?", (time.time() - self.ttl,))
+        conn.execute(
+            """DELETE FROM seen_messages WHERE message_id IN (
+                   SELECT message_id FROM seen_messages ORDER BY seen_at DESC LIMIT -1 OFFSET ?)""",
+            (self.max_entries,))
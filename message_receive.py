@@ -1,31 +1,41 @@
 import json
 import logging
-from openai import OpenAI
-import shelve
-import time
+import openai_registry
 from flask import current_app
-import requests
+import http_client
 import re
 from audio_download_decode import download_and_decrypt
-from transcribe import transcribe_audio
+from transcribe import transcribe_audio, get_backend as transcription_backend
+import punctuation
+from local_store import data_path
+from thread_store import ThreadStore
+from transcript_cache import TranscriptCache, media_hash, RAW, PUNCTUATED
+from assistant_runs import run_and_wait, add_message, ConversationLimiter
+from job_queue import complete_current_job
 import os
 
 client = None
 
+# wa_id -> OpenAI thread id, shared by all workers (see migrate_threads_db.py for the old shelve file)
+thread_store = ThreadStore(data_path('threads.sqlite'))
+
+# One assistant run at a time per thread, and a cap on runs in flight in this
+# worker to stay under the OpenAI rate limits when groups are busy
+assistant_runs = ConversationLimiter(int(os.getenv('ASSISTANT_MAX_CONCURRENT_RUNS', 3)))
+
+# Transcripts of voice notes by content hash, so forwarded copies are answered without new API calls
+transcript_cache = TranscriptCache(data_path('transcripts.sqlite'))
+
 def init_openai_client():
     global client
-    if client is None:
-        OPENAI_API_KEY = current_app.config['OPENAI_API_KEY']
-        
-        try:
-            # Basic initialization with the monkey patch in app.py handling the proxies issue
-            client = OpenAI(api_key=OPENAI_API_KEY)
-            logging.info("OpenAI client initialized successfully")
-        except Exception as e:
-            # Log detailed error information
-            logging.error(f"Failed to initialize OpenAI client: {str(e)}")
-            # If initialization fails, log the error and re-raise
-            raise
+    try:
+        # Shared per-process client (the monkey patch in app.py handles the proxies issue)
+        client = openai_registry.get_client(current_app.config['OPENAI_API_KEY'])
+    except Exception as e:
+        # Log detailed error information
+        logging.error(f"Failed to initialize OpenAI client: {str(e)}")
+        # If initialization fails, log the error and re-raise
+        raise
 
 def create_assistant(file):
     """
@@ -40,66 +50,42 @@ def create_assistant(file):
     )
     return assistant
 
-# Use context manager to ensure the shelf file is closed properly
-def check_if_thread_exists(wa_id):
-    with shelve.open("threads_db") as threads_shelf:
-        return threads_shelf.get(wa_id, None)
-
-def store_thread(wa_id, thread_id):
-    with shelve.open("threads_db", writeback=True) as threads_shelf:
-        threads_shelf[wa_id] = thread_id
-
 def run_assistant(thread, name,assistant_id=None):
-    # Retrieve the Assistant
-    assistant = client.beta.assistants.retrieve(assistant_id)
-
-    # Run the assistant
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=assistant.id,
-        # instructions=f"You are having a conversation with {name}",
-    )
+    # Assistant metadata is cached per process, so this is usually free
+    assistant = openai_registry.get_assistant(client, assistant_id)
 
-    # Wait for completion
-    # https://platform.openai.com/docs/assistants/how-it-works/runs-and-run-steps#:~:text=under%20failed_at.-,Polling%20for%20updates,-In%20order%20to
-    while run.status != "completed":
-        # Be nice to the API
-        time.sleep(0.5)
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-
-    # Retrieve the Messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    new_message = messages.data[0].content[0].text.value
+    # Run the assistant and wait for its reply (streamed when possible)
+    new_message = run_and_wait(client, thread.id, assistant.id)
     logging.info(f"Generated message: {new_message}")
     current_app.logger.info(f"Generated message: {new_message}")
     return new_message
 
 
 def generate_response(message_body, wa_id, name, assistant_id=None):
-    # Check if there is already a thread_id for the wa_id
-    thread_id = check_if_thread_exists(wa_id)
-
-    # If a thread doesn't exist, create one and store it
-    if thread_id is None:
+    # Reuse the thread for this wa_id, or create and store one atomically
+    new_threads = {}
+    def create_thread():
         logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
         thread = client.beta.threads.create()
-        store_thread(wa_id, thread.id)
-        thread_id = thread.id
+        new_threads[thread.id] = thread
+        return thread.id
+
+    thread_id, created = thread_store.get_or_create(wa_id, create_thread)
+
+    if created:
+        thread = new_threads[thread_id]
 
     # Otherwise, retrieve the existing thread
     else:
         logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
         thread = client.beta.threads.retrieve(thread_id)
 
-    # Add message to thread
-    message = client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=message_body,
-    )
+    with assistant_runs.hold(thread_id):
+        # Add message to thread
+        add_message(client, thread_id, message_body)
 
-    # Run the assistant and get the new message
-    new_message = run_assistant(thread, name, assistant_id)
+        # Run the assistant and get the new message
+        new_message = run_assistant(thread, name, assistant_id)
 
     return new_message
 
@@ -120,7 +106,9 @@ def send_response(Message, wa_id, is_group):
     
     current_app.logger.info("About to respond to " + wa_id)
     current_app.logger.info(payload)
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
+    # The reply is out: a failure from here on must not retry the job and send it twice
+    complete_current_job()
     
     # Log the full response
     try:
@@ -142,28 +130,52 @@ def clean_string(text):
     return cleaned_text
 
 def punctuate(text):
-    thread_id = "punct_thread" #don't need threading here, just re-use the same one always
-    # Retrieve the Assistant
-    OPENAI_ASSISTANT_ID = current_app.config['OPENAI_ASSISTANT_ID_PUNCT']
-    punctuated_text = generate_response(text, thread_id, "Punctuation", OPENAI_ASSISTANT_ID)
-    return punctuated_text
+    # One stateless call (or nothing, if the transcription backend already punctuates).
+    # Returns (text, ok); ok is False when the raw transcript came back as a fallback
+    return punctuation.punctuate(text, current_app.config['OPENAI_API_KEY'],
+                                 already_punctuated=transcription_backend().punctuated)
     
 def handle_audio_message(audio_data):
     payload_audio = {
         'url': audio_data['URL'],
         'mediaKey': audio_data['mediaKey'],
         'messageType': 'audioMessage',
-        'whatsappTypeMessageToDecode': 'WhatsApp Audio Keys',
         'mimetype': audio_data['mimetype']
     }
-    audio_file = download_and_decrypt(payload_audio)
-    transcript = transcribe_audio(audio_file)
-    punctuated_transcript = punctuate(transcript)
+    # Forwarded voice notes carry the same fileSHA256, so check the cache before downloading
+    audio_hash = media_hash(audio_data)
+    if audio_hash:
+        punctuated_transcript = transcript_cache.get(audio_hash, PUNCTUATED)
+        if punctuated_transcript is not None:
+            return punctuated_transcript
+        transcript = transcript_cache.get(audio_hash, RAW)
+    else:
+        transcript = None
+
+    if transcript is None:
+        # Decrypted audio only ever lives in memory (or shared memory when large)
+        with download_and_decrypt(payload_audio, mode='spooled') as audio_file:
+            # Entries are written under what the audio actually hashes to, so a
+            # message claiming another note's fileSHA256 can't poison that note's entry
+            file_hash = media_hash(audio_file=audio_file)
+            if file_hash != audio_hash:
+                if audio_hash is not None:
+                    current_app.logger.warning(
+                        f"fileSHA256 {audio_hash} does not match the decrypted audio ({file_hash}); caching under the latter")
+                audio_hash = file_hash
+                punctuated_transcript = transcript_cache.get(audio_hash, PUNCTUATED)
+                if punctuated_transcript is not None:
+                    return punctuated_transcript
+                transcript = transcript_cache.get(audio_hash, RAW)
+            if transcript is None:
+                transcript = transcribe_audio(audio_file)
+                transcript_cache.put(audio_hash, RAW, transcript)
+
+    punctuated_transcript, punctuated = punctuate(transcript)
     #punctuated_transcript = transcript
-
-    # Delete the encrypted file after decryption
-    if os.path.exists(audio_file):
-        os.remove(audio_file)    
+    if punctuated:
+        # A fallback to the raw text is not cached, so the next copy gets another try
+        transcript_cache.put(audio_hash, PUNCTUATED, punctuated_transcript)
     return punctuated_transcript
 
 def message_receive(data):
@@ -0,0 +1,42 @@
+"""Import conversation threads from the old shelve `threads_db` into the thread store.
+
+Usage: python migrate_threads_db.py [shelve_path] [--overwrite]
+
+Existing entries in the thread store are kept unless --overwrite is given,
+so the script is safe to run again.
+"""
+import shelve
+import sys
+
+from local_store import data_path
+from thread_store import ThreadStore
+
+DEFAULT_SHELVE_PATH = "threads_db"
+
+
+def migrate(shelve_path, store, overwrite=False):
+    """Copy every wa_id -> thread_id pair; returns (imported, skipped)"""
+    imported = skipped = 0
+    with shelve.open(shelve_path, flag="r") as threads_shelf:
+        for wa_id in threads_shelf.keys():
+            if not overwrite and store.get(wa_id) is not None:
+                skipped += 1
+                continue
+            store.put(wa_id, threads_shelf[wa_id])
+            imported += 1
+    return imported, skipped
+
+
+def main(args):
+    overwrite = "--overwrite" in args
+    paths = [arg for arg in args if arg != "--overwrite"]
+    shelve_path = paths[0] if paths else DEFAULT_SHELVE_PATH
+
+    store = ThreadStore(data_path("threads.sqlite"))
+    imported, skipped = migrate(shelve_path, store, overwrite)
+    print(f"Imported {imported} thread(s) from {shelve_path}, skipped {skipped} already present; "
+          f"{store.count()} thread(s) in {store.path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+import http_client
+from local_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+# Phase numbers used by the moon-data API
+NEW_MOON, FIRST_QUARTER, FULL_MOON, LAST_QUARTER = 0, 1, 2, 3
+
+# A year's phase events: sorted (datetime, phase) pairs, the phases falling on
+# each date, and the sorted full moon instants
+YearIndex = namedtuple("YearIndex", ["events", "by_date", "full_moons"])
+
+
+# Function to dynamically retrieve moon phase data for a given year
+def fetch_moon_phases(year):
+    url = f"https://craigchamberlain.github.io/moon-data/api/moon-phase-data/{year}/"
+    response = http_client.get(url)
+
+    if response.status_code == 200:
+        return response.json()  # Return the parsed JSON data
+    else:
+        raise Exception(f"Failed to retrieve moon phase data. Status code: {response.status_code}")
+
+
+def build_index(entries):
+    events = sorted((datetime.fromisoformat(entry["Date"]), entry["Phase"]) for entry in entries)
+    by_date = {}
+    for moment, phase in events:
+        by_date.setdefault(moment.date(), set()).add(phase)
+    full_moons = [moment for moment, phase in events if phase == FULL_MOON]
+    return YearIndex(events, by_date, full_moons)
+
+
+class MoonPhaseCalendar(SQLiteStore):
+    """Moon phase events, fetched at most once per year and kept on disk.
+
+    Each year is indexed by date when first used, so "is this a full moon"
+    is a dict lookup and "next full moon" a bisect, and both work offline
+    once the year has been stored.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS moon_phase_years (
+        year INTEGER PRIMARY KEY,
+        entries TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path, fetch=fetch_moon_phases):
+        self.fetch = fetch
+        self._years = {}
+        self._lock = threading.Lock()
+        super().__init__(path)
+
+    def year(self, year):
+        """The YearIndex for a year, loading it from disk or fetching it the first time"""
+        index = self._years.get(year)
+        if index is not None:
+            return index
+
+        with self._lock:
+            if year in self._years:
+                return self._years[year]
+            row = self.connection().execute(
+                "SELECT entries FROM moon_phase_years WHERE year = ?", (year,)).fetchone()
+            if row is not None:
+                entries = json.loads(row[0])
+            else:
+                entries = self.fetch(year)
+                self.connection().execute(
+                    "INSERT OR REPLACE INTO moon_phase_years (year, entries, fetched_at) VALUES (?, ?, ?)",
+                    (year, json.dumps(entries), time.time()))
+                logger.info(f"Stored {len(entries)} moon phase events for {year}")
+            index = self._years[year] = build_index(entries)
+        return index
+
+    def is_full_moon(self, day):
+        self.prefetch_next_year(day)
+        return FULL_MOON in self.year(day.year).by_date.get(day, ())
+
+    def next_full_moon(self, after):
+        """The first full moon instant after the given datetime (looking into the next year if needed)"""
+        for year in (after.year, after.year + 1):
+            full_moons = self.year(year).full_moons
+            position = bisect.bisect_right(full_moons, after)
+            if position < len(full_moons):
+                return full_moons[position]
+        return None
+
+    def prefetch_next_year(self, day):
+        """In December, load next year's data in the background so January 1st doesn't wait on it"""
+        if day.month != 12 or day.year + 1 in self._years:
+            return
+
+        def load():
+            try:
+                self.year(day.year + 1)
+            except Exception as e:
+                logger.warning(f"Could not prefetch moon phases for {day.year + 1}: {str(e)}")
+
+        threading.Thread(target=load, name="moon-phase-prefetch", daemon=True).start()
@@ -1,13 +1,39 @@
+import os
 import sys
-import requests
+import http_client
 import json
 import logging
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
 from weather import yesterday_rain_mm
 from flask import current_app
+import metrics
+from local_store import data_path
+from moon_phases import MoonPhaseCalendar, fetch_moon_phases
+from holiday_calendar import HolidayCalendar
+import quote_pool
+import lunar
 
 logger = logging.getLogger(__name__)
 
+# Moon phases are computed locally (lunar.py). With MOON_DATA_CROSS_CHECK=true
+# the remote moon-data API is consulted as well and disagreements are logged;
+# each year of it is downloaded once and kept under DATA_DIR.
+MOON_DATA_CROSS_CHECK = os.getenv('MOON_DATA_CROSS_CHECK', 'false').lower() == 'true'
+moon_calendar = MoonPhaseCalendar(data_path('moon_phases.sqlite'), fetch_moon_phases)
+# Costa Rica's holidays, one abstractapi call per year, kept under DATA_DIR
+holiday_calendar = HolidayCalendar(data_path('holidays.sqlite'), country="CR")
+
+# Longest each section may take; a section that isn't ready by then is left
+# out of the message instead of holding it up
+SECTION_DEADLINES = {
+    "full_moon": 5,
+    "holiday": 5,
+    "quote": 3,
+    "rain": 8,
+}  # seconds
+
 def formatted_today_date(today):
     # Get the current date
     current_date = today
@@ -18,45 +44,27 @@ def formatted_today_date(today):
     return formatted_date
 
 def get_random_quote():
-  response = requests.get('https://zenquotes.io/api/random')
-  data = response.json()[0]
-  quote = data['q'] + ' - ' + data['a']
-  return quote
-
-# Function to dynamically retrieve moon phase data for a given year
-def fetch_moon_phases(year):
-    url = f"https://craigchamberlain.github.io/moon-data/api/moon-phase-data/{year}/"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        return response.json()  # Return the parsed JSON data
-    else:
-        raise Exception(f"Failed to retrieve moon phase data. Status code: {response.status_code}")
+  # Quotes are fetched from zenquotes in batches ahead of time (quote_pool.py)
+  quote = quote_pool.get_pool().take()
+  if quote is None:
+    return None
+  text, author = quote
+  return text + ' - ' + author
 
 def find_next_full_moon():
-    today = datetime.now()
-    current_year = datetime.now().year  # Get the current year dynamically
-    moon_phases = fetch_moon_phases(current_year)
-
-    # Loop through the data and find the next full moon (Phase == 2)
-    for entry in moon_phases:
-        date_obj = datetime.fromisoformat(entry["Date"])
-        if date_obj > today and entry["Phase"] == 2:
-            return date_obj.date()  # Return the date of the next full moon
-    
-    return None
+    # Phase instants are in UTC
+    return lunar.next_full_moon(datetime.now(timezone.utc).replace(tzinfo=None)).date()
 
 # Function to check if today is a full moon (Phase == 2)
 def IsTodayFullMoon(today):
-    current_year = today.year
-    moon_phases = fetch_moon_phases(current_year)
-    
-    # Loop through the data to find if today's date is a full moon (Phase == 2)
-    for entry in moon_phases:
-        date_obj = datetime.fromisoformat(entry["Date"])
-        if date_obj.date() == today and entry["Phase"] == 2:
-            return True
-    return False
+    full_moon = lunar.is_full_moon(today)
+    if MOON_DATA_CROSS_CHECK:
+        try:
+            if moon_calendar.is_full_moon(today) != full_moon:
+                logger.warning(f"Moon-data disagrees with the local calculation about a full moon on {today}")
+        except Exception as e:
+            logger.warning(f"Could not cross-check moon phase with moon-data: {str(e)}")
+    return full_moon
 
 def SendMessage(Message):
     url = "https://mywhinlite.p.rapidapi.com/sendmsg"
@@ -72,39 +80,16 @@ def SendMessage(Message):
     	"Content-Type": "application/json"
     }
     
-    response = requests.post(url, json=payload, headers=headers)
+    response = http_client.post(url, json=payload, headers=headers)
     
     print(response)
 
     return True
 
 def todayHoliday(today):
-    # Get the current date
-    current_date = today
-    year = current_date.year
-    month = current_date.month
-    day = current_date.day
-
-    url = "https://holidays.abstractapi.com/v1/"
-    querystring = {
-        "api_key": current_app.config['ABSTRACT_API_KEY'], 
-        "country": "CR", 
-        "year": year, 
-        "month": month, 
-        "day": day
-    }
-
-    response = requests.get(url, params=querystring)
-
-    if response.status_code == 200:
-        holidays = response.json()
-        if holidays:
-            holiday_name = holidays[0].get("name", "No holiday name found")
-            return holiday_name
-        else:
-            return None
-    else:
-        print(f"Error: {response.status_code}, {response.text}")
+    # Answered from the year's stored holiday list; the API is only called
+    # once a year (and for background refreshes)
+    return holiday_calendar.holiday(today, current_app.config['ABSTRACT_API_KEY'])
 
 def year_progress_no_decimals_string(today):
     # Get the current date and the total number of days in the current year
@@ -140,6 +125,48 @@ def FullMoonMsg(today):
     except Exception as e:
         print(str(e))
 
+def gather_sections(providers, deadlines=SECTION_DEADLINES):
+    """Run the section providers concurrently, each inside the app context.
+
+    Returns (results, timings_ms). A section that raises or misses its
+    deadline comes back as None; the message is never held up longer than
+    the largest deadline.
+    """
+    app = current_app._get_current_object()
+    results = {}
+    timings_ms = {}
+
+    def run(name, provider):
+        start = time.perf_counter()
+        try:
+            with app.app_context():
+                return provider()
+        finally:
+            timings_ms[name] = round((time.perf_counter() - start) * 1000)
+            metrics.observe(f"morning_message.{name}", time.perf_counter() - start)
+
+    # Not used as a context manager: leaving it would wait for providers that hang
+    executor = ThreadPoolExecutor(max_workers=len(providers), thread_name_prefix="morning-message")
+    start = time.monotonic()
+    futures = {name: executor.submit(run, name, provider) for name, provider in providers.items()}
+    executor.shutdown(wait=False)
+
+    for name, future in futures.items():
+        remaining = start + deadlines.get(name, max(deadlines.values())) - time.monotonic()
+        try:
+            results[name] = future.result(timeout=max(0, remaining))
+        except FutureTimeoutError:
+            results[name] = None
+            timings_ms.setdefault(name, "timeout")
+            metrics.incr(f"morning_message.{name}.timeouts")
+            logger.warning(f"Morning message section '{name}' missed its {deadlines.get(name)}s deadline, leaving it out")
+        except Exception as e:
+            results[name] = None
+            metrics.incr(f"morning_message.{name}.errors")
+            logger.warning(f"Morning message section '{name}' failed, leaving it out: {str(e)}")
+
+    return results, dict(timings_ms)
+
 def main(args):
     today = datetime.now().date()
 
@@ -150,18 +177,28 @@ def main(args):
     # Call the updated function and assign the strings to variables
     formatted_date = formatted_today_date(today)
     days_left_str, percentage_passed_str = year_progress_no_decimals_string(today)
-    full_moon_str = FullMoonMsg(today)
-    today_holiday_str = todayHoliday(today)
-    get_random_quote_str = get_random_quote()
-    yesterday_rain = yesterday_rain_mm()
+
+    # The third-party lookups run side by side; total time is bounded by the slowest deadline
+    sections, timings_ms = gather_sections({
+        "full_moon": lambda: FullMoonMsg(today),
+        "holiday": lambda: todayHoliday(today),
+        "quote": get_random_quote,
+        "rain": yesterday_rain_mm,
+    })
+    logger.info(f"Morning message sections took (ms): {timings_ms}")
+    full_moon_str = sections["full_moon"]
+    today_holiday_str = sections["holiday"]
+    get_random_quote_str = sections["quote"]
+    yesterday_rain = sections["rain"]
 
     # Create morning message with conditionally including the full moon message
     morning_message = (
         formatted_date + "\n" 
         + days_left_str + "\n" 
         + percentage_passed_str + "\n" 
-        + "Yesterday we had " + str(yesterday_rain) + "mm of rain." + "\n"
     )
+    if yesterday_rain is not None:
+        morning_message += "Yesterday we had " + str(yesterday_rain) + "mm of rain." + "\n"
 
     if full_moon_str:
         morning_message += "\n" + full_moon_str
@@ -175,5 +212,6 @@ def main(args):
 
     return {
         "statusCode": 200,
-        "body": json.dumps("ok")  # Explicitly make the body JSON serializable
+        "body": json.dumps("ok"),  # Explicitly make the body JSON serializable
+        "timings_ms": timings_ms
     }
\ No newline at end of file
@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+import time
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+# How long retrieved assistant metadata is reused before it is fetched again
+ASSISTANT_TTL = 60 * 60  # seconds
+
+# One OpenAI client per API key and one copy of each assistant's metadata
+# per process. The client owns an HTTP connection pool, so it is created
+# lazily in each worker (never inherited across a fork) and then shared by
+# every request thread.
+_lock = threading.Lock()
+_pid = None
+_clients = {}
+_assistants = {}
+
+
+def _reset_after_fork():
+    global _pid
+    if _pid != os.getpid():
+        _clients.clear()
+        _assistants.clear()
+        _pid = os.getpid()
+
+
+def get_client(api_key):
+    """The shared OpenAI client for api_key in this process"""
+    with _lock:
+        _reset_after_fork()
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = OpenAI(api_key=api_key)
+            logger.info("OpenAI client initialized successfully")
+        return client
+
+
+def get_assistant(client, assistant_id, ttl=ASSISTANT_TTL):
+    """Assistant metadata, retrieved at most once per ttl.
+
+    If refreshing fails the previous copy is kept, since assistants rarely change.
+    """
+    with _lock:
+        _reset_after_fork()
+        cached = _assistants.get(assistant_id)
+    if cached is not None and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+
+    try:
+        assistant = client.beta.assistants.retrieve(assistant_id)
+    except Exception as e:
+        if cached is None:
+            raise
+        logger.warning(f"Keeping cached assistant {assistant_id}, refresh failed: {str(e)}")
+        assistant = cached[0]
+
+    with _lock:
+        _assistants[assistant_id] = (assistant, time.monotonic())
+    return assistant
+
+
+def prime(api_key, assistant_ids):
+    """Create the client and fetch the assistants up front, e.g. when a worker boots"""
+    if not api_key:
+        return
+    assistant_ids = [assistant_id for assistant_id in assistant_ids if assistant_id]
+    try:
+        client = get_client(api_key)
+        for assistant_id in assistant_ids:
+            get_assistant(client, assistant_id)
+        logger.info(f"Primed OpenAI client and {len(assistant_ids)} assistant(s)")
+    except Exception as e:
+        logger.warning(f"Could not prime OpenAI client: {str(e)}")
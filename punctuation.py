@@ -0,0 +1,146 @@
+import logging
+import os
+import threading
+import time
+import openai_registry
+import metrics
+
+try:
+    from deepmultilingualpunctuation import PunctuationModel
+except ImportError:
+    PunctuationModel = None
+
+logger = logging.getLogger(__name__)
+
+# Longest a voice note reply may wait on punctuation before the raw transcript is sent instead
+PUNCTUATION_BUDGET = float(os.getenv('PUNCTUATION_BUDGET', 10))  # seconds
+
+PUNCTUATION_PROMPT = (
+    "Add punctuation and capitalization to the voice note transcript you are given. "
+    "Do not add, remove, reword or translate anything. Reply with the corrected text only."
+)
+
+
+class PunctuationBackend:
+    name = "base"
+
+    def warm_up(self):
+        """Load whatever the backend needs before the first request"""
+
+    def punctuate(self, text, api_key, timeout):
+        raise NotImplementedError
+
+
+class OpenAIPunctuation(PunctuationBackend):
+    """One stateless chat completion per transcript; no thread, no assistant run"""
+    name = "openai"
+
+    def __init__(self, model="gpt-4o-mini"):
+        self.model = model
+
+    def punctuate(self, text, api_key, timeout):
+        client = openai_registry.get_client(api_key).with_options(timeout=timeout, max_retries=0)
+        completion = client.chat.completions.create(
+            model=self.model,
+            temperature=0,
+            messages=[
+                {"role": "system", "content": PUNCTUATION_PROMPT},
+                {"role": "user", "content": text},
+            ],
+        )
+        return completion.choices[0].message.content.strip()
+
+
+class LocalPunctuation(PunctuationBackend):
+    """Punctuation restoration with a local model (deepmultilingualpunctuation), loaded once per worker"""
+    name = "local"
+
+    def __init__(self):
+        if PunctuationModel is None:
+            raise RuntimeError("deepmultilingualpunctuation is not installed (pip install deepmultilingualpunctuation)")
+        self._model = None
+        self._lock = threading.Lock()
+
+    def warm_up(self):
+        with self._lock:
+            if self._model is None:
+                self._model = PunctuationModel()
+
+    def punctuate(self, text, api_key, timeout):
+        self.warm_up()
+        return self._model.restore_punctuation(text)
+
+
+class NoPunctuation(PunctuationBackend):
+    name = "none"
+
+    def punctuate(self, text, api_key, timeout):
+        return text
+
+
+def create_punctuation_backend(kind='openai'):
+    """Build the configured backend, falling back to the OpenAI call"""
+    if kind == 'local':
+        try:
+            return LocalPunctuation()
+        except RuntimeError as e:
+            logger.warning(f"Could not use local punctuation, using OpenAI: {str(e)}")
+    elif kind == 'none':
+        return NoPunctuation()
+    elif kind != 'openai':
+        logger.warning(f"Unknown PUNCTUATION_BACKEND '{kind}', using OpenAI")
+    return OpenAIPunctuation(os.getenv('PUNCTUATION_MODEL', 'gpt-4o-mini'))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The punctuation backend for this process, chosen by PUNCTUATION_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_punctuation_backend(os.getenv('PUNCTUATION_BACKEND', 'openai'))
+        return _backend
+
+
+def warm_up():
+    """Load a local punctuation model up front, e.g. when a gunicorn worker boots"""
+    try:
+        get_backend().warm_up()
+    except Exception as e:
+        logger.warning(f"Could not warm up punctuation backend: {str(e)}")
+
+
+def punctuate(text, api_key=None, already_punctuated=False, budget=PUNCTUATION_BUDGET):
+    """Punctuate a transcript, returning (text, ok).
+
+    ok is False when punctuation failed or came back empty and the raw
+    transcript is returned instead, so callers don't keep that as final.
+    budget is the OpenAI request timeout, so a slow call fails over to the
+    raw transcript; local models are only reported when they overrun it.
+    """
+    if already_punctuated or not text or not text.strip():
+        metrics.incr("punctuation.skipped")
+        return text, True
+
+    backend = get_backend()
+    start = time.perf_counter()
+    try:
+        punctuated = backend.punctuate(text, api_key, budget)
+    except Exception as e:
+        metrics.incr("punctuation.fallbacks")
+        logger.warning(f"Punctuation failed, sending the raw transcript: {str(e)}")
+        return text, False
+    finally:
+        metrics.observe(f"punctuation.{backend.name}", time.perf_counter() - start)
+
+    elapsed = time.perf_counter() - start
+    if elapsed > budget:
+        logger.warning(f"Punctuation took {elapsed:.1f}s, over its {budget:.0f}s budget")
+    if not punctuated:
+        metrics.incr("punctuation.fallbacks")
+        logger.warning("Punctuation came back empty, sending the raw transcript")
+        return text, False
+    return punctuated, True
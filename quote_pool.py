@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+import http_client
+from local_store import SQLiteStore, data_path
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ZENQUOTES_BATCH_URL = "https://zenquotes.io/api/quotes"
+
+# Refill in the background once fewer unused quotes than this are left
+LOW_WATERMARK = 20
+# A quote handed out is not repeated for this long
+RECENT_WINDOW = 180 * 24 * 60 * 60  # seconds
+
+
+def fetch_quotes():
+    """A batch of quotes from zenquotes (about 50 per call), as (text, author) pairs"""
+    response = http_client.get(ZENQUOTES_BATCH_URL)
+    if response.status_code != 200:
+        raise Exception(f"zenquotes returned {response.status_code}: {response.text[:200]}")
+    quotes = []
+    for entry in response.json():
+        # When rate limited, zenquotes answers with a notice dressed up as a quote
+        if entry.get('a') == 'zenquotes.io' or not entry.get('q'):
+            continue
+        quotes.append((entry['q'], entry['a']))
+    return quotes
+
+
+class QuotePool(SQLiteStore):
+    """Quotes fetched in batches ahead of time and handed out from disk.
+
+    Quotes are deduplicated on (text, author); taking one marks it used, and
+    used quotes come back only after RECENT_WINDOW. When the unused supply
+    drops below the low watermark a refill runs in a background thread, so
+    sending a quote never waits on the network unless the pool is empty.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS quotes (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        author TEXT NOT NULL,
+        added_at REAL NOT NULL,
+        used_at REAL,
+        UNIQUE (text, author)
+    );
+    CREATE INDEX IF NOT EXISTS quotes_used_at ON quotes (used_at);
+    """
+
+    def __init__(self, path, fetch=fetch_quotes, low_watermark=LOW_WATERMARK, recent_window=RECENT_WINDOW):
+        self.fetch = fetch
+        self.low_watermark = low_watermark
+        self.recent_window = recent_window
+        self._refill_lock = threading.Lock()
+        super().__init__(path)
+
+    def add(self, quotes):
+        """Store (text, author) pairs, ignoring ones already in the pool; returns how many were new"""
+        now = time.time()
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO quotes (text, author, added_at) VALUES (?, ?, ?)",
+                [(text, author, now) for text, author in quotes])
+            return conn.total_changes - before
+
+    def available(self):
+        """Quotes that can be handed out now (never used, or not used recently)"""
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM quotes WHERE used_at IS NULL OR used_at < ?",
+            (time.time() - self.recent_window,)).fetchone()[0]
+
+    def refill(self):
+        """Fetch a batch and add it; does nothing if a refill is already running"""
+        if not self._refill_lock.acquire(blocking=False):
+            return 0
+        try:
+            with metrics.timed("quote_pool.refill"):
+                added = self.add(self.fetch())
+            logger.info(f"Added {added} new quotes to the pool")
+            return added
+        except Exception as e:
+            metrics.incr("quote_pool.refill_errors")
+            logger.warning(f"Could not refill the quote pool: {str(e)}")
+            return 0
+        finally:
+            self._refill_lock.release()
+
+    def refill_if_low(self, background=True):
+        if self.available() >= self.low_watermark:
+            return
+        if background:
+            threading.Thread(target=self.refill, name="quote-pool-refill", daemon=True).start()
+        else:
+            self.refill()
+
+    def _take(self):
+        now = time.time()
+        with self.transaction() as conn:
+            # Never-used quotes first (in random order), then the ones used longest ago
+            row = conn.execute(
+                "SELECT id, text, author FROM quotes WHERE used_at IS NULL OR used_at < ? "
+                "ORDER BY used_at IS NOT NULL, used_at, random() LIMIT 1",
+                (now - self.recent_window,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE quotes SET used_at = ? WHERE id = ?", (now, row[0]))
+        return row[1], row[2]
+
+    def take(self):
+        """A (text, author) quote not handed out recently, or None if none could be had"""
+        quote = self._take()
+        if quote is None:
+            # Empty pool (first run, or everything used recently): fetch while the caller waits
+            metrics.incr("quote_pool.misses")
+            self.refill()
+            quote = self._take()
+        else:
+            metrics.incr("quote_pool.hits")
+        self.refill_if_low()
+        return quote
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The quote pool for this process, stored under DATA_DIR and opened on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = QuotePool(data_path('quotes.sqlite'))
+        return _pool
@@ -0,0 +1,51 @@
+import threading
+from concurrent.futures import Future
+import metrics
+
+
+class SingleFlight:
+    """Run at most one call per key at a time; concurrent callers share its Future.
+
+    Counts `<name>.started` and `<name>.coalesced` in metrics so a burst of
+    callers can be checked against the number of calls that actually ran.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def submit(self, key, fn):
+        """Start fn in a background thread unless a call for key is already in flight"""
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                metrics.incr(f"{self.name}.coalesced")
+                return future
+            future = self._flights[key] = Future()
+
+        metrics.incr(f"{self.name}.started")
+        thread = threading.Thread(target=self._run, args=(key, fn, future))
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._flights
+
+    def _run(self, key, fn, future):
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+        else:
+            self._finish(key)
+            future.set_result(result)
+
+    def _finish(self, key):
+        # Drop the flight before publishing the result so a caller that sees
+        # the outcome and still finds the cache stale can start a new one
+        with self._lock:
+            self._flights.pop(key, None)
@@ -0,0 +1,68 @@
+import unittest
+from airtable_directory import (
+    fetch_directory_snapshot, merge_records, modified_since_formula, DirectoryFetchError
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class FakeSession:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.calls.append(dict(params))
+        return self.pages[len(self.calls) - 1]
+
+
+class TestFetchDirectorySnapshot(unittest.TestCase):
+
+    def test_follows_offset_until_last_page(self):
+        session = FakeSession([
+            FakeResponse(200, {"records": [{"id": "rec1"}, {"id": "rec2"}], "offset": "itr1"}),
+            FakeResponse(200, {"records": [{"id": "rec3"}], "offset": "itr2"}),
+            FakeResponse(200, {"records": [{"id": "rec4"}]}),
+        ])
+        snapshot = fetch_directory_snapshot("appX", "main-directory", "token", session=session)
+
+        self.assertEqual([r["id"] for r in snapshot["records"]], ["rec1", "rec2", "rec3", "rec4"])
+        self.assertNotIn("offset", session.calls[0])
+        self.assertEqual(session.calls[1]["offset"], "itr1")
+        self.assertEqual(session.calls[2]["offset"], "itr2")
+
+    def test_failed_page_raises_instead_of_returning_partial_data(self):
+        session = FakeSession([
+            FakeResponse(200, {"records": [{"id": "rec1"}], "offset": "itr1"}),
+            FakeResponse(429, {"error": "rate limited"}),
+        ])
+        with self.assertRaises(DirectoryFetchError):
+            fetch_directory_snapshot("appX", "main-directory", "token", session=session)
+
+
+class TestDeltaHelpers(unittest.TestCase):
+
+    def test_merge_replaces_in_place_and_appends_new(self):
+        records = [{"id": "rec1", "v": 1}, {"id": "rec2", "v": 1}]
+        merged = merge_records(records, [{"id": "rec2", "v": 2}, {"id": "rec3", "v": 1}])
+        self.assertEqual(merged, [{"id": "rec1", "v": 1}, {"id": "rec2", "v": 2}, {"id": "rec3", "v": 1}])
+
+    def test_merge_drops_ids_missing_upstream(self):
+        records = [{"id": "rec1"}, {"id": "rec2"}]
+        self.assertEqual(merge_records(records, [], keep_ids={"rec2"}), [{"id": "rec2"}])
+
+    def test_modified_since_formula(self):
+        self.assertEqual(modified_since_formula(0),
+                         "IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('1970-01-01T00:00:00.000Z'))")
+        self.assertEqual(modified_since_formula(0, "Last Modified"),
+                         "IS_AFTER({Last Modified}, DATETIME_PARSE('1970-01-01T00:00:00.000Z'))")
+
+if __name__ == '__main__':
+    unittest.main()
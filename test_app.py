@@ -0,0 +1,64 @@
+import gzip
+import time
+import unittest
+from unittest import mock
+import app as server
+from directory_cache import MemoryCacheBackend, CacheEntry
+
+RECORDS = {"records": [{"id": "rec1", "fields": {"Title": "Soda Machu"}}]}
+
+
+class TestGetDirectoryData(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCacheBackend()
+        self.cache.put(RECORDS, time.time())
+        patcher = mock.patch.object(server, "directory_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = server.app.test_client()
+
+    def test_serves_identity_body_with_etag(self):
+        response = self.client.get("/get_directory_data")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), RECORDS)
+        self.assertIsNone(response.headers.get("Content-Encoding"))
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.get_etag()[0], self.cache.get().etag)
+
+    def test_negotiates_brotli_then_gzip(self):
+        entry = self.cache.get()
+        self.cache._entry = entry._replace(encoded=dict(entry.encoded, br=b"brotli bytes"))
+
+        response = self.client.get("/get_directory_data", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(response.data, b"brotli bytes")
+        self.assertEqual(response.get_etag()[0], f"{entry.etag}-br")
+
+        response = self.client.get("/get_directory_data", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.data), entry.body)
+        self.assertEqual(response.get_etag()[0], f"{entry.etag}-gzip")
+
+    def test_if_none_match_returns_304_per_representation(self):
+        etag = self.client.get("/get_directory_data", headers={"Accept-Encoding": "gzip"}).get_etag()[0]
+
+        response = self.client.get("/get_directory_data",
+                                   headers={"Accept-Encoding": "gzip", "If-None-Match": f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        # The gzip ETag doesn't validate the identity body
+        response = self.client.get("/get_directory_data", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_empty_cache_serves_no_records(self):
+        self.cache._entry = CacheEntry(None, time.time(), 0, None, None, {})
+        with mock.patch.object(server, "start_directory_refresh") as refresh:
+            refresh.return_value.result.return_value = None
+            response = self.client.get("/get_directory_data")
+        self.assertEqual(response.get_json(), {"records": []})
+
+
+if __name__ == '__main__':
+    unittest.main()
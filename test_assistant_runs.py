@@ -0,0 +1,176 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import assistant_runs
+from assistant_runs import run_and_wait, add_message, ConversationLimiter, RunFailed
+
+
+def text_message(value, message_id="msg_1"):
+    return SimpleNamespace(id=message_id, content=[SimpleNamespace(type="text", text=SimpleNamespace(value=value))])
+
+
+def event(name, data=None):
+    return SimpleNamespace(event=name, data=data)
+
+
+class FakeStream:
+    def __init__(self, events):
+        self.events = events
+
+    def __enter__(self):
+        return iter(self.events)
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeRuns:
+    def __init__(self, statuses=(), events=None):
+        self.statuses = list(statuses)
+        self.cancelled = []
+        self.retrieves = 0
+        if events is not None:
+            self.stream = lambda **kwargs: FakeStream(events)
+
+    def create(self, thread_id, assistant_id):
+        return SimpleNamespace(id="run_1", status=self.statuses.pop(0))
+
+    def retrieve(self, thread_id, run_id):
+        self.retrieves += 1
+        return SimpleNamespace(id=run_id, status=self.statuses.pop(0), last_error=None)
+
+    def cancel(self, thread_id, run_id):
+        self.cancelled.append(run_id)
+
+
+def fake_client(runs, reply="Hola!"):
+    messages = SimpleNamespace(list=lambda **kwargs: SimpleNamespace(data=[text_message(reply)]))
+    return SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs, messages=messages)))
+
+
+class TestStreamedRuns(unittest.TestCase):
+
+    def test_returns_completed_message(self):
+        runs = FakeRuns(events=[
+            event("thread.run.created", SimpleNamespace(id="run_1")),
+            event("thread.message.delta"),
+            event("thread.message.completed", text_message("Hola!")),
+            event("thread.run.completed", SimpleNamespace(id="run_1", status="completed")),
+        ])
+        self.assertEqual(run_and_wait(fake_client(runs), "thread_1", "asst_1"), "Hola!")
+
+    def test_failed_run_raises(self):
+        runs = FakeRuns(events=[
+            event("thread.run.created", SimpleNamespace(id="run_1")),
+            event("thread.run.failed", SimpleNamespace(id="run_1", status="failed", last_error="rate_limit")),
+        ])
+        with self.assertRaises(RunFailed):
+            run_and_wait(fake_client(runs), "thread_1", "asst_1")
+        self.assertEqual(runs.cancelled, [])
+
+    def test_requires_action_cancels_run(self):
+        runs = FakeRuns(events=[
+            event("thread.run.created", SimpleNamespace(id="run_1")),
+            event("thread.run.requires_action", SimpleNamespace(id="run_1", status="requires_action")),
+        ])
+        with self.assertRaises(RunFailed):
+            run_and_wait(fake_client(runs), "thread_1", "asst_1")
+        self.assertEqual(runs.cancelled, ["run_1"])
+
+    def test_broken_stream_cancels_run(self):
+        def events():
+            yield event("thread.run.created", SimpleNamespace(id="run_1"))
+            yield event("thread.message.delta")
+            raise ConnectionResetError("connection reset by peer")
+
+        runs = FakeRuns(events=events())
+        with self.assertRaises(ConnectionResetError):
+            run_and_wait(fake_client(runs), "thread_1", "asst_1")
+        self.assertEqual(runs.cancelled, ["run_1"])
+
+
+@mock.patch.object(assistant_runs.time, "sleep", lambda seconds: None)
+class TestPolledRuns(unittest.TestCase):
+
+    def test_polls_until_completed(self):
+        runs = FakeRuns(statuses=["queued", "in_progress", "completed"])
+        self.assertEqual(run_and_wait(fake_client(runs), "thread_1", "asst_1"), "Hola!")
+        self.assertEqual(runs.retrieves, 2)
+
+    def test_terminal_state_stops_polling(self):
+        for status in ["failed", "expired", "cancelled"]:
+            runs = FakeRuns(statuses=["queued", status, "completed"])
+            with self.assertRaises(RunFailed):
+                run_and_wait(fake_client(runs), "thread_1", "asst_1")
+            self.assertEqual(runs.cancelled, [])
+
+    def test_requires_action_cancels_run(self):
+        runs = FakeRuns(statuses=["queued", "requires_action"])
+        with self.assertRaises(RunFailed):
+            run_and_wait(fake_client(runs), "thread_1", "asst_1")
+        self.assertEqual(runs.cancelled, ["run_1"])
+
+    def test_deadline_cancels_run(self):
+        runs = FakeRuns(statuses=["queued"])
+        with self.assertRaises(RunFailed):
+            run_and_wait(fake_client(runs), "thread_1", "asst_1", deadline_seconds=0.1)
+        self.assertEqual(runs.cancelled, ["run_1"])
+
+class TestConversationLimiter(unittest.TestCase):
+
+    def run_holders(self, limiter, keys):
+        active = {"total": 0, "max_total": 0, "per_key": {}, "max_per_key": 0}
+        lock = threading.Lock()
+
+        def hold(key):
+            with limiter.hold(key):
+                with lock:
+                    active["total"] += 1
+                    active["per_key"][key] = active["per_key"].get(key, 0) + 1
+                    active["max_total"] = max(active["max_total"], active["total"])
+                    active["max_per_key"] = max(active["max_per_key"], active["per_key"][key])
+                time.sleep(0.02)
+                with lock:
+                    active["total"] -= 1
+                    active["per_key"][key] -= 1
+
+        threads = [threading.Thread(target=hold, args=(key,)) for key in keys]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return active
+
+    def test_same_conversation_runs_one_at_a_time(self):
+        active = self.run_holders(ConversationLimiter(max_runs=4), ["thread_1"] * 4)
+        self.assertEqual(active["max_per_key"], 1)
+
+    def test_concurrent_runs_are_capped(self):
+        limiter = ConversationLimiter(max_runs=2)
+        active = self.run_holders(limiter, [f"thread_{n}" for n in range(6)])
+        self.assertEqual(active["max_total"], 2)
+        self.assertEqual(limiter._conversations, {})
+
+
+@mock.patch.object(assistant_runs.time, "sleep", lambda seconds: None)
+class TestAddMessage(unittest.TestCase):
+
+    def client_failing(self, errors):
+        def create(**kwargs):
+            if errors:
+                raise errors.pop(0)
+            return "msg_1"
+        return SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(messages=SimpleNamespace(create=create))))
+
+    def test_retries_while_another_run_is_active(self):
+        busy = Exception("Can't add messages to thread_1 while a run run_1 is active.")
+        self.assertEqual(add_message(self.client_failing([busy, busy]), "thread_1", "hola"), "msg_1")
+
+    def test_other_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            add_message(self.client_failing([ValueError("bad request")]), "thread_1", "hola")
+
+if __name__ == '__main__':
+    unittest.main()
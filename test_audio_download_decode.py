@@ -0,0 +1,145 @@
+import base64
+import glob
+import hashlib
+import hmac
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+from audio_download_decode import (
+    hkdf, decrypt_stream, download_and_decrypt, decrypt_media_file, expand_media_key, app_info_for, MediaIntegrityError
+)
+
+APP_INFO = b"WhatsApp Audio Keys"
+
+
+def encrypt_media(plaintext, app_info=APP_INFO):
+    """Encrypt like WhatsApp does; returns (base64 media key, encrypted body)"""
+    media_key = os.urandom(32)
+    expanded = hkdf(media_key, 112, app_info)
+    iv, cipher_key, mac_key = expanded[:16], expanded[16:48], expanded[48:80]
+    ciphertext = AES.new(cipher_key, AES.MODE_CBC, iv).encrypt(pad(plaintext, AES.block_size))
+    mac = hmac.new(mac_key, iv + ciphertext, hashlib.sha256).digest()[:10]
+    return base64.b64encode(media_key).decode(), ciphertext + mac
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestDecryptStream(unittest.TestCase):
+
+    def test_any_chunking_gives_the_original_plaintext(self):
+        for length in [0, 1, 15, 16, 17, 1000, 70000]:
+            plaintext = os.urandom(length)
+            media_key, body = encrypt_media(plaintext)
+            for size in [1, 7, 16, 26, 4096, len(body)]:
+                output = io.BytesIO()
+                self.assertEqual(decrypt_stream(media_key, APP_INFO, chunked(body, size), output), length)
+                self.assertEqual(output.getvalue(), plaintext)
+
+    def test_tampered_media_is_rejected(self):
+        media_key, body = encrypt_media(os.urandom(5000))
+        corrupt = bytearray(body)
+        corrupt[100] ^= 1
+        with self.assertRaises(MediaIntegrityError):
+            decrypt_stream(media_key, APP_INFO, chunked(bytes(corrupt), 1024), io.BytesIO())
+
+    def test_truncated_media_is_rejected(self):
+        media_key, body = encrypt_media(os.urandom(5000))
+        for truncated in [body[:-1], body[:-26], body[:5], b""]:
+            with self.assertRaises(MediaIntegrityError):
+                decrypt_stream(media_key, APP_INFO, chunked(truncated, 1024), io.BytesIO())
+
+    def test_wrong_app_info_is_rejected(self):
+        media_key, body = encrypt_media(os.urandom(100))
+        with self.assertRaises(MediaIntegrityError):
+            decrypt_stream(media_key, b"WhatsApp Image Keys", [body], io.BytesIO())
+
+class TestDecryptMediaFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.encrypted_path = os.path.join(self.tmpdir.name, 'media.enc')
+        self.output_path = os.path.join(self.tmpdir.name, 'media.jpg')
+
+    def write_encrypted(self, body):
+        with open(self.encrypted_path, 'wb') as file:
+            file.write(body)
+
+    def test_decrypts_other_media_types(self):
+        plaintext = os.urandom(200000)
+        app_info = app_info_for('imageMessage')
+        media_key, body = encrypt_media(plaintext, app_info)
+        self.write_encrypted(body)
+
+        decrypt_media_file(media_key, self.encrypted_path, self.output_path, app_info)
+        with open(self.output_path, 'rb') as file:
+            self.assertEqual(file.read(), plaintext)
+        self.assertFalse(os.path.exists(self.encrypted_path))
+
+    def test_corrupt_file_is_rejected_before_decrypting(self):
+        media_key, body = encrypt_media(os.urandom(5000))
+        self.write_encrypted(body[:-1] + bytes([body[-1] ^ 1]))
+
+        with self.assertRaises(MediaIntegrityError):
+            decrypt_media_file(media_key, self.encrypted_path, self.output_path, APP_INFO)
+        self.assertFalse(os.path.exists(self.output_path))
+
+    def test_key_expansion_is_cached(self):
+        media_key, _ = encrypt_media(b"")
+        expand_media_key(media_key, APP_INFO)
+        hits = expand_media_key.cache_info().hits
+        expand_media_key(media_key, APP_INFO)
+        self.assertEqual(expand_media_key.cache_info().hits, hits + 1)
+
+    def test_unknown_media_type(self):
+        with self.assertRaises(ValueError):
+            app_info_for('pollCreationMessage')
+
+class FakeMediaResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        return chunked(self.body, chunk_size)
+
+
+class TestDownloadAndDecrypt(unittest.TestCase):
+
+    def download(self, body, media_key, mode):
+        payload = {'url': 'https://mmg.whatsapp.net/media.enc', 'mediaKey': media_key,
+                   'messageType': 'audioMessage', 'mimetype': 'audio/ogg; codecs=opus', 'filename': 'voice'}
+        with mock.patch('audio_download_decode.http_client.get', return_value=FakeMediaResponse(body)):
+            return download_and_decrypt(payload, mode=mode)
+
+    def test_in_memory_modes_write_nothing_to_decoded(self):
+        plaintext = os.urandom(100000)
+        media_key, body = encrypt_media(plaintext)
+        before = set(glob.glob('decoded/*'))
+        for mode in ['memory', 'spooled']:
+            with self.download(body, media_key, mode) as audio:
+                self.assertEqual(audio.name, 'voice.oga')
+                self.assertEqual(audio.read(), plaintext)
+        self.assertEqual(set(glob.glob('decoded/*')), before)
+
+    def test_corrupt_download_raises(self):
+        media_key, body = encrypt_media(os.urandom(1000))
+        with self.assertRaises(MediaIntegrityError):
+            self.download(body[:-1], media_key, 'spooled')
+
+if __name__ == '__main__':
+    unittest.main()
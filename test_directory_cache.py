@@ -0,0 +1,212 @@
+import gzip
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from directory_cache import (
+    MemoryCacheBackend, SQLiteCacheBackend, apply_changes, body_etag, serialize_snapshot, splice_records
+)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class BackendContract:
+    """Checks every cache backend has to pass"""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+
+    def test_put_then_get(self):
+        self.assertIsNone(self.backend.get().data)
+        started_at = time.time()
+        self.backend.put({"records": [{"id": "rec1"}]}, started_at)
+        entry = self.backend.get()
+        self.assertEqual(entry.data, {"records": [{"id": "rec1"}]})
+        self.assertEqual(entry.last_updated, started_at)
+
+    def test_put_stores_serialized_and_compressed_body(self):
+        self.backend.put({"records": [{"id": "rec1"}]}, time.time())
+        entry = self.backend.get()
+        self.assertEqual(entry.body, b'{"records":[{"id":"rec1"}]}')
+        self.assertEqual(gzip.decompress(entry.encoded['gzip']), entry.body)
+        self.assertEqual(entry.etag, body_etag(serialize_snapshot(entry.data)[0]))
+
+    def test_invalidate_marks_stale_but_keeps_data(self):
+        self.backend.put({"records": []}, time.time())
+        self.backend.invalidate()
+        entry = self.backend.get()
+        self.assertEqual(entry.last_updated, 0)
+        self.assertEqual(entry.data, {"records": []})
+
+    def test_invalidate_during_refresh_keeps_result_stale(self):
+        started_at = time.time() - 1
+        self.backend.invalidate()
+        self.backend.put({"records": []}, started_at)
+        self.assertEqual(self.backend.get().last_updated, 0)
+
+    def test_apply_writes_through_and_bumps_version(self):
+        self.assertFalse(self.backend.apply(upserts=[{"id": "rec9"}]))
+        started_at = time.time()
+        self.backend.put({"records": [{"id": "rec1", "v": 1}, {"id": "rec2"}]}, started_at)
+        version = self.backend.get().version
+
+        self.assertTrue(self.backend.apply(upserts=[{"id": "rec1", "v": 2}, {"id": "rec3"}], deletes=["rec2"]))
+        entry = self.backend.get()
+        self.assertEqual(entry.data, {"records": [{"id": "rec1", "v": 2}, {"id": "rec3"}]})
+        self.assertEqual(entry.version, version + 1)
+        self.assertEqual(entry.last_updated, started_at)
+        self.assertEqual(entry.body, serialize_snapshot(entry.data)[0])
+        self.assertEqual(entry.etag, body_etag(entry.body))
+
+        # Compression happens in the background; brotli waits for the next refresh
+        self.assertTrue(wait_for(lambda: 'gzip' in self.backend.get().encoded))
+        entry = self.backend.get()
+        self.assertEqual(gzip.decompress(entry.encoded['gzip']), entry.body)
+        self.assertNotIn('br', entry.encoded)
+
+    def test_delete_during_a_refresh_is_not_undone(self):
+        self.backend.put({"records": [{"id": "rec1"}, {"id": "rec2", "v": 1}]}, time.time() - 20)
+        started_at = time.time() - 1
+        fetched = {"records": [{"id": "rec1"}, {"id": "rec2", "v": 1}, {"id": "rec3"}]}
+
+        self.backend.apply(deletes=["rec1"])
+        self.backend.apply(upserts=[{"id": "rec2", "v": 2}])
+        self.backend.put(fetched, started_at, reconciled=False)
+
+        entry = self.backend.get()
+        self.assertEqual(entry.data, {"records": [{"id": "rec2", "v": 2}, {"id": "rec3"}]})
+        self.assertEqual(entry.body, serialize_snapshot(entry.data)[0])
+        self.assertEqual(entry.last_updated, 0)
+
+        # Writes older than the refresh are already in what it fetched
+        self.backend.put({"records": [{"id": "rec4"}]}, time.time() + 1)
+        self.assertEqual(self.backend.get().data, {"records": [{"id": "rec4"}]})
+
+    def test_refresh_started_before_a_write_stays_stale(self):
+        started_at = time.time() - 1
+        self.backend.put({"records": []}, started_at - 10)
+        self.backend.apply(upserts=[{"id": "rec1"}])
+        self.backend.put({"records": []}, started_at)
+        self.assertEqual(self.backend.get().last_updated, 0)
+
+    def test_sync_state_tracks_delta_and_reconciled_refreshes(self):
+        self.backend.put({"records": []}, 100)
+        self.assertEqual(self.backend.sync_state(), (100, 100))
+        self.backend.put({"records": [{"id": "rec1"}]}, 200, reconciled=False)
+        self.assertEqual(self.backend.sync_state(), (200, 100))
+
+        version = self.backend.get().version
+        self.backend.touch(300)
+        entry = self.backend.get()
+        self.assertEqual((entry.version, entry.last_updated), (version, 300))
+        self.assertEqual(self.backend.sync_state(), (300, 100))
+
+    def test_full_refresh_request_clears_sync_state(self):
+        self.backend.put({"records": []}, 100)
+        in_flight_started_at = time.time() - 1
+        self.backend.request_full_refresh()
+        self.assertEqual(self.backend.sync_state(), (0, 0))
+        self.assertEqual(self.backend.get().last_updated, 0)
+
+        # A refresh that started before the request doesn't bring the watermarks back
+        self.backend.put({"records": []}, in_flight_started_at, reconciled=False)
+        self.backend.touch(in_flight_started_at, reconciled=True)
+        self.assertEqual(self.backend.sync_state(), (0, 0))
+
+        started_at = time.time() + 1
+        self.backend.put({"records": []}, started_at)
+        self.assertEqual(self.backend.sync_state(), (started_at, started_at))
+
+    def test_refresh_lease_is_exclusive(self):
+        lease = self.backend.begin_refresh(60)
+        self.assertTrue(lease)
+        self.assertTrue(self.backend.is_refreshing())
+        self.assertFalse(self.backend.begin_refresh(60))
+        self.backend.end_refresh(lease)
+        self.assertTrue(self.backend.begin_refresh(60))
+
+    def test_expired_lease_holder_cannot_release_the_next_lease(self):
+        expired = self.backend.begin_refresh(-1)
+        current = self.backend.begin_refresh(60)
+        self.assertTrue(current)
+        self.backend.end_refresh(expired)
+        self.assertTrue(self.backend.is_refreshing())
+        self.backend.end_refresh(current)
+        self.assertFalse(self.backend.is_refreshing())
+
+
+class TestSpliceRecords(unittest.TestCase):
+
+    def test_splice_matches_full_serialization(self):
+        data = {"records": [{"id": f"rec{i}", "fields": {"Title": f"Négocio {i}"}} for i in range(5)]}
+        body, spans = serialize_snapshot(data)
+        writes = [
+            ([{"id": "rec2", "fields": {"Title": "Renamed"}}, {"id": "rec9"}], ["rec0", "rec4"]),
+            ([], ["rec9"]),
+            ([{"id": "rec7"}], []),
+        ]
+        for upserts, deletes in writes:
+            body, spans = splice_records(body, spans, upserts, deletes)
+            data = apply_changes(data, upserts, deletes)
+            self.assertEqual((body, spans), serialize_snapshot(data))
+
+    def test_splice_into_empty_snapshot(self):
+        body, spans = splice_records(*serialize_snapshot({"records": []}), upserts=[{"id": "rec1"}])
+        self.assertEqual(body, b'{"records":[{"id":"rec1"}]}')
+
+
+class TestMemoryCacheBackend(BackendContract, unittest.TestCase):
+
+    def make_backend(self):
+        return MemoryCacheBackend()
+
+
+class TestSQLiteCacheBackend(BackendContract, unittest.TestCase):
+
+    def make_backend(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'cache.sqlite')
+        return SQLiteCacheBackend(self.path)
+
+    def test_second_worker_sees_refresh_and_invalidation(self):
+        other_worker = SQLiteCacheBackend(self.path)
+        self.backend.put({"records": [{"id": "rec1"}]}, time.time())
+        self.assertEqual(other_worker.get().data, {"records": [{"id": "rec1"}]})
+
+        other_worker.invalidate()
+        self.assertEqual(self.backend.get().last_updated, 0)
+
+        other_worker.apply(upserts=[{"id": "rec2"}])
+        self.assertTrue(wait_for(lambda: 'gzip' in self.backend.get().encoded))
+
+        self.assertTrue(other_worker.begin_refresh(60))
+        self.assertFalse(self.backend.begin_refresh(60))
+
+    def test_table_from_an_older_version_is_migrated(self):
+        path = os.path.join(self.tmpdir.name, 'old.sqlite')
+        conn = sqlite3.connect(path)
+        conn.execute("""CREATE TABLE cache_entries (
+            key TEXT PRIMARY KEY, body BLOB, last_updated REAL NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0, refresh_until REAL NOT NULL DEFAULT 0)""")
+        conn.execute("""INSERT INTO cache_entries (key, body, version) VALUES ('directory', '{"records":[]}', 3)""")
+        conn.commit()
+        conn.close()
+
+        backend = SQLiteCacheBackend(path)
+        self.assertEqual(backend.get().data, {"records": []})
+        self.assertEqual(backend.sync_state(), (0, 0))
+        backend.put({"records": [{"id": "rec1"}]}, time.time())
+        self.assertEqual(backend.get().version, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+from directory_index import DirectoryIndex
+
+
+def record(record_id, title, category, subtitle=None):
+    fields = {"Title": title, "Category": category}
+    if subtitle:
+        fields["Subtitle"] = subtitle
+    return {"id": record_id, "fields": fields}
+
+
+class TestDirectoryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = DirectoryIndex()
+        self.index.sync([
+            record("rec1", "Soda La Esquina", ["Food"], "Casados y café"),
+            record("rec2", "Playa Tours", ["Tours"]),
+            record("rec3", "Café Montaña", ["Food", "Coffee"]),
+            record("rec4", "Auto Repair", ["Services"]),
+        ], version=1)
+
+    def ids(self, result):
+        return [r["id"] for r in result["records"]]
+
+    def test_prefix_search_ignores_accents_and_case(self):
+        self.assertEqual(self.ids(self.index.query(q="CAFE")), ["rec3", "rec1"])
+        self.assertEqual(self.ids(self.index.query(q="mont")), ["rec3"])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.ids(self.index.query(q="cafe casados")), ["rec1"])
+
+    def test_category_filter_combines_with_search(self):
+        self.assertEqual(self.ids(self.index.query(category="food")), ["rec3", "rec1"])
+        self.assertEqual(self.ids(self.index.query(q="soda", category="Coffee")), [])
+
+    def test_cursor_pages_through_results_in_title_order(self):
+        first = self.index.query(limit=3)
+        self.assertEqual(self.ids(first), ["rec4", "rec3", "rec2"])
+        self.assertEqual(first["total"], 4)
+        second = self.index.query(limit=3, cursor=first["next_cursor"])
+        self.assertEqual(self.ids(second), ["rec1"])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_sync_applies_changes_and_removals(self):
+        self.index.sync([
+            record("rec1", "Soda La Esquina", ["Food"], "Casados y café"),
+            record("rec2", "Playa Surf School", ["Tours"]),
+            record("rec5", "Surf Shop", ["Shops"]),
+        ], version=2)
+        self.assertEqual(self.ids(self.index.query(q="surf")), ["rec2", "rec5"])
+        self.assertEqual(self.ids(self.index.query(q="montana")), [])
+        self.assertEqual(self.ids(self.index.query(category="services")), [])
+
+    def test_invalid_cursor_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.index.query(cursor="not-a-cursor")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date
+import holiday_calendar
+from holiday_calendar import HolidayCalendar, easter_sunday, fallback_holidays
+
+HOLIDAYS = {
+    2024: [
+        {"date": "2024-01-01", "name": "New Year's Day"},
+        {"date": "2024-03-28", "name": "Maundy Thursday"},
+        {"date": "2024-09-15", "name": "Independence Day"},
+        {"date": "2024-09-15", "name": "Independence Day (observed)"},
+    ],
+    2025: [
+        {"date": "2025-01-01", "name": "New Year's Day"},
+    ],
+}
+
+
+class TestHolidayCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'holidays.sqlite')
+        self.fetched = []
+
+    def fetch(self, year, api_key, country):
+        self.fetched.append((year, api_key, country))
+        return HOLIDAYS[year]
+
+    def failing_fetch(self, year, api_key, country):
+        self.fetched.append((year, api_key, country))
+        raise holiday_calendar.HolidayFetchError("abstractapi returned 429")
+
+    def test_a_year_is_fetched_once_and_persisted(self):
+        calendar = HolidayCalendar(self.path, fetch=self.fetch)
+        self.assertEqual(calendar.holiday(date(2024, 1, 1), "key"), "New Year's Day")
+        self.assertEqual(calendar.holiday(date(2024, 9, 15), "key"), "Independence Day")
+        self.assertIsNone(calendar.holiday(date(2024, 9, 16), "key"))
+        self.assertEqual(self.fetched, [(2024, "key", "CR")])
+
+        offline = HolidayCalendar(self.path, fetch=self.failing_fetch)
+        self.assertEqual(offline.holiday(date(2024, 3, 28), "key"), "Maundy Thursday")
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_falls_back_to_fixed_holidays_and_backs_off(self):
+        calendar = HolidayCalendar(self.path, fetch=self.failing_fetch)
+        self.assertEqual(calendar.holiday(date(2024, 7, 25), "key"), "Guanacaste Day")
+        self.assertIsNone(calendar.holiday(date(2024, 7, 26), "key"))
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_stale_years_are_refreshed_in_the_background(self):
+        calendar = HolidayCalendar(self.path, fetch=self.fetch)
+        calendar.holiday(date(2024, 1, 1), "key")
+        by_date, _ = calendar._years[2024]
+        calendar._years[2024] = (by_date, time.time() - holiday_calendar.REFRESH_INTERVAL - 1)
+
+        self.assertEqual(calendar.holiday(date(2024, 1, 1), "key"), "New Year's Day")
+        deadline = time.time() + 2
+        while len(self.fetched) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_an_empty_year_is_a_fetch_error(self):
+        calendar = HolidayCalendar(self.path, fetch=lambda year, api_key, country: [])
+        self.assertEqual(calendar.holiday(date(2024, 9, 15), "key"), "Independence Day")
+        self.assertNotIn(2024, calendar._years)
+        self.assertIn(2024, calendar._failed_at)
+
+    def test_lookups_do_not_wait_for_a_fetch(self):
+        release = threading.Event()
+
+        def slow_fetch(year, api_key, country):
+            if year == 2025:
+                release.wait(5)
+            return HOLIDAYS[year]
+
+        calendar = HolidayCalendar(self.path, fetch=slow_fetch)
+        self.addCleanup(release.set)
+        calendar.year(2024, "key")
+        calendar.holiday(date(2024, 12, 20), "key")  # starts loading 2025 in the background
+
+        lookup = threading.Thread(target=calendar.holiday, args=(date(2024, 12, 25), "key"), daemon=True)
+        lookup.start()
+        lookup.join(1)
+        self.assertFalse(lookup.is_alive())
+
+        release.set()
+        deadline = time.time() + 2
+        while 2025 not in calendar._years and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn(2025, calendar._years)
+
+    def test_next_year_is_loaded_in_december(self):
+        calendar = HolidayCalendar(self.path, fetch=self.fetch)
+        calendar.holiday(date(2024, 12, 20), "key")
+        deadline = time.time() + 2
+        while 2025 not in calendar._years and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIn(2025, calendar._years)
+
+
+class TestFallbackHolidays(unittest.TestCase):
+
+    def test_easter(self):
+        self.assertEqual(easter_sunday(2024), date(2024, 3, 31))
+        self.assertEqual(easter_sunday(2025), date(2025, 4, 20))
+        self.assertEqual(easter_sunday(2019), date(2019, 4, 21))
+
+    def test_fallback_table(self):
+        holidays = fallback_holidays(2025)
+        self.assertEqual(holidays[date(2025, 9, 15)], "Independence Day")
+        self.assertEqual(holidays[date(2025, 4, 17)], "Holy Thursday")
+        self.assertEqual(holidays[date(2025, 4, 18)], "Good Friday")
+        self.assertEqual(len(holidays), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from unittest import mock
+import requests
+import http_client
+import metrics
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class ScriptedSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class TestHttpClient(unittest.TestCase):
+
+    def send(self, method, outcomes):
+        fake = ScriptedSession(outcomes)
+        with mock.patch.object(http_client, "session", return_value=fake), \
+                mock.patch.object(http_client.time, "sleep") as sleep:
+            response = http_client.request(method, "https://api.example.test/x")
+        return response, fake, sleep
+
+    def test_get_retries_5xx_then_succeeds(self):
+        response, fake, sleep = self.send("GET", [FakeResponse(503), FakeResponse(502), FakeResponse(200)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(fake.calls), 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertGreaterEqual(metrics.get_counter("http.api.example.test.retries"), 2)
+
+    def test_default_timeout_is_applied(self):
+        _, fake, _ = self.send("GET", [FakeResponse(200)])
+        self.assertEqual(fake.calls[0][1]["timeout"], http_client.DEFAULT_TIMEOUT)
+
+    def test_post_is_not_retried_on_5xx(self):
+        response, fake, _ = self.send("POST", [FakeResponse(500), FakeResponse(200)])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(len(fake.calls), 1)
+
+    def test_429_is_retried_for_post_honouring_retry_after(self):
+        response, fake, sleep = self.send("POST", [FakeResponse(429, {"Retry-After": "2"}), FakeResponse(200)])
+        self.assertEqual(response.status_code, 200)
+        sleep.assert_called_once_with(2.0)
+
+    def test_gives_up_after_max_retries(self):
+        outcomes = [requests.exceptions.ConnectionError("reset")] * (http_client.MAX_RETRIES + 1)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            self.send("GET", outcomes)
+
+    def test_post_read_timeout_is_not_retried(self):
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            self.send("POST", [requests.exceptions.ReadTimeout("slow"), FakeResponse(200)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from job_queue import JobQueue, JobWorkerPool, QueueFull, complete_current_job
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'jobs.sqlite')
+        self.queue = JobQueue(self.path, max_depth=2, max_attempts=2, retry_backoff=0)
+
+    def test_jobs_are_claimed_in_order(self):
+        self.queue.enqueue("message_receive", {"n": 1})
+        self.queue.enqueue("message_receive", {"n": 2})
+        first = self.queue.claim(60)
+        second = self.queue.claim(60)
+        self.assertEqual((first[2], second[2]), ({"n": 1}, {"n": 2}))
+        self.assertIsNone(self.queue.claim(60))
+
+    def test_jobs_with_the_same_ordering_key_run_one_at_a_time(self):
+        queue = JobQueue(self.path, max_depth=10)
+        queue.enqueue("message_receive", {"n": 1}, ordering_key="chat_a")
+        queue.enqueue("message_receive", {"n": 2}, ordering_key="chat_a")
+        queue.enqueue("message_receive", {"n": 3}, ordering_key="chat_b")
+
+        first = queue.claim(60)
+        other_chat = queue.claim(60)
+        self.assertEqual((first[2], other_chat[2]), ({"n": 1}, {"n": 3}))
+        self.assertIsNone(queue.claim(60))
+
+        queue.complete(first[0])
+        self.assertEqual(queue.claim(60)[2], {"n": 2})
+
+    def test_queue_file_without_ordering_keys_is_migrated(self):
+        path = os.path.join(self.tmpdir.name, 'old.sqlite')
+        conn = sqlite3.connect(path)
+        conn.executescript(JobQueue.schema.replace(",\n        ordering_key TEXT", ""))
+        conn.execute("INSERT INTO jobs (kind, payload, enqueued_at) VALUES ('message_receive', '{}', 0)")
+        conn.commit()
+        conn.close()
+
+        queue = JobQueue(path)
+        queue.enqueue("message_receive", {"n": 1}, ordering_key="chat_a")
+        self.assertEqual(queue.claim(60)[2], {})
+
+    def test_full_queue_rejects_new_jobs(self):
+        self.queue.enqueue("message_receive", {})
+        self.queue.enqueue("message_receive", {})
+        with self.assertRaises(QueueFull):
+            self.queue.enqueue("message_receive", {})
+
+    def test_job_survives_a_crashed_worker(self):
+        self.queue.enqueue("message_receive", {"n": 1})
+        self.queue.claim(-1)  # lease already expired, as if the worker died
+
+        restarted = JobQueue(self.path)
+        job_id, kind, payload, attempts, _ = restarted.claim(60)
+        self.assertEqual((payload, attempts), ({"n": 1}, 2))
+        restarted.complete(job_id)
+        self.assertEqual(restarted.depth(), 0)
+
+    def test_failed_job_is_retried_then_dropped(self):
+        self.queue.enqueue("message_receive", {})
+        job_id, _, _, attempts, _ = self.queue.claim(60)
+        self.assertTrue(self.queue.fail(job_id, attempts))
+        job_id, _, _, attempts, _ = self.queue.claim(60)
+        self.assertFalse(self.queue.fail(job_id, attempts))
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_retries_back_off(self):
+        queue = JobQueue(self.path, max_attempts=3, retry_backoff=0.2)
+        queue.enqueue("message_receive", {}, ordering_key="chat_a")
+        queue.enqueue("message_receive", {"n": 2}, ordering_key="chat_a")
+        job_id, _, _, attempts, _ = queue.claim(60)
+        queue.fail(job_id, attempts)
+
+        # Neither the failed job nor the next one in its conversation runs before the delay
+        self.assertIsNone(queue.claim(60))
+        time.sleep(0.25)
+        job_id, _, _, attempts, _ = queue.claim(60)
+        self.assertEqual(attempts, 2)
+
+        queue.fail(job_id, attempts)
+        time.sleep(0.25)
+        self.assertIsNone(queue.claim(60))
+        time.sleep(0.2)
+        self.assertEqual(queue.claim(60)[3], 3)
+
+    def test_running_jobs_keep_their_lease(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def slow(payload):
+            started.set()
+            release.wait(5)
+
+        pool = JobWorkerPool(self.queue, {"slow": slow}, workers=1, lease_seconds=0.3, poll_interval=0.05)
+        pool.submit("slow", {})
+        self.assertTrue(started.wait(5))
+        time.sleep(0.6)
+        self.assertIsNone(JobQueue(self.path).claim(60))
+        release.set()
+
+    def test_job_completed_by_its_handler_is_not_retried(self):
+        calls = []
+        done = threading.Event()
+
+        def reply_then_fail(payload):
+            calls.append(payload)
+            complete_current_job()
+            done.set()
+            raise RuntimeError("failed after sending")
+
+        pool = JobWorkerPool(self.queue, {"reply": reply_then_fail}, workers=1, poll_interval=0.05)
+        pool.submit("reply", {})
+        self.assertTrue(done.wait(5))
+        time.sleep(0.2)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_complete_current_job_outside_a_job_does_nothing(self):
+        complete_current_job()
+
+    def test_worker_pool_runs_submitted_jobs(self):
+        done = threading.Event()
+        pool = JobWorkerPool(self.queue, {"echo": lambda payload: done.set()}, workers=1, poll_interval=0.05)
+        pool.submit("echo", {})
+        self.assertTrue(done.wait(5))
+
+if __name__ == '__main__':
+    unittest.main()
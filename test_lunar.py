@@ -0,0 +1,55 @@
+import unittest
+from datetime import date, datetime, timedelta
+import lunar
+
+# 2024 new and full moons as published by the moon-data API (USNO times, UTC)
+MOON_DATA_2024 = [
+    {"Date": "2024-01-11T11:57:00", "Phase": 0}, {"Date": "2024-01-25T17:54:00", "Phase": 2},
+    {"Date": "2024-02-09T22:59:00", "Phase": 0}, {"Date": "2024-02-24T12:30:00", "Phase": 2},
+    {"Date": "2024-03-10T09:00:00", "Phase": 0}, {"Date": "2024-03-25T07:00:00", "Phase": 2},
+    {"Date": "2024-04-08T18:21:00", "Phase": 0}, {"Date": "2024-04-23T23:49:00", "Phase": 2},
+    {"Date": "2024-05-08T03:22:00", "Phase": 0}, {"Date": "2024-05-23T13:53:00", "Phase": 2},
+    {"Date": "2024-06-06T12:38:00", "Phase": 0}, {"Date": "2024-06-22T01:08:00", "Phase": 2},
+    {"Date": "2024-07-05T22:57:00", "Phase": 0}, {"Date": "2024-07-21T10:17:00", "Phase": 2},
+    {"Date": "2024-08-04T11:13:00", "Phase": 0}, {"Date": "2024-08-19T18:26:00", "Phase": 2},
+    {"Date": "2024-09-03T01:55:00", "Phase": 0}, {"Date": "2024-09-18T02:34:00", "Phase": 2},
+    {"Date": "2024-10-02T18:49:00", "Phase": 0}, {"Date": "2024-10-17T11:26:00", "Phase": 2},
+    {"Date": "2024-11-01T12:47:00", "Phase": 0}, {"Date": "2024-11-15T21:28:00", "Phase": 2},
+    {"Date": "2024-12-01T06:21:00", "Phase": 0}, {"Date": "2024-12-15T09:02:00", "Phase": 2},
+    {"Date": "2024-12-30T22:27:00", "Phase": 0},
+]
+
+
+class TestLunar(unittest.TestCase):
+
+    def test_meeus_example_49a(self):
+        # New moon of 1977 February 18, 3h37m42s TD
+        self.assertAlmostEqual(lunar.phase_jde(-283), 2443192.65118, places=4)
+
+    def test_matches_moon_data_within_two_minutes(self):
+        computed = {}
+        for entry in lunar.year_phases(2024):
+            computed.setdefault(entry["Phase"], []).append(datetime.fromisoformat(entry["Date"]))
+
+        for entry in MOON_DATA_2024:
+            expected = datetime.fromisoformat(entry["Date"])
+            closest = min(computed[entry["Phase"]], key=lambda moment: abs(moment - expected))
+            self.assertLess(abs(closest - expected), timedelta(minutes=2), entry)
+
+    def test_year_has_every_quarter(self):
+        phases = [entry["Phase"] for entry in lunar.year_phases(2024)]
+        self.assertEqual(len(phases), 50)
+        self.assertEqual(phases.count(lunar.FULL_MOON), 12)
+
+    def test_is_full_moon(self):
+        self.assertTrue(lunar.is_full_moon(date(2024, 1, 25)))
+        self.assertFalse(lunar.is_full_moon(date(2024, 1, 24)))
+        self.assertFalse(lunar.is_full_moon(date(2024, 1, 26)))
+        self.assertTrue(lunar.is_full_moon(date(2024, 12, 15)))
+
+    def test_next_full_moon(self):
+        self.assertEqual(lunar.next_full_moon(datetime(2024, 12, 15, 9, 30)).date(), date(2025, 1, 13))
+        self.assertEqual(lunar.next_full_moon(datetime(2024, 4, 1)).date(), date(2024, 4, 23))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import time
+import unittest
+from message_dedup import SeenMessages
+
+
+class TestSeenMessages(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'seen.sqlite')
+
+    def test_duplicate_is_detected_across_workers(self):
+        worker_a = SeenMessages(self.path)
+        worker_b = SeenMessages(self.path)
+        self.assertTrue(worker_a.first_sighting("chat:3EB0"))
+        self.assertFalse(worker_b.first_sighting("chat:3EB0"))
+        self.assertTrue(worker_b.first_sighting("chat:3EB1"))
+
+    def test_expired_id_counts_as_new(self):
+        seen = SeenMessages(self.path, ttl=0.05)
+        self.assertTrue(seen.first_sighting("chat:3EB0"))
+        time.sleep(0.1)
+        self.assertTrue(seen.first_sighting("chat:3EB0"))
+
+    def test_forget_allows_redelivery(self):
+        seen = SeenMessages(self.path)
+        seen.first_sighting("chat:3EB0")
+        seen.forget("chat:3EB0")
+        self.assertTrue(seen.first_sighting("chat:3EB0"))
+
+    def test_prune_keeps_store_bounded(self):
+        seen = SeenMessages(self.path, max_entries=3)
+        for n in range(5):
+            seen.first_sighting(f"chat:{n}")
+        seen.prune()
+        count, = seen.connection().execute("SELECT COUNT(*) FROM seen_messages").fetchone()
+        self.assertEqual(count, 3)
+        self.assertTrue(seen.first_sighting("chat:0"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import time
+import unittest
+from datetime import date, datetime
+from moon_phases import MoonPhaseCalendar
+
+PHASES = {
+    2024: [
+        {"Date": "2024-01-11T11:57:00", "Phase": 0},
+        {"Date": "2024-01-25T17:54:00", "Phase": 2},
+        {"Date": "2024-11-15T21:28:00", "Phase": 2},
+        {"Date": "2024-12-15T09:02:00", "Phase": 2},
+        {"Date": "2024-12-30T22:27:00", "Phase": 0},
+    ],
+    2025: [
+        {"Date": "2025-01-13T22:27:00", "Phase": 2},
+    ],
+}
+
+
+class TestMoonPhaseCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'moon.sqlite')
+        self.fetched = []
+
+    def fetch(self, year):
+        self.fetched.append(year)
+        return PHASES[year]
+
+    def test_each_year_is_fetched_once_and_persisted(self):
+        calendar = MoonPhaseCalendar(self.path, self.fetch)
+        self.assertTrue(calendar.is_full_moon(date(2024, 1, 25)))
+        self.assertFalse(calendar.is_full_moon(date(2024, 1, 11)))
+        self.assertFalse(calendar.is_full_moon(date(2024, 1, 26)))
+        self.assertEqual(self.fetched, [2024])
+
+        offline = MoonPhaseCalendar(self.path, fetch=None)
+        self.assertTrue(offline.is_full_moon(date(2024, 11, 15)))
+
+    def test_next_full_moon_crosses_the_year_boundary(self):
+        calendar = MoonPhaseCalendar(self.path, self.fetch)
+        self.assertEqual(calendar.next_full_moon(datetime(2024, 1, 26)), datetime(2024, 11, 15, 21, 28))
+        self.assertEqual(calendar.next_full_moon(datetime(2024, 12, 15, 9, 2)), datetime(2025, 1, 13, 22, 27))
+
+    def test_next_year_is_prefetched_in_december(self):
+        calendar = MoonPhaseCalendar(self.path, self.fetch)
+        calendar.is_full_moon(date(2024, 11, 30))
+        self.assertEqual(self.fetched, [2024])
+
+        calendar.is_full_moon(date(2024, 12, 1))
+        for _ in range(100):
+            if 2025 in self.fetched:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.fetched), [2024, 2025])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import time
+import unittest
+from flask import Flask, current_app
+from morning_message import gather_sections
+
+
+class TestGatherSections(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['ABSTRACT_API_KEY'] = 'key'
+        context = self.app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    def test_sections_run_concurrently_and_slow_ones_are_left_out(self):
+        def slow(seconds, value):
+            def provider():
+                time.sleep(seconds)
+                return value
+            return provider
+
+        def broken():
+            raise ValueError("provider down")
+
+        start = time.monotonic()
+        results, timings_ms = gather_sections(
+            {"quote": slow(0.2, "quote"), "holiday": slow(0.2, "holiday"), "rain": slow(5, 3), "moon": broken},
+            deadlines={"quote": 1, "holiday": 1, "rain": 0.5, "moon": 1},
+        )
+
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(results, {"quote": "quote", "holiday": "holiday", "rain": None, "moon": None})
+        self.assertEqual(timings_ms["rain"], "timeout")
+        self.assertGreaterEqual(timings_ms["quote"], 200)
+
+    def test_providers_run_inside_the_app_context(self):
+        results, _ = gather_sections({"holiday": lambda: current_app.config['ABSTRACT_API_KEY']})
+        self.assertEqual(results, {"holiday": "key"})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import openai_registry
+
+
+class FakeAssistants:
+    def __init__(self):
+        self.retrieves = 0
+        self.fail = False
+
+    def retrieve(self, assistant_id):
+        self.retrieves += 1
+        if self.fail:
+            raise ConnectionError("OpenAI unavailable")
+        return SimpleNamespace(id=assistant_id, version=self.retrieves)
+
+
+class TestOpenAIRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.assistants = FakeAssistants()
+        self.client = SimpleNamespace(beta=SimpleNamespace(assistants=self.assistants))
+        openai_registry._assistants.clear()
+
+    @mock.patch.object(openai_registry, "OpenAI", lambda api_key: SimpleNamespace(api_key=api_key))
+    def test_client_is_shared(self):
+        openai_registry._clients.clear()
+        self.assertIs(openai_registry.get_client("sk-test"), openai_registry.get_client("sk-test"))
+        self.assertIsNot(openai_registry.get_client("sk-test"), openai_registry.get_client("sk-other"))
+
+    def test_assistant_is_retrieved_once_per_ttl(self):
+        for _ in range(3):
+            self.assertEqual(openai_registry.get_assistant(self.client, "asst_1").id, "asst_1")
+        self.assertEqual(self.assistants.retrieves, 1)
+
+        self.assertEqual(openai_registry.get_assistant(self.client, "asst_1", ttl=0).version, 2)
+
+    def test_stale_assistant_kept_when_refresh_fails(self):
+        openai_registry.get_assistant(self.client, "asst_1")
+        self.assistants.fail = True
+        self.assertEqual(openai_registry.get_assistant(self.client, "asst_1", ttl=0).version, 1)
+
+        with self.assertRaises(ConnectionError):
+            openai_registry.get_assistant(self.client, "asst_2")
+
+if __name__ == '__main__':
+    unittest.main()
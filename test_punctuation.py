@@ -0,0 +1,96 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+import message_receive
+import punctuation
+from audio_message_harness import audio_payload, handling_audio
+from transcript_cache import TranscriptCache, RAW, PUNCTUATED
+from punctuation import PunctuationBackend, OpenAIPunctuation, NoPunctuation, create_punctuation_backend
+
+
+class FakeBackend(PunctuationBackend):
+    name = "fake"
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = []
+
+    def punctuate(self, text, api_key, timeout):
+        self.calls.append((text, timeout))
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class TestPunctuate(unittest.TestCase):
+
+    def use_backend(self, backend):
+        patcher = mock.patch.object(punctuation, "_backend", backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return backend
+
+    def test_calls_backend_within_budget(self):
+        backend = self.use_backend(FakeBackend(result="Hola, ¿cómo estás?"))
+        self.assertEqual(punctuation.punctuate("hola como estas", "sk-test", budget=5), ("Hola, ¿cómo estás?", True))
+        self.assertEqual(backend.calls, [("hola como estas", 5)])
+
+    def test_skipped_when_already_punctuated(self):
+        backend = self.use_backend(FakeBackend(result="unused"))
+        self.assertEqual(punctuation.punctuate("Hello there.", already_punctuated=True), ("Hello there.", True))
+        self.assertEqual(punctuation.punctuate("   "), ("   ", True))
+        self.assertEqual(backend.calls, [])
+
+    def test_raw_transcript_returned_on_failure(self):
+        self.use_backend(FakeBackend(error=TimeoutError("budget exceeded")))
+        self.assertEqual(punctuation.punctuate("hola como estas"), ("hola como estas", False))
+
+    def test_empty_result_is_a_failure(self):
+        self.use_backend(FakeBackend(result=""))
+        self.assertEqual(punctuation.punctuate("hola como estas"), ("hola como estas", False))
+
+    def test_failed_punctuation_is_not_cached(self):
+        backend = self.use_backend(FakeBackend(error=TimeoutError("budget exceeded")))
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        cache = TranscriptCache(os.path.join(tmpdir.name, 'transcripts.sqlite'))
+        audio = b"voice note"
+        audio_data = audio_payload(audio)
+        audio_hash = hashlib.sha256(audio).hexdigest()
+
+        with handling_audio(audio, cache, transcribe_audio=mock.Mock(return_value="hola como estas"),
+                            transcription_backend=mock.Mock(return_value=SimpleNamespace(punctuated=False))):
+            self.assertEqual(message_receive.handle_audio_message(audio_data), "hola como estas")
+            self.assertEqual(cache.get(audio_hash, RAW), "hola como estas")
+            self.assertIsNone(cache.get(audio_hash, PUNCTUATED))
+
+            backend.error, backend.result = None, "Hola, ¿cómo estás?"
+            self.assertEqual(message_receive.handle_audio_message(audio_data), "Hola, ¿cómo estás?")
+            self.assertEqual(cache.get(audio_hash, PUNCTUATED), "Hola, ¿cómo estás?")
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_openai_makes_one_stateless_completion(self):
+        create = mock.Mock(return_value=SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=" Hola, amigo. "))]))
+        client = mock.Mock()
+        client.with_options.return_value.chat.completions.create = create
+
+        with mock.patch.object(punctuation.openai_registry, "get_client", return_value=client):
+            self.assertEqual(OpenAIPunctuation("gpt-4o-mini").punctuate("hola amigo", "sk-test", 3), "Hola, amigo.")
+        client.with_options.assert_called_once_with(timeout=3, max_retries=0)
+        self.assertEqual(create.call_args.kwargs["messages"][-1], {"role": "user", "content": "hola amigo"})
+
+    @mock.patch.object(punctuation, "PunctuationModel", None)
+    def test_backend_selection(self):
+        self.assertIsInstance(create_punctuation_backend(), OpenAIPunctuation)
+        self.assertIsInstance(create_punctuation_backend("local"), OpenAIPunctuation)
+        self.assertIsInstance(create_punctuation_backend("none"), NoPunctuation)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import time
+import unittest
+from quote_pool import QuotePool
+
+
+class TestQuotePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'quotes.sqlite')
+        self.batches = []
+
+    def fetch(self):
+        self.batches.append(time.time())
+        return [(f"Quote {i}", "Author") for i in range(5)]
+
+    def wait_for_batches(self, count):
+        deadline = time.time() + 2
+        while len(self.batches) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_add_deduplicates(self):
+        pool = QuotePool(self.path, fetch=self.fetch)
+        self.assertEqual(pool.add([("A", "x"), ("B", "y"), ("A", "x")]), 2)
+        self.assertEqual(pool.add([("A", "x"), ("C", "z")]), 1)
+        self.assertEqual(pool.available(), 3)
+
+    def test_quotes_are_not_repeated_within_the_window(self):
+        pool = QuotePool(self.path, fetch=lambda: [], low_watermark=0)
+        pool.add([("A", "x"), ("B", "y")])
+        taken = {pool.take(), pool.take()}
+        self.assertEqual(taken, {("A", "x"), ("B", "y")})
+        self.assertIsNone(pool.take())
+
+        expired = QuotePool(self.path, fetch=lambda: [], low_watermark=0, recent_window=0)
+        self.assertIn(expired.take(), taken)
+
+    def test_least_recently_used_quote_comes_back_first(self):
+        pool = QuotePool(self.path, fetch=lambda: [], low_watermark=0, recent_window=0)
+        pool.add([("A", "x"), ("B", "y"), ("C", "z")])
+        pool.connection().executemany(
+            "UPDATE quotes SET used_at = ? WHERE text = ?", [(300, "A"), (100, "B"), (200, "C")])
+        self.assertEqual([pool.take() for _ in range(3)], [("B", "y"), ("C", "z"), ("A", "x")])
+
+    def test_empty_pool_fetches_once_then_refills_in_the_background(self):
+        pool = QuotePool(self.path, fetch=self.fetch, low_watermark=5)
+        self.assertEqual(pool.take()[1], "Author")
+        self.wait_for_batches(2)
+        self.assertEqual(len(self.batches), 2)
+
+        # The second batch is all duplicates, so it adds nothing
+        self.assertEqual(pool.available(), 4)
+
+    def test_no_refill_above_the_watermark(self):
+        pool = QuotePool(self.path, fetch=self.fetch, low_watermark=2)
+        pool.add([(f"Q{i}", "a") for i in range(10)])
+        pool.take()
+        time.sleep(0.05)
+        self.assertEqual(self.batches, [])
+
+    def test_fetch_errors_leave_the_pool_usable(self):
+        def broken():
+            raise Exception("429")
+        pool = QuotePool(self.path, fetch=broken, low_watermark=0)
+        self.assertIsNone(pool.take())
+        pool.add([("A", "x")])
+        self.assertEqual(pool.take(), ("A", "x"))
+
+
+if __name__ == '__main__':
+    unittest.main()
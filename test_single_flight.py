@@ -0,0 +1,45 @@
+import threading
+import time
+import unittest
+import metrics
+from single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_burst_of_callers_runs_once(self):
+        flight = SingleFlight("test_burst")
+        calls = []
+        release = threading.Event()
+
+        def slow_fetch():
+            calls.append(1)
+            release.wait(5)
+            return "snapshot"
+
+        futures = [flight.submit("directory", slow_fetch) for _ in range(20)]
+        release.set()
+
+        self.assertEqual({f.result(timeout=5) for f in futures}, {"snapshot"})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(metrics.get_counter("test_burst.started"), 1)
+        self.assertEqual(metrics.get_counter("test_burst.coalesced"), 19)
+
+    def test_new_flight_after_previous_finishes(self):
+        flight = SingleFlight("test_sequential")
+        flight.submit("directory", lambda: 1).result(timeout=5)
+        while flight.in_flight("directory"):
+            time.sleep(0.01)
+        self.assertEqual(flight.submit("directory", lambda: 2).result(timeout=5), 2)
+
+    def test_exception_reaches_every_waiter(self):
+        flight = SingleFlight("test_error")
+
+        def failing_fetch():
+            raise RuntimeError("airtable down")
+
+        with self.assertRaises(RuntimeError):
+            flight.submit("directory", failing_fetch).result(timeout=5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shelve
+import tempfile
+import threading
+import unittest
+from thread_store import ThreadStore
+from migrate_threads_db import migrate
+
+
+class TestThreadStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'threads.sqlite')
+
+    def test_get_or_create_creates_once(self):
+        store = ThreadStore(self.path)
+        calls = []
+        create = lambda: calls.append(1) or f"thread_{len(calls)}"
+
+        self.assertEqual(store.get_or_create("506111", create), ("thread_1", True))
+        self.assertEqual(store.get_or_create("506111", create), ("thread_1", False))
+        self.assertEqual(len(calls), 1)
+        # Visible to another worker's store
+        self.assertEqual(ThreadStore(self.path).get("506111"), "thread_1")
+
+    def test_concurrent_creators_agree_on_one_thread(self):
+        stores = [ThreadStore(self.path) for _ in range(4)]
+        barrier = threading.Barrier(len(stores))
+        results = []
+
+        def create(number):
+            barrier.wait()
+            return f"thread_{number}"
+
+        threads = [threading.Thread(target=lambda n=n, s=s: results.append(s.get_or_create("506111", lambda: create(n))))
+                   for n, s in enumerate(stores)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len({thread_id for thread_id, _ in results}), 1)
+        self.assertEqual(sum(created for _, created in results), 1)
+
+    def test_cache_is_bounded(self):
+        store = ThreadStore(self.path, cache_size=2)
+        for n in range(5):
+            store.put(f"wa{n}", f"thread_{n}")
+        self.assertEqual(list(store._cache), ["wa3", "wa4"])
+        self.assertEqual(store.get("wa0"), "thread_0")
+
+    def test_migrate_from_shelve(self):
+        shelve_path = os.path.join(self.tmpdir.name, 'threads_db')
+        with shelve.open(shelve_path) as threads_shelf:
+            threads_shelf["506111"] = "thread_a"
+            threads_shelf["punct_thread"] = "thread_b"
+        store = ThreadStore(self.path)
+        store.put("punct_thread", "thread_new")
+
+        self.assertEqual(migrate(shelve_path, store), (1, 1))
+        self.assertEqual(store.get("506111"), "thread_a")
+        self.assertEqual(store.get("punct_thread"), "thread_new")
+        self.assertEqual(migrate(shelve_path, store, overwrite=True), (2, 0))
+        self.assertEqual(store.get("punct_thread"), "thread_b")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+import transcribe
+from transcribe import TranscriptionBackend, ReplicateBackend, create_transcription_backend, transcribe_audio
+
+
+class RecordingBackend(TranscriptionBackend):
+    name = "recording"
+
+    def __init__(self):
+        self.inputs = []
+
+    def transcribe(self, file_input):
+        self.inputs.append(file_input.read())
+        return "hello"
+
+
+class TestTranscribeAudio(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RecordingBackend()
+        patcher = mock.patch.object(transcribe, "_backend", self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_accepts_file_like_objects_from_the_start(self):
+        audio = io.BytesIO(b"OggS audio")
+        audio.read()
+        self.assertEqual(transcribe_audio(audio), "hello")
+        self.assertEqual(self.backend.inputs, [b"OggS audio"])
+
+    def test_accepts_paths(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "voice.ogg")
+            with open(path, "wb") as file:
+                file.write(b"OggS audio")
+            self.assertEqual(transcribe_audio(path), "hello")
+            with self.assertRaises(FileNotFoundError):
+                transcribe_audio(os.path.join(tmpdir, "missing.ogg"))
+        self.assertEqual(self.backend.inputs, [b"OggS audio"])
+
+
+class TestBackendSelection(unittest.TestCase):
+
+    def test_replicate_is_the_default(self):
+        self.assertIsInstance(create_transcription_backend(), ReplicateBackend)
+        self.assertIsInstance(create_transcription_backend("whisper.cpp"), ReplicateBackend)
+
+    @mock.patch.object(transcribe, "WhisperModel", None)
+    def test_falls_back_when_faster_whisper_is_missing(self):
+        self.assertIsInstance(create_transcription_backend("faster-whisper"), ReplicateBackend)
+
+    @mock.patch.object(transcribe, "BatchedInferencePipeline", None)
+    def test_local_model_is_loaded_once(self):
+        segment = mock.Mock(text=" Hello there.")
+        model = mock.Mock()
+        model.transcribe.return_value = ([segment], None)
+        with mock.patch.object(transcribe, "WhisperModel", mock.Mock(return_value=model)) as whisper_model:
+            backend = create_transcription_backend("faster-whisper")
+            backend.warm_up()
+            self.assertEqual(backend.transcribe(io.BytesIO(b"OggS")), "Hello there.")
+            self.assertEqual(backend.transcribe(io.BytesIO(b"OggS")), "Hello there.")
+        whisper_model.assert_called_once()
+        self.assertTrue(backend.punctuated)
+
+if __name__ == '__main__':
+    unittest.main()
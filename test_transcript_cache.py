@@ -0,0 +1,64 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+import message_receive
+from audio_message_harness import audio_payload, handling_audio
+from transcript_cache import TranscriptCache, media_hash, RAW, PUNCTUATED
+
+
+class TestTranscriptCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'transcripts.sqlite')
+
+    def test_raw_and_punctuated_are_cached_separately(self):
+        cache = TranscriptCache(self.path)
+        cache.put("abc", RAW, "hola como estas")
+        self.assertEqual(cache.get("abc", RAW), "hola como estas")
+        self.assertIsNone(cache.get("abc", PUNCTUATED))
+
+        cache.put("abc", PUNCTUATED, "Hola, ¿cómo estás?")
+        self.assertEqual(TranscriptCache(self.path).get("abc", PUNCTUATED), "Hola, ¿cómo estás?")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = TranscriptCache(self.path, max_entries=2)
+        cache.put("a", RAW, "first")
+        cache.put("b", RAW, "second")
+        cache.get("a", RAW)
+        cache.put("c", RAW, "third")
+
+        self.assertEqual(cache.get("a", RAW), "first")
+        self.assertIsNone(cache.get("b", RAW))
+        self.assertEqual(cache.get("c", RAW), "third")
+
+    def test_payload_hash_matches_content_hash(self):
+        audio = b"OggS fake voice note"
+        audio_data = {'fileSHA256': base64.b64encode(hashlib.sha256(audio).digest()).decode()}
+        audio_file = io.BytesIO(audio)
+
+        self.assertEqual(media_hash(audio_data), media_hash(audio_file=audio_file))
+        self.assertEqual(audio_file.tell(), 0)
+        self.assertIsNone(media_hash({'fileSHA256': 'not base64!'}))
+
+    def test_entries_are_keyed_by_the_decrypted_audio(self):
+        cache = TranscriptCache(self.path)
+        audio, other = b"voice note", b"another voice note"
+        claimed = hashlib.sha256(other).hexdigest()
+        audio_data = audio_payload(audio, claimed=other)
+
+        with handling_audio(audio, cache, transcribe_audio=mock.Mock(return_value="hola"),
+                            punctuate=mock.Mock(return_value=("Hola.", True))):
+            self.assertEqual(message_receive.handle_audio_message(audio_data), "Hola.")
+
+        self.assertIsNone(cache.get(claimed, RAW))
+        self.assertIsNone(cache.get(claimed, PUNCTUATED))
+        self.assertEqual(cache.get(hashlib.sha256(audio).hexdigest(), PUNCTUATED), "Hola.")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from local_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadStore(SQLiteStore):
+    """Maps a WhatsApp id to its OpenAI conversation thread.
+
+    Backed by a SQLite file shared by every gunicorn worker, with a small
+    in-process LRU cache in front since a mapping never changes once made.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS threads (
+        wa_id TEXT PRIMARY KEY,
+        thread_id TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path, cache_size=1024):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        super().__init__(path)
+
+    def _remember(self, wa_id, thread_id):
+        with self._cache_lock:
+            self._cache[wa_id] = thread_id
+            self._cache.move_to_end(wa_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def get(self, wa_id):
+        with self._cache_lock:
+            thread_id = self._cache.get(wa_id)
+            if thread_id is not None:
+                self._cache.move_to_end(wa_id)
+                return thread_id
+
+        row = self.connection().execute("SELECT thread_id FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        if row is None:
+            return None
+        self._remember(wa_id, row[0])
+        return row[0]
+
+    def put(self, wa_id, thread_id):
+        self.connection().execute(
+            "INSERT OR REPLACE INTO threads (wa_id, thread_id, created_at) VALUES (?, ?, ?)",
+            (wa_id, thread_id, time.time()))
+        self._remember(wa_id, thread_id)
+
+    def get_or_create(self, wa_id, create):
+        """Return (thread_id, created), calling create() for a new thread id if wa_id has none.
+
+        create() runs outside any lock so a slow API call doesn't block other
+        workers. If two workers race, the first insert wins and both return
+        its thread id.
+        """
+        thread_id = self.get(wa_id)
+        if thread_id is not None:
+            return thread_id, False
+
+        new_thread_id = create()
+        self.connection().execute(
+            "INSERT OR IGNORE INTO threads (wa_id, thread_id, created_at) VALUES (?, ?, ?)",
+            (wa_id, new_thread_id, time.time()))
+        thread_id, = self.connection().execute(
+            "SELECT thread_id FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        if thread_id != new_thread_id:
+            logger.info(f"Another worker already created thread {thread_id} for {wa_id}, discarding {new_thread_id}")
+
+        self._remember(wa_id, thread_id)
+        return thread_id, thread_id == new_thread_id
+
+    def count(self):
+        count, = self.connection().execute("SELECT COUNT(*) FROM threads").fetchone()
+        return count
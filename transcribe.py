@@ -1,32 +1,167 @@
+import logging
 import os
+import threading
+import time
 import replicate
+import metrics
 
-def transcribe_audio(audio_file):
-    # Ensure the file exists
-    if not os.path.exists(audio_file):
-        raise FileNotFoundError(f"The file {output_file_path} does not exist.")
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
 
-    # Open the file in binary mode
-    with open(audio_file, "rb") as file_input:
+try:
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:
+    BatchedInferencePipeline = None
+
+logger = logging.getLogger(__name__)
+
+# Voice notes are translated to English, as the Replicate model was asked to
+WHISPER_TASK = "translate"
+
+
+class TranscriptionBackend:
+    """Turns a binary audio file-like object into text.
+
+    punctuated says whether the text already comes back punctuated, in
+    which case callers can skip the punctuation stage.
+    """
+    name = "base"
+    punctuated = False
+
+    def warm_up(self):
+        """Load whatever the backend needs before the first request"""
+
+    def transcribe(self, file_input):
+        raise NotImplementedError
+
+
+class ReplicateBackend(TranscriptionBackend):
+    """Hosted whisper on Replicate; nothing to load, but subject to queue times and cold boots"""
+    name = "replicate"
+
+    #This model had very long boot-up time
+    #MODEL_ID = "turian/insanely-fast-whisper-with-video:4f41e90243af171da918f04da3e526b2c247065583ea9b757f2071f573965408" ##slow queing time!!
+
+    #This model is the standard whisper model, has shortest queue time, but had longer processing time for larger messages.
+    #MODEL_ID = "openai/whisper:cdd97b257f93cb89dede1c7584e3f3dfc969571b357dbcee08e793740bedd854"
+
+    #This model is fast! But sometimes has longer queue times.
+    MODEL_ID = "vaibhavs10/incredibly-fast-whisper:3ab86df6c8f54c11309d4d1f930ac292bad43ace52d10c80d87eb258b3c9f79c"
+
+    def transcribe(self, file_input):
         input = {   "audio": file_input,
-                    "task": "translate",
+                    "task": WHISPER_TASK,
                     "language": "None",
                     "timestamp": "chunk",
                     "batch_size": 24,
                     "diarise_audio": False,
         }
+        output = replicate.run(self.MODEL_ID, input=input)
+        # Extract the transcription
+        return output.get('text') or output.get('transcription', 'No transcription found.')
 
-        #This model had very long boot-up time
-        model_id = "turian/insanely-fast-whisper-with-video:4f41e90243af171da918f04da3e526b2c247065583ea9b757f2071f573965408" ##slow queing time!!
 
-        #This model is the standard whisper model, has shortest queue time, but had longer processing time for larger messages.
-        #model_id = "openai/whisper:cdd97b257f93cb89dede1c7584e3f3dfc969571b357dbcee08e793740bedd854"
+class FasterWhisperBackend(TranscriptionBackend):
+    """Local CPU whisper through faster-whisper (CTranslate2).
 
-        #This model is fast! But sometimes has longer queue times.
-        model_id = "vaibhavs10/incredibly-fast-whisper:3ab86df6c8f54c11309d4d1f930ac292bad43ace52d10c80d87eb258b3c9f79c"
+    The model is loaded once per worker. Up to `workers` transcriptions run
+    at once on it and further requests wait their turn; each voice note's
+    speech segments are decoded in batches of `batch_size` when the
+    installed faster-whisper has BatchedInferencePipeline.
+    """
+    name = "faster-whisper"
+    punctuated = True
+
+    def __init__(self, model_size="small", compute_type="int8", workers=1, batch_size=8, cpu_threads=0):
+        if WhisperModel is None:
+            raise RuntimeError("faster-whisper is not installed (pip install faster-whisper)")
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.workers = workers
+        self.batch_size = batch_size
+        self.cpu_threads = cpu_threads
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def warm_up(self):
+        with self._load_lock:
+            if self._model is not None:
+                return
+            start = time.perf_counter()
+            self._model = WhisperModel(self.model_size, device="cpu", compute_type=self.compute_type,
+                                       cpu_threads=self.cpu_threads, num_workers=self.workers)
+            logger.info(f"Loaded whisper model '{self.model_size}' in {time.perf_counter() - start:.1f}s")
+
+    def transcribe(self, file_input):
+        self.warm_up()
+        with self._slots:
+            if BatchedInferencePipeline is not None:
+                # The pipeline keeps per-call state, so each transcription gets its own (it's a thin wrapper)
+                pipeline = BatchedInferencePipeline(model=self._model)
+                segments, _ = pipeline.transcribe(file_input, task=WHISPER_TASK, batch_size=self.batch_size)
+            else:
+                segments, _ = self._model.transcribe(file_input, task=WHISPER_TASK)
+            # segments is lazy; decoding happens while it is consumed
+            return "".join(segment.text for segment in segments).strip()
+
+
+def create_transcription_backend(kind='replicate'):
+    """Build the configured backend, falling back to Replicate"""
+    if kind == 'faster-whisper':
+        try:
+            return FasterWhisperBackend(
+                model_size=os.getenv('WHISPER_MODEL', 'small'),
+                compute_type=os.getenv('WHISPER_COMPUTE_TYPE', 'int8'),
+                workers=int(os.getenv('TRANSCRIPTION_WORKERS', 1)),
+                batch_size=int(os.getenv('WHISPER_BATCH_SIZE', 8)),
+            )
+        except RuntimeError as e:
+            logger.warning(f"Could not use local transcription, using Replicate: {str(e)}")
+    elif kind != 'replicate':
+        logger.warning(f"Unknown TRANSCRIPTION_BACKEND '{kind}', using Replicate")
+    return ReplicateBackend()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The transcription backend for this process, chosen by TRANSCRIPTION_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_transcription_backend(os.getenv('TRANSCRIPTION_BACKEND', 'replicate'))
+        return _backend
+
+
+def warm_up():
+    """Load the transcription model up front, e.g. when a gunicorn worker boots"""
+    try:
+        get_backend().warm_up()
+    except Exception as e:
+        logger.warning(f"Could not warm up transcription backend: {str(e)}")
+
+
+def transcribe_audio(audio_file):
+    """Transcribe a path or a binary file-like object (e.g. from download_and_decrypt(mode='spooled'))"""
+    if not isinstance(audio_file, (str, os.PathLike)):
+        audio_file.seek(0)
+        return _transcribe(audio_file)
+
+    # Ensure the file exists
+    if not os.path.exists(audio_file):
+        raise FileNotFoundError(f"The file {audio_file} does not exist.")
+
+    # Open the file in binary mode
+    with open(audio_file, "rb") as file_input:
+        return _transcribe(file_input)
 
-        output = replicate.run(model_id, input=input)
-        # Extract the transcription
-        transcription = output.get('text') or output.get('transcription', 'No transcription found.')
 
-        return transcription
\ No newline at end of file
+def _transcribe(file_input):
+    backend = get_backend()
+    with metrics.timed(f"transcription.{backend.name}"):
+        return backend.transcribe(file_input)
@@ -0,0 +1,78 @@
+import base64
+import binascii
+import hashlib
+import time
+from local_store import SQLiteStore
+import metrics
+
+# Kinds of text cached per voice note
+RAW = "raw"
+PUNCTUATED = "punctuated"
+
+
+def media_hash(audio_data=None, audio_file=None):
+    """Hex SHA-256 of a voice note's plaintext.
+
+    WhatsApp sends it as base64 fileSHA256 in the message, so forwarded copies
+    can be looked up before downloading anything; otherwise it is computed
+    from the decrypted file (rewound afterwards). The payload's value is only
+    a claim: entries are written under the hash of the decrypted file.
+    """
+    encoded = (audio_data or {}).get('fileSHA256')
+    if encoded:
+        try:
+            return base64.b64decode(encoded, validate=True).hex()
+        except (binascii.Error, ValueError):
+            pass
+    if audio_file is None:
+        return None
+    digest = hashlib.file_digest(audio_file, "sha256").hexdigest()
+    audio_file.seek(0)
+    return digest
+
+
+class TranscriptCache(SQLiteStore):
+    """Transcripts of voice notes keyed by the media's content hash.
+
+    Raw and punctuated text are stored separately, so a change to the
+    punctuation stage doesn't require transcribing again. The least
+    recently used entries are evicted beyond max_entries.
+    """
+    schema = """
+    CREATE TABLE IF NOT EXISTS transcripts (
+        media_hash TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        used_at REAL NOT NULL,
+        PRIMARY KEY (media_hash, kind)
+    );
+    CREATE INDEX IF NOT EXISTS transcripts_by_use ON transcripts (used_at);
+    """
+
+    def __init__(self, path, max_entries=5000):
+        self.max_entries = max_entries
+        super().__init__(path)
+
+    def get(self, media_hash, kind):
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT text FROM transcripts WHERE media_hash = ? AND kind = ?", (media_hash, kind)).fetchone()
+        if row is None:
+            metrics.incr(f"transcript_cache.{kind}.misses")
+            return None
+        conn.execute("UPDATE transcripts SET used_at = ? WHERE media_hash = ? AND kind = ?",
+                     (time.time(), media_hash, kind))
+        metrics.incr(f"transcript_cache.{kind}.hits")
+        return row[0]
+
+    def put(self, media_hash, kind, text):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO transcripts (media_hash, kind, text, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (media_hash, kind, text, now, now))
+            conn.execute(
+                """DELETE FROM transcripts WHERE rowid IN (
+                       SELECT rowid FROM transcripts ORDER BY used_at DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,))